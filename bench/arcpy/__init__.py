@@ -0,0 +1,303 @@
+import os, re, time
+from collections import Counter
+
+###################################################################################################
+###################################################################################################
+#
+# module:	arcpy (benchmark stand-in)
+# purpose:	In-memory stand-in for the parts of arcpy the connector calls. Tables live in TABLES,
+#			every tool and cursor call is counted in CALLS, and every call sleeps for the
+#			configured latency, so benchmarks can model the cost of round trips to an
+#			enterprise geodatabase without one. Only the where clauses the connector builds
+#			are understood: FIELD = value and FIELD IN (value, ...).
+#
+###################################################################################################
+
+CALLS = Counter()
+TABLES = dict()
+VIEWS = dict()
+REPLICAS = []
+#seconds slept per geoprocessing tool, per cursor opened and per row read or written
+LATENCY = {'tool': 0.0, 'cursor': 0.0, 'row': 0.0}
+#records written by ExportDataChangeMessage_management
+EXPORT_RECORDS = [0]
+#names of the tools that raise ExecuteError, to test how failures are handled
+FAILING = set()
+#undo journal of the open edit operation, see da.Editor
+_operation = [None]
+#number of da.Editor sessions that are editing, da cursors only write inside one like on versioned data
+_editing = [0]
+
+class ExecuteError(Exception):
+	pass
+
+def configure(tool = 0.0, cursor = 0.0, row = 0.0, exportRecords = 0):
+	LATENCY['tool'] = tool
+	LATENCY['cursor'] = cursor
+	LATENCY['row'] = row
+	EXPORT_RECORDS[0] = exportRecords
+
+def reset():
+	CALLS.clear()
+	TABLES.clear()
+	VIEWS.clear()
+	del REPLICAS[:]
+	FAILING.clear()
+	_operation[0] = None
+	_editing[0] = 0
+
+def _call(name, kind):
+	CALLS[name] += 1
+	if LATENCY[kind] > 0:
+		time.sleep(LATENCY[kind])
+	if name in FAILING:
+		raise ExecuteError(name + ' failed')
+
+###################################################################################################
+# Tables
+###################################################################################################
+
+class _Field(object):
+	def __init__(self, name, type):
+		self.name = name
+		self.type = type
+		self.length = 255
+
+class Table(object):
+	#name:		Unqualified table name.
+	#fields:	List of (name, type) with arcpy field types, OID and Geometry included.
+	def __init__(self, name, fields):
+		self.name = name
+		self.fields = fields
+		self.rows = dict()
+		self._nextOid = 1
+		self._indexes = dict()
+
+	def insert(self, row):
+		oid = self._nextOid
+		self._nextOid = oid + 1
+		self.rows[oid] = row
+		self._index(oid, row, True)
+		_journal(self, oid, None)
+		return oid
+
+	def update(self, oid, row):
+		old = self.rows[oid]
+		_journal(self, oid, dict(old))
+		self._index(oid, old, False)
+		self.rows[oid] = row
+		self._index(oid, row, True)
+
+	def delete(self, oid):
+		old = self.rows.pop(oid)
+		self._index(oid, old, False)
+		_journal(self, oid, old)
+
+	#Puts a row back as it was before an aborted edit operation.
+	def restore(self, oid, row):
+		if oid in self.rows:
+			self._index(oid, self.rows.pop(oid), False)
+		if row is not None:
+			self.rows[oid] = row
+			self._index(oid, row, True)
+
+	#Returns the oids that match a where clause, using an index on the where clause field.
+	def select(self, where):
+		if not where:
+			return sorted(self.rows.keys())
+		field, values = _parseWhere(where)
+		index = self._indexes.get(field)
+		if index is None:
+			index = dict()
+			for oid, row in self.rows.items():
+				index.setdefault(row.get(field), set()).add(oid)
+			self._indexes[field] = index
+		oids = set()
+		for value in values:
+			oids.update(index.get(value, ()))
+		return sorted(oids)
+
+	def _index(self, oid, row, add):
+		for field, index in self._indexes.items():
+			value = row.get(field)
+			if add:
+				index.setdefault(value, set()).add(oid)
+			elif value in index:
+				index[value].discard(oid)
+
+def _journal(table, oid, row):
+	if _operation[0] is not None:
+		_operation[0].append((table, oid, row))
+
+def createTable(name, fields, rows = ()):
+	table = Table(name, fields)
+	for row in rows:
+		table.insert(dict(row))
+	TABLES[name.lower()] = table
+	return table
+
+def _table(path):
+	if path in VIEWS:
+		return VIEWS[path]
+	name = path.replace('\\', '/').split('/')[-1].split('.')[-1].lower()
+	if not name in TABLES:
+		raise ExecuteError('Table not found: ' + path)
+	return TABLES[name]
+
+_TOKEN = re.compile(r"'(?:[^']|'')*'|[^,\s]+")
+
+def _parseWhere(where):
+	m = re.match(r'\s*"?(\w+)"?\s+IN\s+\((.*)\)\s*$', where, re.IGNORECASE)
+	if m:
+		return (m.group(1), [_parseValue(token) for token in _TOKEN.findall(m.group(2))])
+	m = re.match(r'\s*"?(\w+)"?\s*=\s*(.+?)\s*$', where)
+	if m:
+		return (m.group(1), [_parseValue(m.group(2))])
+	raise ExecuteError('Unsupported where clause: ' + where)
+
+def _parseValue(token):
+	if token.startswith("'"):
+		return token[1:-1].replace("''", "'")
+	try:
+		return int(token)
+	except ValueError:
+		return float(token)
+
+###################################################################################################
+# Geometry and rows
+###################################################################################################
+
+class Point(object):
+	def __init__(self, X = None, Y = None):
+		self.X = X
+		self.Y = Y
+
+class PointGeometry(object):
+	def __init__(self, point):
+		self.firstPoint = point
+
+class _Row(object):
+	def __init__(self, values):
+		self.__dict__['_values'] = values
+
+	def getValue(self, name):
+		return self._values.get(name)
+
+	def setValue(self, name, value):
+		self._values[name] = value
+
+	def __setattr__(self, name, value):
+		if name == 'shape':
+			self._values['SHAPE'] = (value.firstPoint.X, value.firstPoint.Y)
+		else:
+			self.__dict__[name] = value
+
+class InsertCursor(object):
+	def __init__(self, path):
+		_call('InsertCursor', 'cursor')
+		self._table = _table(path)
+
+	def newRow(self):
+		return _Row(dict())
+
+	def insertRow(self, row):
+		_call('InsertCursor.insertRow', 'row')
+		self._table.insert(dict(row._values))
+
+class UpdateCursor(object):
+	def __init__(self, path, where = None):
+		_call('UpdateCursor', 'cursor')
+		self._table = _table(path)
+		self._oids = self._table.select(where)
+		self._oid = None
+
+	def __iter__(self):
+		for oid in self._oids:
+			if not oid in self._table.rows:
+				continue
+			_call('UpdateCursor.next', 'row')
+			self._oid = oid
+			yield _Row(dict(self._table.rows[oid]))
+
+	def updateRow(self, row):
+		_call('UpdateCursor.updateRow', 'row')
+		self._table.update(self._oid, dict(row._values))
+
+	def deleteRow(self, row):
+		_call('UpdateCursor.deleteRow', 'row')
+		self._table.delete(self._oid)
+
+###################################################################################################
+# Tools
+###################################################################################################
+
+def ListFields(path):
+	_call('ListFields', 'tool')
+	return [_Field(name, type) for name, type in _table(path).fields]
+
+def AddFieldDelimiters(path, field):
+	return field
+
+def MakeTableView_management(path, name, where = None):
+	_call('MakeTableView_management', 'tool')
+	VIEWS[name] = _table(path)
+
+def MakeFeatureLayer_management(path, name, where = None):
+	_call('MakeFeatureLayer_management', 'tool')
+	VIEWS[name] = _table(path)
+
+def ChangeVersion_management(*args):
+	_call('ChangeVersion_management', 'tool')
+
+def Delete_management(name, *args):
+	_call('Delete_management', 'tool')
+	VIEWS.pop(name, None)
+
+def ReconcileVersions_management(*args):
+	_call('ReconcileVersions_management', 'tool')
+
+def Compress_management(*args):
+	_call('Compress_management', 'tool')
+
+def SynchronizeChanges_management(*args):
+	_call('SynchronizeChanges_management', 'tool')
+
+def ImportMessage_management(*args):
+	_call('ImportMessage_management', 'tool')
+
+#Writes EXPORT_RECORDS insert records, spread over the datasets of the replica.
+def ExportDataChangeMessage_management(workspace, path, replica, *args):
+	_call('ExportDataChangeMessage_management', 'tool')
+	datasets = []
+	for item in REPLICAS:
+		if item.name == replica:
+			datasets = item.datasets
+	datasets = datasets or ['DBO.BENCH']
+	with open(path, 'w') as f:
+		f.write('<?xml version="1.0" encoding="UTF-8"?>\n<esri:DataChangeMessage xmlns:esri="http://www.esri.com/schemas/ArcGIS/10.1" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">\n')
+		f.write('<ReplicaName>' + replica + '</ReplicaName>\n<DataChanges xsi:type="esri:DataChanges">\n')
+		for n in range(len(datasets)):
+			f.write('<DatasetChanges xsi:type="esri:DeltaChanges"><DatasetName>' + datasets[n] + '</DatasetName>\n<Inserts><Records>\n')
+			for i in range(n, EXPORT_RECORDS[0], len(datasets)):
+				f.write('<Record><Values><Value>' + str(i) + '</Value><Value>bench record ' + str(i) + '</Value></Values></Record>\n')
+			f.write('</Records></Inserts></DatasetChanges>\n')
+		f.write('</DataChanges></esri:DataChangeMessage>\n')
+
+class ArcSDESQLExecute(object):
+	def __init__(self, workspace):
+		self._workspace = workspace
+
+	def execute(self, sql):
+		_call('ArcSDESQLExecute.execute', 'tool')
+		return 1
+
+def GetMessages(severity = 0):
+	return ''
+
+def AddMessage(message):
+	return
+
+def AddError(message):
+	return
+
+from arcpy import da
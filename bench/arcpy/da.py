@@ -0,0 +1,126 @@
+import arcpy
+
+###################################################################################################
+###################################################################################################
+#
+# module:	arcpy.da (benchmark stand-in)
+# purpose:	Data access cursors, Editor and ListReplicas over the in-memory tables of the arcpy
+#			stand-in. SHAPE@XY reads and writes the (x, y) of a point. Like on versioned data, the
+#			cursors only write inside an Editor session.
+#
+###################################################################################################
+
+#Raises the error of arcpy when a da cursor writes versioned data outside an edit session.
+def _checkEditing(table):
+	if arcpy._editing[0] == 0:
+		raise RuntimeError('Objects in this class cannot be updated outside an edit session [' + table.name + ']')
+
+def _get(row, field):
+	if field == 'SHAPE@XY':
+		return row.get('SHAPE')
+	return row.get(field)
+
+class _Cursor(object):
+	def __enter__(self):
+		return self
+
+	def __exit__(self, type, value, tb):
+		return False
+
+class SearchCursor(_Cursor):
+	def __init__(self, path, fields, where = None):
+		arcpy._call('da.SearchCursor', 'cursor')
+		self._table = arcpy._table(path)
+		self._fields = fields
+		self._where = where
+
+	def __iter__(self):
+		for oid in self._table.select(self._where):
+			arcpy._call('da.SearchCursor.next', 'row')
+			row = self._table.rows[oid]
+			yield tuple([_get(row, field) for field in self._fields])
+
+class InsertCursor(_Cursor):
+	def __init__(self, path, fields):
+		arcpy._call('da.InsertCursor', 'cursor')
+		self._table = arcpy._table(path)
+		self._fields = fields
+
+	def insertRow(self, values):
+		arcpy._call('da.InsertCursor.insertRow', 'row')
+		_checkEditing(self._table)
+		row = dict()
+		for field, value in zip(self._fields, values):
+			row['SHAPE' if field == 'SHAPE@XY' else field] = value
+		return self._table.insert(row)
+
+class UpdateCursor(_Cursor):
+	def __init__(self, path, fields, where = None):
+		arcpy._call('da.UpdateCursor', 'cursor')
+		self._table = arcpy._table(path)
+		self._fields = fields
+		self._oids = self._table.select(where)
+		self._oid = None
+
+	def __iter__(self):
+		for oid in self._oids:
+			if not oid in self._table.rows:
+				continue
+			arcpy._call('da.UpdateCursor.next', 'row')
+			self._oid = oid
+			row = self._table.rows[oid]
+			yield [_get(row, field) for field in self._fields]
+
+	def updateRow(self, values):
+		arcpy._call('da.UpdateCursor.updateRow', 'row')
+		_checkEditing(self._table)
+		row = dict(self._table.rows[self._oid])
+		for field, value in zip(self._fields, values):
+			row['SHAPE' if field == 'SHAPE@XY' else field] = value
+		self._table.update(self._oid, row)
+
+	def deleteRow(self):
+		arcpy._call('da.UpdateCursor.deleteRow', 'row')
+		_checkEditing(self._table)
+		self._table.delete(self._oid)
+
+class Editor(object):
+	def __init__(self, workspace):
+		arcpy._call('da.Editor', 'tool')
+		self.isEditing = False
+
+	def startEditing(self, with_undo = True, multiuser_mode = True):
+		arcpy._call('da.Editor.startEditing', 'tool')
+		if not self.isEditing:
+			arcpy._editing[0] = arcpy._editing[0] + 1
+		self.isEditing = True
+
+	def stopEditing(self, save_changes = True):
+		arcpy._call('da.Editor.stopEditing', 'tool')
+		if self.isEditing:
+			arcpy._editing[0] = arcpy._editing[0] - 1
+		self.isEditing = False
+
+	def startOperation(self):
+		arcpy._call('da.Editor.startOperation', 'tool')
+		arcpy._operation[0] = []
+
+	def stopOperation(self):
+		arcpy._call('da.Editor.stopOperation', 'tool')
+		arcpy._operation[0] = None
+
+	def abortOperation(self):
+		arcpy._call('da.Editor.abortOperation', 'tool')
+		journal = arcpy._operation[0] or []
+		arcpy._operation[0] = None
+		for table, oid, row in reversed(journal):
+			table.restore(oid, row)
+
+class Replica(object):
+	def __init__(self, name, datasets):
+		self.name = name
+		self.datasets = datasets
+
+def ListReplicas(workspace):
+	arcpy._call('da.ListReplicas', 'tool')
+	return list(arcpy.REPLICAS)
@@ -0,0 +1,289 @@
+import os, sys, time, json, glob, shutil, tempfile, logging, argparse
+
+###################################################################################################
+###################################################################################################
+#
+# script:	run_bench
+# purpose:	Runs WarehouseToSde and SdeToWarehouse against the arcpy stand-in and a SQLite
+#			Warehouse loaded with a synthetic workload, and reports CDC records and rows per
+#			second, arcpy calls per record, peak memory and the wall time of each stage.
+#			Results can be saved as a baseline, and later runs are compared against it. Runs
+#			under Python 2.7, like the connector.
+#
+#			python bench/run_bench.py --workload line_seq_storm --size 5000 --set bulkApply=true
+#			python bench/run_bench.py --workload line_seq_storm --size 5000 --save-baseline
+#
+###################################################################################################
+
+BENCH = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH), 'src', 'connector'))
+sys.path.insert(0, BENCH)
+try:
+	import pyodbc
+except ImportError:
+	sys.path.insert(0, os.path.join(BENCH, 'stubs'))
+
+import arcpy
+import util, bgimport, bgexport
+import workloads
+from warehouse import SqliteWarehouse
+
+#metric -> True if higher is better. rows_per_sec is only reported, coalescing lowers it.
+METRICS = {
+	'records_per_sec': True,
+	'calls_per_record': False,
+	'peak_memory_kb': False,
+	'import_seconds': False,
+	'export_seconds': False,
+}
+MIN_SECONDS = 0.05
+
+###################################################################################################
+# Measurement
+###################################################################################################
+
+#Replaces method name of obj with a wrapper that adds its wall time to stages[label].
+def _timeStage(obj, name, label, stages, results = None):
+	method = getattr(obj, name)
+	def timed(*args, **kwargs):
+		start = time.time()
+		try:
+			result = method(*args, **kwargs)
+			if results is not None:
+				results[label] = result
+			return result
+		finally:
+			stages[label] = stages.get(label, 0.0) + time.time() - start
+	setattr(obj, name, timed)
+
+class _Memory(object):
+	def start(self):
+		try:
+			import tracemalloc
+			tracemalloc.start()
+			self._tracemalloc = tracemalloc
+			self.source = 'tracemalloc'
+		except ImportError:
+			self._tracemalloc = None
+			self.source = 'maxrss'
+
+	#Returns the peak memory in KB: traced Python allocations if available, otherwise the peak RSS of the process.
+	def peak(self):
+		if self._tracemalloc is not None:
+			peak = self._tracemalloc.get_traced_memory()[1] // 1024
+			self._tracemalloc.stop()
+			return peak
+		try:
+			import resource
+			return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+		except ImportError:
+			return None
+
+###################################################################################################
+# Benchmark
+###################################################################################################
+
+def _config(workdir, overrides):
+	config = util.Config(os.path.join(workdir, 'none.properties'))
+	defaults = {
+		'stagingWorkspace': 'Staging.sde',
+		'productionWorkspace': 'Production.sde',
+		'bgbaseEditVersion': 'DBO.BG-BASE',
+		'stagingEditVersions': 'DBO.DESKTOP,DBO.MOBILE',
+		'replica': 'DBO.StagingToProduction',
+		'lockFilePath': os.path.join(workdir, 'bgimport.loc'),
+		'tempPath': workdir,
+		'exportPath': workdir,
+		'deleteTempFiles': 'true',
+		'autoReconcile': 'true',
+	}
+	for key, value in defaults.items():
+		config[key] = value
+	for override in overrides:
+		key, value = override.split('=', 1)
+		config[key] = value.replace('${workdir}', workdir)
+	#worker processes connect to SQL Server, the benchmark imports in process
+	config['maxWorkers'] = '1'
+	return config
+
+def _load(workload, warehouse):
+	for dataset in workload:
+		arcpy.createTable(dataset.table, dataset.fields, dataset.rows)
+		warehouse.addDataset(dataset.table, dataset.pkfield, dataset.columns(), dataset.xfield, dataset.yfield)
+		for transaction in dataset.transactions:
+			warehouse.addChanges(dataset.table, transaction)
+	arcpy.REPLICAS.append(arcpy.da.Replica('DBO.StagingToProduction', ['Staging.DBO.' + dataset.table for dataset in workload]))
+
+#Returns the number of rows that differ from the rows expected after replaying the workload's transactions.
+def _verify(workload):
+	mismatches = 0
+	for dataset in workload:
+		expected = dict()
+		for row in dataset.rows:
+			expected[row[dataset.pkfield]] = row
+		for transaction in dataset.transactions:
+			for operation, row in transaction:
+				if operation == 1:
+					expected.pop(row[dataset.pkfield], None)
+				else:
+					expected[row[dataset.pkfield]] = row
+		actual = dict()
+		for row in arcpy.TABLES[dataset.table.lower()].rows.values():
+			actual[row.get(dataset.pkfield)] = row
+		for key in set(expected.keys()) | set(actual.keys()):
+			if not key in expected or not key in actual:
+				mismatches = mismatches + 1
+			elif [expected[key].get(column) for column in dataset.columns()] != [actual[key].get(column) for column in dataset.columns()]:
+				mismatches = mismatches + 1
+	return mismatches
+
+def run(args):
+	workdir = tempfile.mkdtemp(prefix = 'bgbench')
+	try:
+		arcpy.reset()
+		arcpy.configure(args.latency_tool, args.latency_cursor, args.latency_row, args.export_records)
+		workload = workloads.build(args.workload, args.size, args.seed)
+		warehouse = SqliteWarehouse(os.path.join(workdir, 'warehouse.db'))
+		_load(workload, warehouse)
+		num_records = sum([dataset.numRecords() for dataset in workload])
+		config = _config(workdir, args.set)
+		arcpy.CALLS.clear()
+
+		stages = dict()
+		results = dict()
+		memory = _Memory()
+		memory.start()
+
+		importer = bgimport.WarehouseToSde(warehouse, config)
+		_timeStage(importer, '_importChanges', 'import.apply', stages, results)
+		_timeStage(importer, '_reconcileStaging', 'import.reconcile', stages)
+		_timeStage(importer, '_syncWithProd', 'import.sync', stages)
+		start = time.time()
+		imported = importer.run()
+		stages['import'] = time.time() - start
+		import_calls = sum(arcpy.CALLS.values())
+		calls = dict(arcpy.CALLS)
+
+		exporter = bgexport.SdeToWarehouse(config)
+		_timeStage(exporter, '_reconcileStaging', 'export.reconcile', stages)
+		_timeStage(exporter, '_exportChangeFile', 'export.message', stages)
+		_timeStage(exporter, '_syncWithProd', 'export.sync', stages)
+		_timeStage(exporter, '_sendChangeFile', 'export.delivery', stages)
+		start = time.time()
+		exporter.run()
+		stages['export'] = time.time() - start
+
+		peak = memory.peak()
+		rows = results.get('import.apply', 0)
+		apply_seconds = max(stages.get('import.apply', 0.0), 1e-9)
+		metrics = {
+			'records': num_records,
+			'rows': rows,
+			'records_per_sec': num_records / apply_seconds,
+			'rows_per_sec': max(rows, 0) / apply_seconds,
+			'calls_per_record': float(import_calls) / max(num_records, 1),
+			'peak_memory_kb': peak,
+			'import_seconds': stages['import'],
+			'export_seconds': stages['export'],
+			'records_left': sum([warehouse.numChanges(dataset.table) for dataset in workload]),
+			'mismatched_rows': _verify(workload),
+		}
+		return {'workload': args.workload, 'size': args.size, 'seed': args.seed, 'set': args.set, 'imported': imported,
+			'latency': dict(arcpy.LATENCY), 'memory': memory.source, 'metrics': metrics, 'stages': stages, 'calls': calls}
+	finally:
+		shutil.rmtree(workdir, True)
+		#the export joins paths with backslashes, which are not separators outside Windows
+		for path in glob.glob(workdir + '\\*'):
+			os.remove(path)
+
+###################################################################################################
+# Reporting
+###################################################################################################
+
+def report(result):
+	metrics = result['metrics']
+	if not result['imported']:
+		print('WarehouseToSde.run failed, run with --verbose to see the log')
+	print('Workload ' + result['workload'] + ', ' + str(metrics['records']) + ' CDC records, ' + str(metrics['rows']) + ' rows applied, ' + str(metrics['records_left']) + ' records left in CDC, ' + str(metrics['mismatched_rows']) + ' rows differ from the expected result')
+	for name in sorted(list(METRICS.keys()) + ['rows_per_sec']):
+		print('  %-20s %12s' % (name, _format(metrics[name])))
+	print('Stages (seconds)')
+	for name in sorted(result['stages'].keys()):
+		print('  %-20s %12.3f' % (name, result['stages'][name]))
+	print('arcpy calls during import')
+	for name, count in sorted(result['calls'].items(), key = lambda item: -item[1]):
+		print('  %-40s %8d' % (name, count))
+
+#Prints the change of each metric against the baseline. Returns the number of regressions beyond tolerance.
+def compare(result, baseline, tolerance):
+	regressions = 0
+	print('Compared with baseline (tolerance ' + str(int(tolerance * 100)) + '%)')
+	for name in sorted(METRICS.keys()):
+		current = result['metrics'].get(name)
+		previous = baseline['metrics'].get(name)
+		if current is None or not previous:
+			continue
+		#peak memory is only comparable when measured the same way
+		if name == 'peak_memory_kb' and result['memory'] != baseline.get('memory'):
+			continue
+		#times under MIN_SECONDS are noise
+		if name.endswith('_seconds') and max(current, previous) < MIN_SECONDS:
+			continue
+		change = (current - previous) / float(previous)
+		worse = -change if METRICS[name] else change
+		status = ''
+		if worse > tolerance:
+			status = 'REGRESSION'
+			regressions = regressions + 1
+		elif worse < -tolerance:
+			status = 'improved'
+		print('  %-20s %12s -> %12s %+8.1f%% %s' % (name, _format(previous), _format(current), change * 100, status))
+	return regressions
+
+def _format(value):
+	if value is None:
+		return 'n/a'
+	if isinstance(value, float):
+		return '%.3f' % value
+	return str(value)
+
+def main(argv):
+	parser = argparse.ArgumentParser(description = 'Benchmark the BG-BASE connector against stand-ins for arcpy and the Warehouse.')
+	parser.add_argument('--workload', default = 'line_seq_storm', choices = sorted(workloads.WORKLOADS.keys()))
+	parser.add_argument('--size', type = int, default = 2000, help = 'approximate number of CDC records')
+	parser.add_argument('--seed', type = int, default = 1)
+	parser.add_argument('--latency-tool', type = float, default = 0.0, help = 'seconds per geoprocessing tool call')
+	parser.add_argument('--latency-cursor', type = float, default = 0.0, help = 'seconds per cursor opened')
+	parser.add_argument('--latency-row', type = float, default = 0.0, help = 'seconds per row read or written')
+	parser.add_argument('--export-records', type = int, default = 100, help = 'records in the exported change message')
+	parser.add_argument('--set', action = 'append', default = [], metavar = 'KEY=VALUE', help = 'connector property, ${workdir} is replaced with the temp directory')
+	parser.add_argument('--baseline', help = 'baseline name, defaults to the workload name')
+	parser.add_argument('--baseline-dir', default = os.path.join(BENCH, 'baselines'))
+	parser.add_argument('--save-baseline', action = 'store_true')
+	parser.add_argument('--tolerance', type = float, default = 0.10)
+	parser.add_argument('--verbose', action = 'store_true')
+	args = parser.parse_args(argv)
+
+	logging.basicConfig(level = logging.DEBUG if args.verbose else logging.CRITICAL)
+	result = run(args)
+	report(result)
+	if not result['imported']:
+		return 1
+
+	path = os.path.join(args.baseline_dir, (args.baseline or args.workload) + '.json')
+	if args.save_baseline:
+		if not os.path.exists(args.baseline_dir):
+			os.makedirs(args.baseline_dir)
+		with open(path, 'w') as f:
+			json.dump(result, f, indent = 1, sort_keys = True)
+		print('Saved baseline ' + path)
+		return 0
+	if os.path.exists(path):
+		with open(path, 'r') as f:
+			baseline = json.load(f)
+		if compare(result, baseline, args.tolerance) > 0:
+			return 1
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,15 @@
+###################################################################################################
+#
+# module:	pyodbc (benchmark stand-in)
+# purpose:	Lets connector.bgbase be imported on machines without the ODBC client. Benchmarks read
+#			changes from bench.warehouse.SqliteWarehouse, so connecting is an error.
+#
+###################################################################################################
+
+class Error(Exception):
+	pass
+
+Binary = bytearray
+
+def connect(connectionString, **kwargs):
+	raise Error('08001', 'pyodbc is not installed, benchmarks use bench.warehouse.SqliteWarehouse')
@@ -0,0 +1,169 @@
+import sqlite3, binascii, logging
+from datetime import datetime
+
+###################################################################################################
+###################################################################################################
+#
+# class:	SqliteWarehouse
+# purpose:	Stand-in for bgbase.Warehouse that serves synthetic CDC streams from SQLite. Each
+#			dataset has a change table with the SQL Server CDC columns (__$start_lsn, __$seqval,
+#			__$operation) and the data columns, and the sync table has the columns of
+#			SDE_SYNC_TABLES. LSNs are 10 byte big-endian binaries, so windows, checkpoints and
+#			__$CDCKEY behave like they do on SQL Server. Net changes are not supported, the
+#			change cursor is always read in 'all' mode.
+#
+###################################################################################################
+
+class SqliteWarehouse(object):
+	#path:	SQLite database file, or :memory:.
+	def __init__(self, path = ':memory:'):
+		self._connection = sqlite3.connect(path)
+		self._changeCursorFields = None
+		self._lastLsn = 0
+		self._connection.execute('''CREATE TABLE IF NOT EXISTS SDE_SYNC_TABLES (TABLE_NAME TEXT, CDC_FUNCTION TEXT,
+LAST_SYNC_DATE TEXT, CDC_TABLE_NAME TEXT, DISABLED INTEGER, PK_FIELD TEXT, X_FIELD TEXT, Y_FIELD TEXT)''')
+
+	#Adds a dataset with its change table.
+	#columns:	Names of the data columns of the change table.
+	def addDataset(self, table, pkfield, columns, xfield = None, yfield = None):
+		cdc_table = 'cdc_' + table
+		self._connection.execute('INSERT INTO SDE_SYNC_TABLES VALUES (?, ?, NULL, ?, 0, ?, ?, ?)', (table, 'cdc.fn_cdc_get_all_changes_' + table, cdc_table, pkfield, xfield, yfield))
+		cols = ', '.join(['"' + column + '"' for column in columns])
+		self._connection.execute('CREATE TABLE ' + cdc_table + ' ("__$start_lsn" BLOB, "__$seqval" BLOB, "__$operation" INTEGER, ' + cols + ')')
+		self._connection.execute('CREATE INDEX ix_' + cdc_table + ' ON ' + cdc_table + ' ("__$start_lsn", "__$seqval")')
+		self._connection.commit()
+
+	#Appends CDC records to a dataset's change table, one transaction (LSN) per call.
+	#records:	List of (operation, row dictionary), operation 1 = delete, 2 = insert, 4 = update.
+	def addChanges(self, table, records):
+		self._lastLsn = self._lastLsn + 1
+		start_lsn = sqlite3.Binary(_lsn(self._lastLsn))
+		cdc_table = 'cdc_' + table
+		for seq in range(len(records)):
+			operation, row = records[seq]
+			columns = sorted(row.keys())
+			sql = 'INSERT INTO ' + cdc_table + ' ("__$start_lsn", "__$seqval", "__$operation", ' + ', '.join(['"' + column + '"' for column in columns]) + ') VALUES (?, ?, ?' + ', ?' * len(columns) + ')'
+			self._connection.execute(sql, [start_lsn, sqlite3.Binary(_lsn(seq + 1)), operation] + [row[column] for column in columns])
+		self._connection.commit()
+
+	def numChanges(self, table):
+		return self._connection.execute('SELECT COUNT(*) FROM cdc_' + table).fetchone()[0]
+
+	def isConnected(self):
+		return True
+
+	def close(self):
+		return
+
+	def getSyncDatasets(self):
+		datasets = []
+		for row in self._connection.execute('SELECT TABLE_NAME, CDC_FUNCTION, LAST_SYNC_DATE, CDC_TABLE_NAME, DISABLED, PK_FIELD, X_FIELD, Y_FIELD FROM SDE_SYNC_TABLES'):
+			dataset = dict()
+			dataset['table'] = row[0]
+			dataset['func'] = row[1]
+			dataset['last_run'] = row[2] or '2000-01-01 00:00:00'
+			dataset['cdc_table'] = row[3]
+			dataset['disabled'] = row[4] == 1
+			dataset['pkfield'] = row[5]
+			dataset['xfield'] = row[6]
+			dataset['yfield'] = row[7]
+			datasets.append(dataset)
+		return datasets
+
+	#Returns a cursor of the CDC records after the dataset's last_lsn, or all of them, ordered by LSN.
+	#Like Warehouse.getChanges, returns None with the dataset's read_error set if the records cannot be read.
+	def getChanges(self, dataset, netChanges = False):
+		if netChanges:
+			logging.warn('SqliteWarehouse does not support net changes, reading all changes')
+		dataset['read_error'] = False
+		dataset['read_time'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+		sql = 'SELECT MIN("__$start_lsn"), MAX("__$start_lsn") FROM ' + dataset['cdc_table']
+		params = []
+		if dataset.get('last_lsn') is not None:
+			sql = sql + ' WHERE "__$start_lsn" > ?'
+			params.append(sqlite3.Binary(bytes(dataset['last_lsn'])))
+		try:
+			lsns = self._connection.execute(sql, params).fetchone()
+			if lsns[0] is None:
+				dataset['begin_lsn'] = None
+				dataset['end_lsn'] = None
+				return None
+			dataset['begin_lsn'] = bytearray(lsns[0])
+			dataset['end_lsn'] = bytearray(lsns[1])
+			sql = 'SELECT * FROM ' + dataset['cdc_table'] + ' WHERE "__$start_lsn" BETWEEN ? AND ? ORDER BY "__$start_lsn", "__$seqval"'
+			cursor = _ChangeCursor(self._connection.execute(sql, (lsns[0], lsns[1])))
+		except sqlite3.Error as e:
+			logging.error('Error reading the changes of ' + dataset['table'] + ': ' + str(e))
+			dataset['read_error'] = True
+			return None
+		self._changeCursorFields = dict()
+		for i in range(len(cursor.description)):
+			self._changeCursorFields[cursor.description[i][0]] = i
+		return cursor
+
+	def getMaxLsn(self):
+		return bytearray(_lsn(self._lastLsn))
+
+	def getOperationType(self, cdcRow):
+		return {1: 'delete', 2: 'insert', 4: 'update'}.get(cdcRow[self._changeCursorFields['__$operation']], '')
+
+	#Deletes each dataset's LSN window except the records that failed, and sets LAST_SYNC_DATE.
+	def clearChanges(self, deleteList, datasets):
+		windows = dict()
+		for dataset in datasets or []:
+			windows[dataset['cdc_table']] = dataset
+		for table in deleteList:
+			dataset = windows.get(table)
+			if dataset is None or dataset.get('begin_lsn') is None:
+				continue
+			keep = set([bytes(key) for key in deleteList[table].failed()])
+			window = (sqlite3.Binary(bytes(dataset['begin_lsn'])), sqlite3.Binary(bytes(dataset['end_lsn'])))
+			if len(keep) == 0:
+				self._connection.execute('DELETE FROM ' + table + ' WHERE "__$start_lsn" BETWEEN ? AND ?', window)
+				continue
+			rows = self._connection.execute('SELECT rowid, "__$start_lsn", "__$seqval" FROM ' + table + ' WHERE "__$start_lsn" BETWEEN ? AND ?', window).fetchall()
+			deletes = [(row[0],) for row in rows if not bytes(row[1]) + bytes(row[2]) in keep]
+			self._connection.executemany('DELETE FROM ' + table + ' WHERE rowid = ?', deletes)
+		for dataset in datasets or []:
+			if 'read_time' in dataset:
+				self._connection.execute('UPDATE SDE_SYNC_TABLES SET LAST_SYNC_DATE = ? WHERE CDC_TABLE_NAME = ?', (dataset['read_time'], dataset['cdc_table']))
+		self._connection.commit()
+
+###################################################################################################
+###################################################################################################
+#
+# class:	_ChangeCursor
+# purpose:	Wraps a SQLite change cursor to return binary columns as bytearray, like pyodbc, and
+#			to add the __$CDCKEY column, the concatenation of __$start_lsn and __$seqval.
+#
+###################################################################################################
+
+class _ChangeCursor(object):
+	def __init__(self, cursor):
+		self._cursor = cursor
+		self.description = tuple(cursor.description) + (('__$CDCKEY', None, None, None, None, None, None),)
+		self.arraysize = cursor.arraysize
+		self._start = [column[0] for column in cursor.description].index('__$start_lsn')
+
+	def _convert(self, row):
+		values = [bytearray(value) if isinstance(value, (bytes, memoryview, buffer)) else value for value in row]
+		values.append(values[self._start] + values[self._start + 1])
+		return tuple(values)
+
+	def fetchmany(self, size = None):
+		return [self._convert(row) for row in self._cursor.fetchmany(size or self.arraysize)]
+
+	def __iter__(self):
+		for row in self._cursor:
+			yield self._convert(row)
+
+	def close(self):
+		self._cursor.close()
+
+try:
+	buffer
+except NameError:
+	buffer = memoryview
+
+def _lsn(n):
+	return binascii.unhexlify('%020x' % n)
@@ -0,0 +1,101 @@
+import random
+
+###################################################################################################
+###################################################################################################
+#
+# module:	workloads
+# purpose:	Synthetic CDC streams for the benchmark. A workload is a list of datasets, each with
+#			its feature class schema, the rows already in SDE and the CDC transactions to import.
+#			build(name, size, seed) returns one by name; size is the approximate number of CDC
+#			records.
+#
+###################################################################################################
+
+PLANT_FIELDS = [('OBJECTID', 'OID'), ('Shape', 'Geometry'), ('PLANT_ID', 'Integer'), ('NAME', 'String'), ('STATUS', 'String'), ('X', 'Double'), ('Y', 'Double'), ('GlobalID', 'GlobalID')]
+OBSERVATION_FIELDS = [('OBJECTID', 'OID'), ('OBS_ID', 'Integer'), ('PLANT_ID', 'Integer'), ('LINE_SEQ', 'Integer'), ('NOTE', 'String'), ('GlobalID', 'GlobalID')]
+
+class Dataset(object):
+	def __init__(self, table, pkfield, fields, xfield = None, yfield = None):
+		self.table = table
+		self.pkfield = pkfield
+		self.fields = fields
+		self.xfield = xfield
+		self.yfield = yfield
+		#rows in SDE before the import
+		self.rows = []
+		#CDC transactions, each a list of (operation, row)
+		self.transactions = []
+
+	def columns(self):
+		return [name for name, type in self.fields if not type in ('OID', 'Geometry', 'GlobalID')]
+
+	def numRecords(self):
+		return sum([len(transaction) for transaction in self.transactions])
+
+def _plant(random, id):
+	x = -71.12 + random.random() / 100
+	y = 42.29 + random.random() / 100
+	return {'PLANT_ID': id, 'NAME': 'Plant ' + str(id), 'STATUS': random.choice(['A', 'D', 'T']), 'X': x, 'Y': y}
+
+def _sdeRow(row, dataset):
+	sde = dict(row)
+	if dataset.xfield:
+		sde['SHAPE'] = (row[dataset.xfield], row[dataset.yfield])
+	return sde
+
+#New plants, one insert per transaction.
+def inserts(size, random):
+	plants = Dataset('PLANTS', 'PLANT_ID', PLANT_FIELDS, 'X', 'Y')
+	for id in range(1, size + 1):
+		plants.transactions.append([(2, _plant(random, id))])
+	return [plants]
+
+#Edits to existing plants, several updates per plant, a few deletes and inserts.
+def mixed(size, random):
+	plants = Dataset('PLANTS', 'PLANT_ID', PLANT_FIELDS, 'X', 'Y')
+	existing = max(size // 2, 1)
+	for id in range(1, existing + 1):
+		plants.rows.append(_sdeRow(_plant(random, id), plants))
+	next_id = existing + 1
+	while plants.numRecords() < size:
+		n = random.random()
+		if n < 0.8:
+			row = _plant(random, random.randint(1, existing))
+			plants.transactions.append([(4, row)])
+		elif n < 0.9:
+			plants.transactions.append([(1, {'PLANT_ID': random.randint(1, existing)})])
+		else:
+			plants.transactions.append([(2, _plant(random, next_id))])
+			next_id = next_id + 1
+	return [plants]
+
+#BG-BASE line_seq renumbering: every new observation of a plant is inserted with LINE_SEQ 0 and
+#every observation of the plant is then renumbered, so one observation costs k + 1 CDC records.
+def line_seq_storm(size, random, observations = 10):
+	obs = Dataset('PLANTS_OBS', 'OBS_ID', OBSERVATION_FIELDS)
+	plants = dict()
+	num_plants = max(size // (observations * 4), 1)
+	next_id = 1
+	for plant_id in range(1, num_plants + 1):
+		plants[plant_id] = []
+		for seq in range(1, observations + 1):
+			row = {'OBS_ID': next_id, 'PLANT_ID': plant_id, 'LINE_SEQ': seq, 'NOTE': 'Observation ' + str(next_id)}
+			obs.rows.append(dict(row))
+			plants[plant_id].append(row)
+			next_id = next_id + 1
+	while obs.numRecords() < size:
+		plant_id = random.randint(1, num_plants)
+		new = {'OBS_ID': next_id, 'PLANT_ID': plant_id, 'LINE_SEQ': 0, 'NOTE': 'Observation ' + str(next_id)}
+		next_id = next_id + 1
+		transaction = [(2, dict(new))]
+		plants[plant_id].append(new)
+		for row in plants[plant_id]:
+			row['LINE_SEQ'] = row['LINE_SEQ'] + 1
+			transaction.append((4, dict(row)))
+		obs.transactions.append(transaction)
+	return [obs]
+
+WORKLOADS = {'inserts': inserts, 'mixed': mixed, 'line_seq_storm': line_seq_storm}
+
+def build(name, size, seed = 1):
+	return WORKLOADS[name](size, random.Random(seed))
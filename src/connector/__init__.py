@@ -1 +1 @@
-__all__ = ["bgbase","bgimport","util"]
\ No newline at end of file
+__all__ = ["bgbase","bgimport","changes","daemon","deadletter","maintenance","metrics","profiling","resync","sdeapply","splitter","util"]
\ No newline at end of file
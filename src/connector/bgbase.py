@@ -1,6 +1,7 @@
 import os, sys, arcpy
 import traceback
 import logging
+import threading, time
 import pyodbc
 
 import util
@@ -31,24 +32,45 @@ import util
 #
 ###################################################################################################
 
+#Number of keys per INSERT when loading CDC keys into a temp table, SQL Server allows 2100 parameters per statement
+ACK_CHUNK_SIZE = 500
+
 class Warehouse(object):
 	#server:		name of the SQL Server.
 	#database:		name of the database that contains our table.
 	#adminTable:	name of the admin table.
-	def __init__(self, server, database, adminTable):
+	#poolSize:		number of idle connections kept in the connection pool.
+	#timeout:		statement timeout in seconds, 0 for no timeout.
+	#retries:		number of times to retry a failed connection attempt.
+	#backoff:		seconds to wait before the first retry, doubled on each retry.
+	def __init__(self, server, database, adminTable, poolSize = 2, timeout = 0, retries = 3, backoff = 0.5):
 		self._server = server
 		self._database = database
 		self._connectionString = "DRIVER={SQL Server};SERVER=${server};DATABASE=${database};Trusted_Connection=yes".replace('${server}', server).replace('${database}', database)
 		self._adminTable = adminTable
+		self._pool = ConnectionPool.get(self._connectionString, poolSize, timeout, retries, backoff)
 		self._connection = None
 		self._changeCursor = None
 		self._changeCursorFields = None
+		self._tableCursor = None
 		self._dbutil = util.DBUtil()
 		self._connect()
 		
+	#Creates a Warehouse from a connector.util.Config object with the server, database and adminTable keys,
+	#and the optional poolSize, queryTimeout, connectRetries and connectBackoff keys.
+	@classmethod
+	def fromConfig(cls, config):
+		poolSize = int(config['poolSize']) if config['poolSize'] else 2
+		timeout = int(config['queryTimeout']) if config['queryTimeout'] else 0
+		retries = int(config['connectRetries']) if config['connectRetries'] else 3
+		backoff = float(config['connectBackoff']) if config['connectBackoff'] else 0.5
+		return cls(config['server'], config['database'], config['adminTable'], poolSize, timeout, retries, backoff)
+		
 	def __del__(self):
-		self._dbutil.close(self._changeCursor)
-		self._dbutil.close(self._connection)
+		try:
+			self.close()
+		except:
+			None
 		
 	def isConnected(self):
 		return not self._connection is None
@@ -56,7 +78,7 @@ class Warehouse(object):
 	def _connect(self):
 		func = 'Warehouse._connect'
 		try:
-			self._connection = pyodbc.connect(self._connectionString)
+			self._connection = self._pool.borrow()
 			return True
 		except:
 			self._connection = None
@@ -65,11 +87,41 @@ class Warehouse(object):
 			msg = "Error in " + func + ":\n" + tbinfo + "\nError Info:\n" + str(sys.exc_info()[1])
 			logging.error(msg);
 		return False
+		
+	#Makes sure the connection is alive, reconnecting if it was dropped. Returns True if connected.
+	def _checkConnection(self):
+		if self._connection is not None and not self._pool.validate(self._connection):
+			logging.warn('Connection to ' + self._server + ' was lost, reconnecting')
+			self._pool.discard(self._connection)
+			self._connection = None
+		if self._connection is None:
+			self._connect()
+		return self.isConnected()
+		
+	#Executes a statement on the connection and returns the cursor. If the connection was dropped,
+	#reconnects and executes the statement once more.
+	def _execute(self, sql, *params):
+		try:
+			return self._connection.execute(sql, *params)
+		except pyodbc.Error as e:
+			if not ConnectionPool.isConnectionError(e):
+				raise
+			logging.warn('Connection to ' + self._server + ' failed, reconnecting: ' + str(e))
+			self._pool.discard(self._connection)
+			self._connection = None
+			if not self._connect():
+				raise
+			return self._connection.execute(sql, *params)
 	
+	#Returns the connection to the pool.
 	def close(self):
+		self._dbutil.close(self._changeCursor)
+		self._changeCursor = None
+		self._dbutil.close(self._tableCursor)
+		self._tableCursor = None
 		if self.isConnected():
 			try:
-				self._connection.close()
+				self._pool.release(self._connection)
 				self._connection = None
 			except:
 				tb = sys.exc_info()[2]
@@ -83,11 +135,11 @@ class Warehouse(object):
 		func = 'Warehouse.getSyncDatasets';
 		cursor = None
 		try:
-			if(not self.isConnected()):
+			if(not self._checkConnection()):
 				logging.error(func + ': No connection')
 			else:
 				sql = 'SELECT * FROM ${table}'.replace('${table}', self._adminTable)
-				cursor = self._connection.execute(sql)
+				cursor = self._execute(sql)
 				fields = self._dbutil.getColumns(cursor)
 				for row in cursor:
 					dataset = dict()
@@ -118,29 +170,52 @@ class Warehouse(object):
 		
 		return datasets
 	
-	#Given an input dataset, returns a cursor of CDC records for that dataset
-	def getChanges(self, dataset):
+	#Given an input dataset, returns a cursor of CDC records for that dataset, ordered by LSN.
+	#If the dataset has a last_lsn high-water mark, the records strictly after it are read,
+	#otherwise the records since LAST_SYNC_DATE. The LSN window that was read is stored in the
+	#dataset's begin_lsn and end_lsn. __$CDCKEY is the binary(20) concatenation of __$start_lsn
+	#and __$seqval.
+	#If netChanges is True, the cursor is read from the dataset's fn_cdc_get_net_changes_* function
+	#and returns one row per key, with the key in __$PK and the folded CDC keys in __$CDCKEY as a
+	#comma-delimited list. Keys whose changes cancelled out are returned with a NULL __$operation.
+	#Returns None if there are no changes, or if the changes could not be read, in which case the dataset's read_error
+	#is True and its window must not be acknowledged.
+	def getChanges(self, dataset, netChanges = False):
 		func = 'Warehouse.getChanges'
+		dataset['read_error'] = False
 		try:
 			self._dbutil.close(self._changeCursor)
 			self._changeCursorFields = None
 			
-			if not self.isConnected():
+			if not self._checkConnection():
 				logging.error(func + ': No connection')
+				dataset['read_error'] = True
 				return None
 		
 			dateUtil = util.DateUtil()
 			now = dateUtil.now()
 			dataset['read_time'] = now
-			self._changeCursor = self._connection.cursor()
-		
-			sql = '''DECLARE @begin_time datetime, @end_time datetime, @begin_lsn binary(10), @end_lsn binary(10);
-SET @begin_time = \'''' + dataset['last_run'] + '''\';
-SET @end_time = \'''' + now + '''\';
-SELECT @begin_lsn = sys.fn_cdc_map_time_to_lsn('smallest greater than', @begin_time);
-SELECT @end_lsn = sys.fn_cdc_map_time_to_lsn('largest less than or equal', @end_time);
-SELECT *, CONVERT(VARCHAR(MAX), __$seqval, 2) as __$CDCKEY FROM ''' + dataset['func'] + '''(@begin_lsn, @end_lsn, 'all');''' 
-			self._changeCursor.execute(sql)
+			
+			if dataset.get('last_lsn') is not None:
+				lsns = self._lsnWindow(dataset)
+			else:
+				sql = "SELECT sys.fn_cdc_map_time_to_lsn('smallest greater than', ?), sys.fn_cdc_map_time_to_lsn('largest less than or equal', ?)"
+				lsns = self._execute(sql, dataset['last_run'], now).fetchone()
+			dataset['begin_lsn'] = lsns[0]
+			dataset['end_lsn'] = lsns[1]
+			if dataset['begin_lsn'] is None or dataset['end_lsn'] is None or dataset['begin_lsn'] > dataset['end_lsn']:
+				logging.debug('No changes for ' + dataset['table'])
+				return None
+			
+			sql = '''DECLARE @begin_lsn binary(10), @end_lsn binary(10);
+SET @begin_lsn = ?;
+SET @end_lsn = ?;
+'''
+			if netChanges:
+				sql = sql + self._netChangesSql(dataset)
+			else:
+				sql = sql + '''SELECT *, __$start_lsn + __$seqval as __$CDCKEY FROM ''' + dataset['func'] + '''(@begin_lsn, @end_lsn, 'all') ORDER BY __$start_lsn, __$seqval;'''
+			self._changeCursor = self._execute(sql, dataset['begin_lsn'], dataset['end_lsn'])
 			self._changeCursorFields = self._dbutil.getColumns(self._changeCursor)
 			
 		except:
@@ -148,10 +223,204 @@ SELECT *, CONVERT(VARCHAR(MAX), __$seqval, 2) as __$CDCKEY FROM ''' + dataset['f
 			tbinfo = traceback.format_tb(tb)[0]
 			msg = "Error in " + func + ":\n" + tbinfo + "\nError Info:\n" + str(sys.exc_info()[1])
 			logging.error(msg);
+			dataset['read_error'] = True
 			return None
 		
 		return self._changeCursor
 	
+	#Returns the current maximum LSN of the CDC database, or None if it cannot be read.
+	#This is a single scalar query, cheap enough to poll to detect new changes.
+	def getMaxLsn(self):
+		func = 'Warehouse.getMaxLsn'
+		try:
+			if not self._checkConnection():
+				logging.error(func + ': No connection')
+				return None
+			return self._execute('SELECT sys.fn_cdc_get_max_lsn()').fetchone()[0]
+		except:
+			tb = sys.exc_info()[2]
+			tbinfo = traceback.format_tb(tb)[0]
+			msg = "Error in " + func + ":\n" + tbinfo + "\nError Info:\n" + str(sys.exc_info()[1])
+			logging.error(msg);
+		return None
+	
+	#Returns a cursor over the rows of the source table whose changes the dataset's CDC table captures, and stores the
+	#maximum CDC LSN and its commit time in the dataset's resync_lsn and resync_time. If the database allows snapshot
+	#isolation, the LSN and the rows are read in one snapshot transaction, so the rows hold exactly the changes up to
+	#the LSN. Otherwise changes committed while the rows are read are read again from CDC by the next import.
+	#Call endTableRead once the rows are read.
+	def getTable(self, dataset):
+		func = 'Warehouse.getTable'
+		try:
+			self._dbutil.close(self._tableCursor)
+			self._tableCursor = None
+			if not self._checkConnection():
+				logging.error(func + ': No connection')
+				return None
+			
+			source = self._sourceTable(dataset)
+			if source is None:
+				logging.error('No capture instance found for ' + dataset['cdc_table'])
+				return None
+			
+			sql = 'SELECT sys.fn_cdc_get_max_lsn(), sys.fn_cdc_map_lsn_to_time(sys.fn_cdc_get_max_lsn())'
+			self._connection.commit()
+			self._execute('SET TRANSACTION ISOLATION LEVEL SNAPSHOT')
+			try:
+				lsns = self._execute(sql).fetchone()
+			except pyodbc.Error as e:
+				logging.warn('Snapshot isolation is not allowed in ' + self._database + ', changes committed while ' + source + ' is read will be read again from CDC: ' + str(e))
+				self._connection.rollback()
+				self._execute('SET TRANSACTION ISOLATION LEVEL READ COMMITTED')
+				lsns = self._execute(sql).fetchone()
+			dataset['resync_lsn'] = lsns[0]
+			dataset['resync_time'] = lsns[1]
+			logging.debug('Reading ' + source + ' for ' + dataset['table'])
+			self._tableCursor = self._execute('SELECT * FROM ' + source)
+		except:
+			tb = sys.exc_info()[2]
+			tbinfo = traceback.format_tb(tb)[0]
+			msg = "Error in " + func + ":\n" + tbinfo + "\nError Info:\n" + str(sys.exc_info()[1])
+			logging.error(msg);
+			self.endTableRead()
+			return None
+		
+		return self._tableCursor
+	
+	#Returns a cursor over the rows of the dataset's source table that match where, a SQL condition, or over all of its rows.
+	#Call endTableRead once the rows are read.
+	def getRows(self, dataset, where = None):
+		func = 'Warehouse.getRows'
+		try:
+			self._dbutil.close(self._tableCursor)
+			self._tableCursor = None
+			if not self._checkConnection():
+				logging.error(func + ': No connection')
+				return None
+			source = self._sourceTable(dataset)
+			if source is None:
+				logging.error('No capture instance found for ' + dataset['cdc_table'])
+				return None
+			sql = 'SELECT * FROM ' + source
+			if where:
+				sql = sql + ' WHERE ' + where
+			self._tableCursor = self._execute(sql)
+		except:
+			tb = sys.exc_info()[2]
+			tbinfo = traceback.format_tb(tb)[0]
+			msg = "Error in " + func + ":\n" + tbinfo + "\nError Info:\n" + str(sys.exc_info()[1])
+			logging.error(msg);
+			return None
+		
+		return self._tableCursor
+	
+	#Returns the (smallest, largest) primary key of the dataset's source table, or None if it cannot be read.
+	def getKeyRange(self, dataset):
+		func = 'Warehouse.getKeyRange'
+		try:
+			if not self._checkConnection():
+				logging.error(func + ': No connection')
+				return None
+			source = self._sourceTable(dataset)
+			if source is None:
+				logging.error('No capture instance found for ' + dataset['cdc_table'])
+				return None
+			row = self._execute('SELECT MIN(' + dataset['pkfield'] + '), MAX(' + dataset['pkfield'] + ') FROM ' + source).fetchone()
+			return (row[0], row[1])
+		except:
+			tb = sys.exc_info()[2]
+			tbinfo = traceback.format_tb(tb)[0]
+			msg = "Error in " + func + ":\n" + tbinfo + "\nError Info:\n" + str(sys.exc_info()[1])
+			logging.error(msg);
+		return None
+	
+	#Closes the cursor of getTable or getRows and ends its transaction.
+	def endTableRead(self):
+		self._dbutil.close(self._tableCursor)
+		self._tableCursor = None
+		if self.isConnected():
+			try:
+				self._connection.commit()
+				self._execute('SET TRANSACTION ISOLATION LEVEL READ COMMITTED')
+			except:
+				logging.warn('Error ending the read of a table: ' + str(sys.exc_info()[1]))
+		return
+	
+	#Returns the schema qualified name of the table captured by the dataset's CDC table, or None if it is not found.
+	#The name is kept in the dataset's source_table.
+	def _sourceTable(self, dataset):
+		if dataset.get('source_table'):
+			return dataset['source_table']
+		sql = '''SELECT QUOTENAME(OBJECT_SCHEMA_NAME(source_object_id)) + '.' + QUOTENAME(OBJECT_NAME(source_object_id)) FROM cdc.change_tables
+WHERE object_id = OBJECT_ID(?) OR capture_instance = ?'''
+		row = self._execute(sql, dataset['cdc_table'], self._captureInstance(dataset) or '').fetchone()
+		if row is None:
+			return None
+		dataset['source_table'] = row[0]
+		return row[0]
+	
+	#Moves the dataset's LAST_SYNC_DATE to the resync_time read by getTable, so the next import reads the changes after
+	#it. If clear is True, the CDC records up to resync_lsn, which the rows that were read already hold, are deleted.
+	#Returns False if the watermark could not be set.
+	def setWatermark(self, dataset, clear):
+		func = 'Warehouse.setWatermark'
+		cursor = None
+		try:
+			if not self._checkConnection():
+				logging.error(func + ': No connection')
+				return False
+			cursor = self._connection.cursor()
+			if clear and dataset.get('resync_lsn') is not None:
+				cursor.execute('DELETE FROM ' + dataset['cdc_table'] + ' WHERE __$start_lsn <= ?', dataset['resync_lsn'])
+				logging.debug('Deleted ' + str(cursor.rowcount) + ' rows from ' + dataset['cdc_table'])
+			if dataset.get('resync_time') is not None:
+				cursor.execute('UPDATE ' + self._adminTable + ' SET LAST_SYNC_DATE = ? WHERE CDC_TABLE_NAME = ?', dataset['resync_time'], dataset['cdc_table'])
+			self._connection.commit()
+			return True
+		except:
+			tb = sys.exc_info()[2]
+			tbinfo = traceback.format_tb(tb)[0]
+			msg = "Error in " + func + ":\n" + tbinfo + "\nError Info:\n" + str(sys.exc_info()[1])
+			logging.error(msg);
+		finally:
+			self._dbutil.close(cursor)
+		return False
+	
+	#Returns the (begin, end) LSN window strictly after the dataset's last_lsn, up to the current maximum LSN.
+	#If the capture job cleaned up records past last_lsn, the window starts at the capture instance's minimum LSN.
+	def _lsnWindow(self, dataset):
+		sql = 'SELECT sys.fn_cdc_increment_lsn(?), sys.fn_cdc_get_max_lsn()'
+		lsns = self._execute(sql, dataset['last_lsn']).fetchone()
+		begin_lsn = lsns[0]
+		captureInstance = self._captureInstance(dataset)
+		if captureInstance is not None:
+			min_lsn = self._execute('SELECT sys.fn_cdc_get_min_lsn(?)', captureInstance).fetchone()[0]
+			if min_lsn is not None and min_lsn > begin_lsn:
+				logging.warn('CDC records after the high-water mark of ' + dataset['table'] + ' were cleaned up, changes may have been missed')
+				begin_lsn = min_lsn
+		return (begin_lsn, lsns[1])
+	
+	#Returns the capture instance name of a dataset, derived from its CDC function.
+	def _captureInstance(self, dataset):
+		n = dataset['func'].find('fn_cdc_get_all_changes_')
+		if n == -1:
+			return None
+		return dataset['func'][n + len('fn_cdc_get_all_changes_'):]
+	
+	#Returns the SELECT statement that reads the net changes of a dataset between @begin_lsn and @end_lsn.
+	#Every key with a record in the change table is returned, so changes that cancelled out are still acknowledged.
+	def _netChangesSql(self, dataset):
+		netFunc = dataset['func'].replace('fn_cdc_get_all_changes_', 'fn_cdc_get_net_changes_')
+		if netFunc == dataset['func']:
+			raise ValueError('Cannot determine the net changes function for ' + dataset['func'])
+		sql = '''SELECT n.*, k.__$PK, STUFF((SELECT ',' + CONVERT(VARCHAR(40), c.__$start_lsn + c.__$seqval, 2) FROM ${cdc_table} c
+	WHERE c.${pk} = k.__$PK AND c.__$start_lsn BETWEEN @begin_lsn AND @end_lsn
+	GROUP BY c.__$start_lsn, c.__$seqval FOR XML PATH('')), 1, 1, '') as __$CDCKEY
+FROM (SELECT ${pk} as __$PK, MIN(__$start_lsn) as __$FIRST_LSN FROM ${cdc_table} WHERE __$start_lsn BETWEEN @begin_lsn AND @end_lsn GROUP BY ${pk}) k
+LEFT JOIN ${func}(@begin_lsn, @end_lsn, 'all') n ON n.${pk} = k.__$PK
+ORDER BY k.__$FIRST_LSN;'''
+		return sql.replace('${cdc_table}', dataset['cdc_table']).replace('${pk}', dataset['pkfield']).replace('${func}', netFunc)
+	
 	#returns "insert","update","delete"
 	def getOperationType(self, cdcRow):
 		func = "Warehouse.getOperationType"
@@ -171,34 +440,169 @@ SELECT *, CONVERT(VARCHAR(MAX), __$seqval, 2) as __$CDCKEY FROM ''' + dataset['f
 			logging.error(msg);
 		return op
 	
+	#Deletes the acknowledged CDC records and sets LAST_SYNC_DATE for the datasets.
+	#deleteList:	CDC table name -> changes.AckList of the records that were read.
+	#datasets:		Datasets that were read, with the begin_lsn and end_lsn of their window.
+	#The LSN window of each table is deleted with one range delete. The keys of records that were
+	#not applied are bulk loaded into a temp table in chunks and excluded from the delete.
 	def clearChanges(self, deleteList, datasets):
 		logging.info('Clearing changes from CDC tables')
 		func = "Warehouse.clearChanges"
+		cursor = None
 		try:
+			if not self._checkConnection():
+				logging.error(func + ': No connection')
+				return
 			cursor = self._connection.cursor()
+			windows = dict()
+			if datasets is not None:
+				for dataset in datasets:
+					windows[dataset['cdc_table']] = dataset
+			
 			for table in deleteList:
-				ids = ''
-				for i in range(0, len(deleteList[table])):
-					if i > 0:
-						ids = ids + ","
-					ids = ids + "'" + deleteList[table][i] + "'"
+				dataset = windows.get(table)
+				if dataset is None or dataset.get('begin_lsn') is None:
+					continue
 				logging.debug('Clearing changes from ' + table)
-				sql = 'DELETE FROM ' + table + ' where CONVERT(VARCHAR(MAX), __$seqval, 2) in (' + ids + ')'
-				cursor.execute(sql)
+				num_deleted = self._clearWindow(cursor, table, dataset['begin_lsn'], dataset['end_lsn'], deleteList[table].failed())
 				self._connection.commit()
-				logging.debug('Deleted ' + str(cursor.rowcount) + ' rows from ' + table)
+				logging.debug('Deleted ' + str(num_deleted) + ' rows from ' + table)
 			
 			if datasets is not None:
-				for dataset in datasets:
-					sql = "UPDATE ${table} SET LAST_SYNC_DATE = '${date}' WHERE CDC_TABLE_NAME = '${cdc_table}'".replace('${table}', self._adminTable).replace('${date}', dataset['read_time']).replace('${cdc_table}', dataset['cdc_table'])
-					cursor.execute(sql)
+				params = [(dataset['read_time'], dataset['cdc_table']) for dataset in datasets if 'read_time' in dataset]
+				if len(params) > 0:
+					sql = 'UPDATE ' + self._adminTable + ' SET LAST_SYNC_DATE = ? WHERE CDC_TABLE_NAME = ?'
+					cursor.executemany(sql, params)
 					self._connection.commit()
-			cursor.close()
-			del cursor
-			cursor = None
 		except:
 			tb = sys.exc_info()[2]
 			tbinfo = traceback.format_tb(tb)[0]
 			msg = "Error in " + func + ":\n" + tbinfo + "\nError Info:\n" + str(sys.exc_info()[1])
 			logging.error(msg);
+		finally:
+			self._dbutil.close(cursor)
 		return
+	
+	#Deletes the CDC records of an LSN window, except the records with the keys in keep.
+	#The range delete and the join on (__$start_lsn, __$seqval) both seek on the change table's clustered index.
+	def _clearWindow(self, cursor, table, begin_lsn, end_lsn, keep):
+		if len(keep) == 0:
+			cursor.execute('DELETE FROM ' + table + ' WHERE __$start_lsn BETWEEN ? AND ?', begin_lsn, end_lsn)
+			return cursor.rowcount
+		cursor.execute('CREATE TABLE #kept (start_lsn binary(10) NOT NULL, seqval binary(10) NOT NULL)')
+		try:
+			for i in range(0, len(keep), ACK_CHUNK_SIZE):
+				chunk = keep[i:i + ACK_CHUNK_SIZE]
+				params = []
+				for key in chunk:
+					params.append(pyodbc.Binary(key[:10]))
+					params.append(pyodbc.Binary(key[10:]))
+				sql = 'INSERT INTO #kept (start_lsn, seqval) VALUES ' + ','.join(['(?,?)'] * len(chunk))
+				cursor.execute(sql, params)
+			sql = '''DELETE c FROM ''' + table + ''' c WHERE c.__$start_lsn BETWEEN ? AND ?
+AND NOT EXISTS (SELECT 1 FROM #kept k WHERE k.start_lsn = c.__$start_lsn AND k.seqval = c.__$seqval)'''
+			cursor.execute(sql, begin_lsn, end_lsn)
+			return cursor.rowcount
+		finally:
+			cursor.execute('DROP TABLE #kept')
+
+###################################################################################################
+###################################################################################################
+#
+# class:	ConnectionPool
+# purpose:	Small pool of pyodbc connections for one connection string, shared by all Warehouse
+#			objects in a process, so a long-running process reuses connections across datasets
+#			and sync cycles. Connections are validated when they are borrowed, failed connection
+#			attempts are retried with exponential backoff, and every connection gets the
+#			configured statement timeout.
+#
+###################################################################################################
+
+class ConnectionPool(object):
+	_pools = dict()
+	_lock = threading.Lock()
+	
+	#Returns the pool for a connection string, creating it on first use.
+	@classmethod
+	def get(cls, connectionString, size = 2, timeout = 0, retries = 3, backoff = 0.5):
+		with cls._lock:
+			pool = cls._pools.get(connectionString)
+			if pool is None:
+				pool = ConnectionPool(connectionString, size, timeout, retries, backoff)
+				cls._pools[connectionString] = pool
+			return pool
+	
+	#Returns True if a pyodbc error means the connection is unusable (SQLSTATE class 08).
+	@staticmethod
+	def isConnectionError(e):
+		return len(e.args) > 0 and str(e.args[0]).startswith('08')
+	
+	def __init__(self, connectionString, size, timeout, retries, backoff):
+		self._connectionString = connectionString
+		self._size = size
+		self._timeout = timeout
+		self._retries = retries
+		self._backoff = backoff
+		self._idle = []
+		self._lock = threading.Lock()
+		
+	#Returns a validated idle connection, or a new connection if there is none.
+	def borrow(self):
+		while True:
+			with self._lock:
+				if len(self._idle) == 0:
+					break
+				connection = self._idle.pop()
+			if self.validate(connection):
+				return connection
+			logging.debug('Discarding dead pooled connection')
+			self.discard(connection)
+		return self._connect()
+		
+	def release(self, connection):
+		try:
+			connection.rollback()
+		except:
+			self.discard(connection)
+			return
+		with self._lock:
+			if len(self._idle) < self._size:
+				self._idle.append(connection)
+				return
+		self.discard(connection)
+		
+	def discard(self, connection):
+		try:
+			connection.close()
+		except:
+			None
+			
+	def validate(self, connection):
+		try:
+			connection.execute('SELECT 1').fetchone()
+			return True
+		except:
+			return False
+			
+	#Closes all idle connections.
+	def clear(self):
+		with self._lock:
+			idle = self._idle
+			self._idle = []
+		for connection in idle:
+			self.discard(connection)
+		
+	def _connect(self):
+		attempt = 0
+		while True:
+			try:
+				connection = pyodbc.connect(self._connectionString)
+				connection.timeout = self._timeout
+				return connection
+			except pyodbc.Error as e:
+				if attempt >= self._retries:
+					raise
+				delay = self._backoff * (2 ** attempt)
+				logging.warn('Connection attempt ' + str(attempt + 1) + ' failed, retrying in ' + str(delay) + ' seconds: ' + str(e))
+				time.sleep(delay)
+				attempt = attempt + 1
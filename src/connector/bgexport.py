@@ -1,9 +1,24 @@
-import os, sys, arcpy
-import traceback, logging, uuid
+import os, sys, re, arcpy
+import traceback, logging, uuid, multiprocessing
 import arcpy
 import util
+import maintenance
+import metrics
+import splitter
 from time import strftime
 
+#Configures logging in an export worker process.
+def _initWorker(logFile):
+	msg_format = "%(asctime)s %(levelname)s \t [%(processName)s] %(message)s"
+	logging.basicConfig(filename=logFile, level=logging.DEBUG, format=msg_format)
+
+#Exports, syncs and delivers one replica in a worker process. Returns the replica, its result and its stage timings and counts.
+def _exportReplicaWorker(args):
+	config, replica = args
+	exporter = SdeToWarehouse(config, replica)
+	result = exporter._exportReplica()
+	return (replica, result, exporter._metrics.stages, exporter._metrics.counts)
+
 ###################################################################################################
 ###################################################################################################
 #
@@ -29,15 +44,42 @@ class SdeToWarehouse(object):
 	#	stagingWorkspace:		Path to the Staging Workspace
 	#	productionWorkspace:	Path to the Production Workspace
 	#	stagingEditVersions:	Comma-delimited list of versions in Staging SDE to reconcile and post edits made in ArcGIS by users if autoReconcile is true
-	#	replica:				Name of the the replica to sync.
+	#	replica:				Name of the the replica to sync, or a comma-delimited list of replicas. Each replica is exported, synced and
+	#							delivered as its own pipeline, concurrently in worker processes, with the replica name in its file names.
+	#	exportWorkers:			Optional. Number of replicas to export concurrently. Defaults to the number of replicas.
+	#	maintenanceStatePath:	Optional. Path to the file that stores the compress state of each workspace. See maintenance.CompressScheduler for the thresholds.
+	#	exportMetricsFile:		Optional. Path to the file that receives the stage timings of each run.
+	#	metricsFormat:			Optional. json|prometheus. Defaults to json, one line appended per run.
+	#	splitRecords:			Optional. If greater than 0, the change file is delivered as shards of at most this many records of one dataset,
+	#							with a manifest. See splitter.MessageSplitter.
+	#	splitGzip:				Optional. true|false. If true, shards are gzip compressed.
+	#	skipEmptyMessages:		Optional. true|false. If true, a change file without records is neither synced nor delivered. Defaults to true.
+	#	deliveryManifestPath:	Optional. Path to the file that lists the change files delivered and not yet acknowledged, with a hash of each record.
+	#							If set, a change file whose records were all delivered before is synced but not delivered. See util.DeliveryManifest.
+	#	acknowledgementPath:	Optional. Folder where BG-BASE drops an acknowledgement file, <change file name>.ack, for each change file it loaded.
+	#replica: Optional. Name of the one replica of the list this exporter runs the pipeline of, in a worker process.
+	#	Production is then compressed by the exporter that started the workers.
 	
-	def __init__(self, config):
+	def __init__(self, config, replica = None):
 		self._config = config
+		self._replicaName = replica
 		ts = strftime("%m%d%Y_%H%M%S")
+		if len(self._replicas()) > 1:
+			ts = re.sub(r'[^\w.-]', '_', self._replica()) + '_' + ts
 		self._tempFile = self._tempPath() + '\\temp_' + ts + '.xml'
 		self._exportFile = self._exportPath() + '\\changes_' + ts + '.xml'
+		self._scheduler = maintenance.CompressScheduler(config)
+		self._metrics = metrics.RunMetrics('export', '')
+		self._manifest = None
 		
+	#Exports the change file, syncs staging with production and sends the change file, and writes the metrics of the run.
 	def run(self):
+		self._metrics = metrics.RunMetrics('export', self._config['exportMetricsFile'], self._config['metricsFormat'])
+		result = self._run()
+		self._metrics.write(result)
+		return result
+		
+	def _run(self):
 		func = 'SdeToWarehouse.run'
 		logging.info(" ")
 		logging.info(" ")
@@ -55,29 +97,104 @@ class SdeToWarehouse(object):
 			logging.info('Reconciling edits from edit versions to default in staging')
 			self._reconcileStaging()
 			
+		replicas = self._replicas()
+		if len(replicas) == 1:
+			result = self._exportReplica()
+		else:
+			result = self._exportReplicas(replicas)
+		logging.info("End " + func)
+		logging.info("******************************************************************************")
+		return result
+		
+	#Runs the pipelines of the replicas in worker processes, or one after the other if exportWorkers is 1,
+	#and compresses production once they have all synced. Returns True if every pipeline succeeded.
+	def _exportReplicas(self, replicas):
+		func = '_exportReplicas'
+		logging.info("Begin " + func)
+		num_workers = min(self._exportWorkers(), len(replicas))
+		args = [(self._config, replica) for replica in replicas]
+		if num_workers > 1:
+			logging.info('Exporting ' + str(len(replicas)) + ' replicas with ' + str(num_workers) + ' workers')
+			pool = multiprocessing.Pool(num_workers, _initWorker, (self._config['exportLogFile'],))
+			try:
+				results = pool.map(_exportReplicaWorker, args, 1)
+			finally:
+				pool.close()
+				pool.join()
+		else:
+			results = [_exportReplicaWorker(item) for item in args]
+		
+		num_failed = 0
+		for replica, result, stages, counts in results:
+			self._metrics.addReplica(replica, result == True, stages, counts)
+			if result == True:
+				logging.info('Export of replica ' + replica + ' succeeded')
+			else:
+				num_failed = num_failed + 1
+				logging.error('Export of replica ' + replica + ' failed')
+		
+		if num_failed < len(results):
+			with self._metrics.timer('compressProduction'):
+				if self._scheduler.compress(self._productionWorkspace()):
+					logging.debug("Finished compressing data in Production SDE")
+		logging.info("End " + func)
+		return num_failed == 0
+		
+	#Returns True if the change file was delivered or did not need to be, False if the sync or the delivery failed and None if the export failed.
+	#Returns True if the change file was delivered or did not need to be, False if the sync failed and None if the export failed.
+	def _exportReplica(self):
+		func = '_exportReplica'
+		logging.info("Begin " + func + " " + self._replica())
+		
+		if self._deliveryManifestPath():
+			self._manifest = util.DeliveryManifest(self._deliveryManifestPath())
+		if self._acknowledgementPath():
+			self._processAcknowledgements()
+		
 		logging.info("Exporting XML change file for BG-BASE")
 		if self._exportChangeFile() == False:
 			msg = 'Failed to create XML change file. Make sure that you have sufficient permissions in ' + self._tempPath()
 			arcpy.AddError(msg)
 			logging.error(msg)
 			logging.error("Export change file failed. Sync will not run.")
-			logging.info("******************************************************************************")
+			logging.info("End " + func)
 			return
+			
+		if self._skipEmptyMessages() and not self._hasChanges():
+			logging.info('The XML change file has no changes. Sync and delivery will not run.')
+			self._metrics.count('emptyMessages')
+			self._deleteFile(self._tempFile)
+			logging.info("End " + func)
+			return True
+			
+		hashes = self._recordHashes()
+		delivered = hashes is not None and len(hashes) > 0 and self._manifest.numNew(hashes) == 0
 	
 		logging.info("Synchronizing changes in Staging Default SDE with Production SDE")
 		if self._syncWithProd() == False:
 			logging.error("Failed to sync with prod. Sync will not run.")
-			logging.info("******************************************************************************")
+			logging.info("End " + func)
 			return False
+			
+		if delivered:
+			logging.info('The ' + str(len(hashes)) + ' records of the XML change file were all delivered before. Delivery will not run.')
+			self._metrics.count('duplicateMessages')
+			self._deleteFile(self._tempFile)
+			logging.info("End " + func)
+			return True
 	
 		arcpy.AddMessage("Sending XML change file to BG-BASE folder queue")
 		if self._sendChangeFile() == False:
 			msg = 'Failed to copy XML change file to BG-BASE folder queue. Make sure that you have sufficient permissions in ' + self._exportPath()
 			logging.error(msg)
 			arcpy.AddError(msg)
+			logging.info("End " + func)
+			return False
+		if hashes is not None:
+			self._manifest.add(self._exportName(), hashes)
+			self._manifest.save()
 			
 		logging.info("End " + func)
-		logging.info("******************************************************************************")
 		return True
 		
 	def _reconcileStaging(self):
@@ -90,12 +207,13 @@ class SdeToWarehouse(object):
 			if len(versions) > 0:
 				logging.debug('Found ' + str(len(versions)) + ' edit versions to reconcile.')
 				logging.debug("Reconciling data with Staging DEFAULT")
-				arcpy.ReconcileVersions_management(self._stagingWorkspace(), "ALL_VERSIONS", "dbo.DEFAULT", ";".join(versions), "NO_LOCK_ACQUIRED", "NO_ABORT", "BY_OBJECT", "FAVOR_TARGET_VERSION", "POST", "KEEP_VERSION")
+				with self._metrics.timer('reconcile'):
+					arcpy.ReconcileVersions_management(self._stagingWorkspace(), "ALL_VERSIONS", "dbo.DEFAULT", ";".join(versions), "NO_LOCK_ACQUIRED", "NO_ABORT", "BY_OBJECT", "FAVOR_TARGET_VERSION", "POST", "KEEP_VERSION")
 				logging.debug("Finished reconciling data with Staging DEFAULT")
 			
-			logging.debug("Compressing data in Staging SDE")
-			arcpy.Compress_management(self._stagingWorkspace())
-			logging.debug("Finished compressing data in Staging SDE")
+			with self._metrics.timer('compressStaging'):
+				if self._scheduler.compress(self._stagingWorkspace()):
+					logging.debug("Finished compressing data in Staging SDE")
 		except arcpy.ExecuteError:
 			msgs = arcpy.GetMessages(2)
 			arcpy.AddError(msgs)
@@ -116,7 +234,8 @@ class SdeToWarehouse(object):
 		try:
 			export_file = self._tempFile
 			logging.debug("Exporting data change message to: %s", export_file)
-			arcpy.ExportDataChangeMessage_management(self._stagingWorkspace(), export_file, self._replica(), "DO_NOT_SWITCH", "UNACKNOWLEDGED", "NEW_CHANGES")
+			with self._metrics.timer('exportMessage'):
+				arcpy.ExportDataChangeMessage_management(self._stagingWorkspace(), export_file, self._replica(), "DO_NOT_SWITCH", "UNACKNOWLEDGED", "NEW_CHANGES")
 			result = True
 		except arcpy.ExecuteError:
 			msgs = arcpy.GetMessages(0)
@@ -137,12 +256,16 @@ class SdeToWarehouse(object):
 		logging.info("Begin " + func)
 		try:
 			logging.debug("Synchronizing data from production to staging")
-			arcpy.SynchronizeChanges_management(self._stagingWorkspace(), self._replica(), self._productionWorkspace(), "FROM_GEODATABASE1_TO_2", "IN_FAVOR_OF_GDB1", "BY_OBJECT", "DO_NOT_RECONCILE")
+			with self._metrics.timer('sync'):
+				arcpy.SynchronizeChanges_management(self._stagingWorkspace(), self._replica(), self._productionWorkspace(), "FROM_GEODATABASE1_TO_2", "IN_FAVOR_OF_GDB1", "BY_OBJECT", "DO_NOT_RECONCILE")
 			logging.debug("Finished synchronizing data from production to staging")
 			
-			logging.debug("Compressing data in Production SDE")
-			arcpy.Compress_management(self._productionWorkspace())
-			logging.debug("Finished compressing data in Production SDE")
+			if self._replicaName is None:
+				with self._metrics.timer('compressProduction'):
+					if self._scheduler.compress(self._productionWorkspace()):
+						logging.debug("Finished compressing data in Production SDE")
+			logging.info("End sync with staging")
+			return True
 		except arcpy.ExecuteError:
 			msgs = arcpy.GetMessages(2)
 			arcpy.AddError(msgs)
@@ -154,16 +277,93 @@ class SdeToWarehouse(object):
 			arcpy.AddError(msg)
 			logging.error(msg)
 		logging.info("End sync with staging")
+		return False
+		
+	#Returns True if the change file has at least one record, or if it cannot be read, so it is delivered as before.
+	def _hasChanges(self):
+		try:
+			with self._metrics.timer('scan'):
+				return splitter.hasRecords(self._tempFile)
+		except:
+			logging.warn('Cannot scan ' + self._tempFile + ' for changes: ' + str(sys.exc_info()[1]))
+		return True
+		
+	#Returns the record hashes of the change file if deliveryManifestPath is set, otherwise None.
+	#Also returns None if the change file cannot be read, so it is delivered as before.
+	def _recordHashes(self):
+		if self._manifest is None:
+			return None
+		try:
+			with self._metrics.timer('hash'):
+				hashes = splitter.recordHashes(self._tempFile)
+			num_new = self._manifest.numNew(hashes)
+			logging.info('The XML change file has ' + str(len(hashes)) + ' records, ' + str(len(hashes) - num_new) + ' of them delivered before')
+			self._metrics.count('records', len(hashes))
+			self._metrics.count('recordsDeliveredBefore', len(hashes) - num_new)
+			return hashes
+		except:
+			logging.warn('Cannot hash the records of ' + self._tempFile + ': ' + str(sys.exc_info()[1]))
+		return None
+		
+	#Reads the acknowledgement files BG-BASE dropped in acknowledgementPath, oldest first. An acknowledgement message
+	#exported by BG-BASE is imported into staging, which advances the replica so later change files leave out the
+	#acknowledged changes. An empty marker file only drops the change file from the delivery manifest.
+	#A file that fails to import is kept and retried in the next run.
+	def _processAcknowledgements(self):
+		func = '_processAcknowledgements'
+		logging.info("Begin " + func)
+		try:
+			folder = self._acknowledgementPath()
+			names = [name for name in os.listdir(folder) if name.lower().endswith('.ack') and name.startswith(self._exportPrefix())]
+			names.sort(key = lambda name: os.path.getmtime(os.path.join(folder, name)))
+			for name in names:
+				path = os.path.join(folder, name)
+				try:
+					with self._metrics.timer('acknowledge'):
+						if os.path.getsize(path) > 0:
+							logging.debug('Importing acknowledgement message %s', path)
+							arcpy.ImportMessage_management(self._stagingWorkspace(), path)
+						if self._manifest is not None:
+							num_messages = self._manifest.acknowledge(name[:-len('.ack')])
+							logging.debug('Acknowledged %s delivered change files', num_messages)
+					self._metrics.count('acknowledgements')
+					self._deleteFile(path)
+				except arcpy.ExecuteError:
+					logging.error("ArcGIS error importing acknowledgement %s: %s", path, arcpy.GetMessages(2))
+			if self._manifest is not None:
+				self._manifest.save()
+		except:
+			tb = sys.exc_info()[2]
+			tbinfo = traceback.format_tb(tb)[0]
+			msg = "Error in " + func + ":\n" + tbinfo + "\nError Info:\n" + str(sys.exc_info()[1])
+			arcpy.AddError(msg)
+			logging.error(msg)
+		logging.info("End " + func)
 		return
 		
+	#Delivers the change file to exportPath, so BG-BASE never picks up a partial file. See util.FileDelivery.
+	#If temp files are deleted and tempPath is on the same volume as exportPath, the change file is renamed instead of copied.
+	#If splitRecords is set, the shards are delivered in load order and the manifest last, instead of the change file.
 	def _sendChangeFile(self):
 		result = False
 		func = '_sendChangeFile'
 		logging.info("Begin " + func)
 		try:
-			logging.debug('Copying %s to %s', self._tempFile, self._exportFile)
-			self._copyFile(self._tempFile, self._exportFile)
-			if self._deleteTempFiles():
+			delivery = util.FileDelivery()
+			if self._splitRecords() > 0:
+				files = self._splitChangeFile()
+				with self._metrics.timer('delivery'):
+					for path in files:
+						size = delivery.deliver(path, os.path.join(self._exportPath(), os.path.basename(path)), True)
+						self._metrics.count('deliveredBytes', size)
+				os.rmdir(os.path.dirname(files[0]))
+			else:
+				logging.debug('Delivering %s to %s', self._tempFile, self._exportFile)
+				with self._metrics.timer('delivery'):
+					size = delivery.deliver(self._tempFile, self._exportFile, self._deleteTempFiles())
+				self._metrics.count('deliveredBytes', size)
+			logging.info('Delivered ' + str(self._metrics.counts['deliveredBytes']) + ' bytes to ' + self._exportPath() + ' in ' + str(round(self._metrics.stages['delivery'], 3)) + ' seconds')
+			if self._deleteTempFiles() and os.path.exists(self._tempFile):
 				self._deleteFile(self._tempFile)
 			result = True
 		except:
@@ -175,6 +375,29 @@ class SdeToWarehouse(object):
 		logging.info("End "  + func)
 		return result
 		
+	#Splits the change file into shards and a manifest in a folder of tempPath, which may also be the exportPath.
+	#Returns their paths in delivery order.
+	def _splitChangeFile(self):
+		name = self._exportName()
+		folder = os.path.join(self._tempPath(), '.' + name)
+		if not os.path.exists(folder):
+			os.makedirs(folder)
+		with self._metrics.timer('split'):
+			files = splitter.MessageSplitter(self._splitRecords(), self._splitGzip()).split(self._tempFile, folder, name)
+		self._metrics.count('shards', len(files) - 1)
+		logging.info('Split ' + self._tempFile + ' into ' + str(len(files) - 1) + ' shards of at most ' + str(self._splitRecords()) + ' records')
+		return files
+		
+	#Returns the name of the change file in exportPath without its extension, e.g. changes_10182026_220000.
+	def _exportName(self):
+		return os.path.splitext(os.path.basename(self._exportFile.replace('\\', '/')))[0]
+		
+	#Returns the start of the change file names of this exporter's replica, changes_ or changes_<replica>_ with a list of replicas.
+	def _exportPrefix(self):
+		if len(self._replicas()) > 1:
+			return 'changes_' + re.sub(r'[^\w.-]', '_', self._replica()) + '_'
+		return 'changes_'
+		
 	def _deleteFile(self, path_to_file):
 		try:
 			os.remove(path_to_file)
@@ -182,27 +405,6 @@ class SdeToWarehouse(object):
 			#do nothing
 			None
 		return
-	
-	def _copyFile(self, source, dest):
-		result = False
-		func = '_copyFile'
-		logging.info("Begin " + func)
-		try:
-			with open(source, 'r') as s:
-				with open(dest, 'w') as d:
-					line = s.readline()
-					while line:
-						d.write(line)
-						line = s.readline()
-			result = True
-		except:
-			tb = sys.exc_info()[2]
-			tbinfo = traceback.format_tb(tb)[0]
-			msg = "Error in " + func + ":\n" + tbinfo + "\nError Info:\n" + str(sys.exc_info()[1])
-			arcpy.AddError(msg)
-			logging.error(msg)
-		logging.info("End " + func)
-		return result
 		
 	def _autoReconcile(self):
 		return self._config['autoReconcile'] == 'true'
@@ -210,6 +412,33 @@ class SdeToWarehouse(object):
 	def _deleteTempFiles(self):
 		return self._config['deleteTempFiles'] == 'true'
 		
+	def _splitRecords(self):
+		if self._config['splitRecords']:
+			return int(self._config['splitRecords'])
+		return 0
+		
+	def _splitGzip(self):
+		return self._config['splitGzip'] == 'true'
+		
+	def _skipEmptyMessages(self):
+		return self._config['skipEmptyMessages'] != 'false'
+		
+	def _exportWorkers(self):
+		if self._config['exportWorkers']:
+			return int(self._config['exportWorkers'])
+		return len(self._replicas())
+		
+	#With a list of replicas, each replica has its own manifest, with the replica name before the extension.
+	def _deliveryManifestPath(self):
+		path = self._config['deliveryManifestPath']
+		if path and len(self._replicas()) > 1:
+			root, ext = os.path.splitext(path)
+			return root + '.' + re.sub(r'[^\w.-]', '_', self._replica()) + ext
+		return path
+		
+	def _acknowledgementPath(self):
+		return self._config['acknowledgementPath']
+		
 	def _tempPath(self):
 		return self._config['tempPath']
 		
@@ -226,4 +455,10 @@ class SdeToWarehouse(object):
 		return self._config['productionWorkspace']
 		
 	def _replica(self):
-		return self._config['replica']
+		if self._replicaName:
+			return self._replicaName
+		replicas = self._replicas()
+		return replicas[0] if len(replicas) > 0 else ''
+		
+	def _replicas(self):
+		return [replica.strip() for replica in self._config['replica'].split(',') if replica.strip()]
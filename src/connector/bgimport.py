@@ -1,7 +1,87 @@
-import os, sys, arcpy
-import traceback, logging, uuid
+import os, sys, time, arcpy
+import traceback, logging, multiprocessing
 import arcpy
 import util
+import bgbase
+import changes
+import deadletter
+import sdeapply
+import maintenance
+import metrics
+import profiling
+
+###################################################################################################
+###################################################################################################
+#
+# class:	DatasetResult
+# purpose:	Outcome of importing the changes of one dataset: the number of changes applied and
+#			read by operation, the seconds spent in each stage, the changes.AckList to
+#			acknowledge, and the number of changes queued in the dead letter queue. Changes retried
+#			from the queue are counted apart from the changes read from CDC, as retried and, if
+#			they applied, recovered. Returned by worker processes, so it only holds picklable values.
+#
+###################################################################################################
+
+class DatasetResult(object):
+	def __init__(self, dataset):
+		self.dataset = dataset
+		self.applied = {'insert': 0, 'update': 0, 'delete': 0}
+		self.total = {'insert': 0, 'update': 0, 'delete': 0}
+		self.folded = 0
+		self.timings = dict()
+		self.acknowledged = changes.AckList()
+		self.deadLettered = 0
+		self.deadLetterRetried = 0
+		self.deadLetterRecovered = 0
+		self.error = False
+		
+	#bQueued:	True if the change failed and was stored in the dead letter queue, so its CDC records are acknowledged.
+	def add(self, change, bProcessed, bQueued = False):
+		if change.operation:
+			self.total[change.operation] = self.total[change.operation] + 1
+			if bProcessed:
+				self.applied[change.operation] = self.applied[change.operation] + 1
+		else:
+			self.folded = self.folded + len(change.cdcKeys)
+		if bQueued:
+			self.deadLettered = self.deadLettered + 1
+		self.acknowledged.add(change.cdcKeys, bProcessed or bQueued)
+		
+	#Counts a change retried from the dead letter queue.
+	def addRetry(self, bRecovered):
+		self.deadLetterRetried = self.deadLetterRetried + 1
+		if bRecovered:
+			self.deadLetterRecovered = self.deadLetterRecovered + 1
+		
+	#Returns the number of changes applied to SDE, including the queued changes that were recovered.
+	def numApplied(self):
+		return self.applied['insert'] + self.applied['update'] + self.applied['delete'] + self.deadLetterRecovered
+		
+	def log(self):
+		num_records = self.total['insert'] + self.total['update'] + self.total['delete']
+		num_applied = self.applied['insert'] + self.applied['update'] + self.applied['delete']
+		logging.info("Processed " + str(num_applied) + " out of " + str(num_records) + " database operations for " + self.dataset['table'])
+		logging.debug('Number of inserts: ' + str(self.applied['insert']) + ' out of ' + str(self.total['insert']))
+		logging.debug('Number of updates: ' + str(self.applied['update']) + ' out of ' + str(self.total['update']))
+		logging.debug('Number of deletes: ' + str(self.applied['delete']) + ' out of ' + str(self.total['delete']))
+		logging.debug('Number of change records that cancelled out: ' + str(self.folded))
+		if self.deadLettered > 0 or self.deadLetterRetried > 0:
+			logging.info('Queued ' + str(self.deadLettered) + ' failed changes and recovered ' + str(self.deadLetterRecovered) + ' out of ' + str(self.deadLetterRetried) + ' retried queued changes for ' + self.dataset['table'])
+
+#Configures logging in an import worker process.
+def _initWorker(logFile):
+	msg_format = "%(asctime)s %(levelname)s \t [%(processName)s] %(message)s"
+	logging.basicConfig(filename=logFile, level=logging.DEBUG, format=msg_format)
+
+#Imports one dataset in a worker process, with its own Warehouse connection and ArcGIS session.
+def _importDatasetWorker(args):
+	config, dataset = args
+	warehouse = bgbase.Warehouse.fromConfig(config)
+	try:
+		importer = WarehouseToSde(warehouse, config)
+		return importer._importDataset(dataset)
+	finally:
+		warehouse.close()
 
 ###################################################################################################
 ###################################################################################################
@@ -25,14 +105,49 @@ class WarehouseToSde(object):
 	#	stagingWorkspace:		Path to the Staging Workspace
 	#	productionWorkspace:	Path to the Production Workspace
 	#	bgbaseEditVersion:		Version name to perform the edits in
-	#	replica:				Name of the the replica to sync.
+	#	replica:				Name of the the replica to sync, or a comma-delimited list of replicas, each synced when its changes are due.
+	#	coalesceChanges:		Optional. true|false. If true, folds the CDC records of each key into one net change.
+	#	netChanges:				Optional. true|false. If true, reads net changes with the fn_cdc_get_net_changes_* functions.
+	#	bulkApply:				Optional. true|false. If true, applies the changes of each dataset set-based with arcpy.da cursors.
+	#	bulkChunkSize:			Optional. Number of rows per bulk cursor. Defaults to 500.
+	#	checkpointPath:			Optional. Path to the file that stores the last applied LSN of each dataset.
+	#	clearCdcRecords:		Optional. true|false. If false and checkpointPath is set, applied CDC records are not deleted.
+	#	fetchSize:				Optional. Number of change records to fetch and apply at a time. Defaults to 1000.
+	#	maintenanceStatePath:	Optional. Path to the file that stores the compress state of each workspace and the changes pending for the replica.
+	#							See maintenance.CompressScheduler and maintenance.SyncScheduler for the thresholds.
+	#	editOperationSize:		Optional. If greater than 0, applies the changes of each dataset in one arcpy.da.Editor session, in edit operations of this many changes.
+	#	maxWorkers:				Optional. Number of datasets to import concurrently in worker processes. Defaults to 1.
+	#	importMetricsFile:		Optional. Path to the file that receives the stage timings and row counts of each run.
+	#	metricsFormat:			Optional. json|prometheus. Defaults to json, one line appended per run.
+	#	profile:				Optional. true|dataset|false. If dataset, the import of each dataset is profiled with cProfile into its own pstats file.
+	#							Whole runs are profiled by the warehouse_to_sde script, see profiling.runProfiled.
+	#	deadLetterPath:			Optional. Path to the SQLite file that keeps the changes that failed to apply, see deadletter.DeadLetterQueue.
+	#	deadLetterBackoff:		Optional. Seconds before the first retry of a failed change. Defaults to 60.
+	#	deadLetterMaxAttempts:	Optional. Number of attempts after which a failed change is only retried when replayed. Defaults to 10.
 
 	def __init__(self, warehouse, config):
 		self._warehouse = warehouse
 		self._config = config
 		self._dbutil = util.DBUtil()
+		self._keyIndexes = dict()
+		self._fieldPlans = dict()
+		self._scheduler = maintenance.CompressScheduler(config)
+		self._syncScheduler = maintenance.SyncScheduler(config)
+		self._replicaDatasets = dict()
+		self._numReplicaChanges = dict()
+		self._metrics = metrics.RunMetrics('import', '')
+		self._deadLetters = None
+		self._errors = deadletter.ErrorCapture()
 		
+	#Imports the changes and synchronizes staging with production, and writes the metrics of the run.
+	#Returns False if the run failed.
 	def run(self):
+		self._metrics = metrics.RunMetrics('import', self._config['importMetricsFile'], self._config['metricsFormat'])
+		result = self._run()
+		self._metrics.write(result)
+		return result
+		
+	def _run(self):
 		func = 'WarehouseToSde.run'
 		logging.info(" ")
 		logging.info(" ")
@@ -44,7 +159,7 @@ class WarehouseToSde(object):
 			logging.error('Invalid config file.')
 			logging.info('End ' + func);
 			logging.info("******************************************************************************")
-			return
+			return False
 			
 		lockfile = util.LockFile(self._config['lockFilePath'])
 		if lockfile.locked():
@@ -52,98 +167,147 @@ class WarehouseToSde(object):
 			logging.info('If WarehouseToSde is not running, then delete the file %s', self._config['lockFilePath'])
 			logging.info('End ' + func);
 			logging.info("******************************************************************************")
-			return
+			return False
 		lockfile.lock()
+		
+		#changes left pending by earlier runs are synced before the import if they are due, so a run started by the
+		#launcher keeps Production within syncMaxSeconds of them however long the import takes
+		if self._syncReplicas() == False:
+			logging.warn('Failed to sync the changes pending from earlier runs, the sync is retried after the import')
 			
 		num_changes = self._importChanges()
-		if num_changes < 1:
+		if num_changes < 0:
 			lockfile.unlock()
-			if num_changes == 0:
-				logging.info('There are no changes from Warehouse. SDE sync will not run')
-			else:
-				logging.info('Failed to refresh staging from Warehouse. SDE sync will not run')
+			logging.info('Failed to refresh staging from Warehouse. SDE sync will not run')
 			logging.info("End " + func)
 			logging.info("******************************************************************************")
-			return
+			return False
 			
-		if self._reconcileStaging() == False:
-			lockfile.unlock()
-			logging.info('Failed to reconcile data in staging between versions. SDE sync will not run')
-			logging.info("End " + func)
-			logging.info("******************************************************************************")
-			return
+		if num_changes == 0:
+			logging.info('There are no changes from Warehouse')
+		else:
+			self._scheduler.record(self._stagingWorkspace(), num_changes)
+			if self._reconcileStaging() == False:
+				lockfile.unlock()
+				logging.info('Failed to reconcile data in staging between versions. SDE sync will not run')
+				logging.info("End " + func)
+				logging.info("******************************************************************************")
+				return False
+			for replica in self._replicas():
+				self._syncScheduler.record(replica, self._numReplicaChanges.get(replica, 0))
 			
-		if self._syncWithProd() == False:
+		if self._syncReplicas() == False:
 			lockfile.unlock()
-			logging.info('Failed to sync data between staging to production. SDE sync will not run')
+			logging.info('Failed to sync data between staging to production')
 			logging.info("End " + func)
 			logging.info("******************************************************************************")
-			return
+			return False
 		
 		lockfile.unlock()
 		logging.info("End " + func)
 		logging.info("******************************************************************************")
-		return
+		return True
+		
+	#Syncs the changes pending for the replicas if a sync is due, without importing.
+	#Called by long-running processes between imports, so pending changes reach production within syncMaxSeconds.
+	def flushSync(self):
+		if not True in [self._syncScheduler.due(replica)[0] for replica in self._replicas()]:
+			return True
+		lockfile = util.LockFile(self._config['lockFilePath'])
+		if lockfile.locked():
+			return False
+		lockfile.lock()
+		try:
+			return self._syncReplicas()
+		finally:
+			lockfile.unlock()
+		
+	#Syncs each replica whose sync is due, then compresses production once if a replica was synced.
+	#Returns False if a sync failed, in which case the changes of that replica stay pending.
+	def _syncReplicas(self):
+		result = True
+		num_synced = 0
+		for replica in self._replicas():
+			synced = self._syncReplica(replica)
+			if synced == False:
+				result = False
+			elif synced:
+				num_synced = num_synced + 1
+		if num_synced > 0:
+			with self._metrics.timer('compressProduction'):
+				if self._scheduler.compress(self._productionWorkspace()):
+					logging.debug("Finished compressing data in Production SDE")
+		return result
+		
+	#Syncs staging with production if enough replica changes are pending. Returns False if the sync failed,
+	#in which case the changes stay pending, and None if the sync is not due.
+	def _syncReplica(self, replica):
+		due, reason = self._syncScheduler.due(replica)
+		if not due:
+			logging.info('Skipping sync of ' + replica + ': ' + reason)
+			return None
+		logging.info('Synchronizing ' + replica + ': ' + reason)
+		self._scheduler.record(self._productionWorkspace(), self._syncScheduler.pending(replica))
+		if self._syncWithProd(replica) == False:
+			return False
+		self._syncScheduler.synced(replica)
+		return True
+		
+	#Returns True if the dataset is in the replica, or if the replica's datasets cannot be listed.
+	def _inReplica(self, dataset, replica):
+		if not replica in self._replicaDatasets:
+			self._replicaDatasets[replica] = self._syncScheduler.replicaDatasets(self._stagingWorkspace(), replica)
+		if self._replicaDatasets[replica] is None:
+			return True
+		return dataset['table'].split('.')[-1].lower() in self._replicaDatasets[replica]
 		
 	def _importChanges(self):
 		func = 'WarehouseToSde._importChanges'
 		logging.info('Begin ' + func)
-		bImport = False
 		deleteList = dict()
 		datasets = None
 		num_total = 0
+		checkpoints = None
+		self._numReplicaChanges = dict()
+		self._keyIndexes = dict()
+		self._fieldPlans = dict()
 		try:
-			datasets = self._warehouse.getSyncDatasets()
-			num_updates = 0
-			num_updates_total = 0
-			num_inserts = 0
-			num_inserts_total = 0
-			num_deletes = 0
-			num_deletes_total = 0
-			num_records = 0
-			for dataset in datasets:
-				cursor = self._warehouse.getChanges(dataset)
-				fields = self._dbutil.getColumns(cursor)
-				if cursor is not None:
-					logging.info("Begin iterating through change records")
-					for row in cursor:
-						operation = self._warehouse.getOperationType(row)
-						bProcessed = False
-						if operation == "insert":
-							num_inserts_total = num_inserts_total + 1
-							if self._processInserts(dataset, row, fields) == True:
-								num_inserts = num_inserts + 1
-								bProcessed = True
-						elif operation == "update":
-							num_updates_total = num_updates_total + 1
-							if self._processUpdates(dataset, row, fields) == True:
-								num_updates = num_updates + 1
-								bProcessed = True
-						elif operation == "delete":
-							num_deletes_total = num_deletes_total + 1
-							if self._processDeletes(dataset, row, fields) == True:
-								num_deletes = num_deletes + 1
-								bProcessed = True
-						else:
-							continue
-							
-						if bProcessed:
-							if not (dataset['cdc_table'] in deleteList):
-								deleteList[dataset['cdc_table']] = []
-							deleteList[dataset['cdc_table']].append(row[fields['__$CDCKEY']])
-						
-						num_records = num_records + 1
-					cursor.close()
-					del cursor
-					cursor = None
-					
-					num_total = num_inserts + num_updates + num_deletes
-					logging.info("Processed " + str(num_total) + " out of " + str(num_records) + " database operations")
-					logging.debug('Number of inserts: ' + str(num_inserts) + ' out of ' + str(num_inserts_total))
-					logging.debug('Number of updates: ' + str(num_updates) + ' out of ' + str(num_updates_total))
-					logging.debug('Number of deletes: ' + str(num_deletes) + ' out of ' + str(num_deletes_total))
-					
-					logging.info("End iterating through change records")
+			with self._metrics.timer('getSyncDatasets'):
+				datasets = self._warehouse.getSyncDatasets()
+			if self._checkpointPath():
+				checkpoints = util.CheckpointStore(self._checkpointPath())
+				for dataset in datasets:
+					dataset['last_lsn'] = checkpoints.get(dataset['cdc_table'])
+					#after a resync, CDC records that were captured late may already be in the rows it loaded
+					dataset['upsert'] = checkpoints.upsertUntil(dataset['cdc_table']) is not None
+			
+			with self._metrics.timer('datasets'):
+				if self._maxWorkers() > 1 and len(datasets) > 1:
+					results = self._importParallel(datasets)
+				else:
+					results = [self._importDataset(dataset) for dataset in datasets]
+			
+			datasets = []
+			num_errors = 0
+			for result in results:
+				self._metrics.addDataset(result.dataset['table'], result.timings, result.applied, result.total, result.folded, result.error)
+				if result.deadLettered > 0:
+					self._metrics.count('deadLettered', result.deadLettered)
+				if result.deadLetterRetried > 0:
+					self._metrics.count('deadLetterRetried', result.deadLetterRetried)
+					self._metrics.count('deadLetterRecovered', result.deadLetterRecovered)
+				if result.error:
+					num_errors = num_errors + 1
+					continue
+				datasets.append(result.dataset)
+				if result.acknowledged.acknowledged > 0:
+					deleteList[result.dataset['cdc_table']] = result.acknowledged
+				num_total = num_total + result.numApplied()
+				for replica in self._replicas():
+					if self._inReplica(result.dataset, replica):
+						self._numReplicaChanges[replica] = self._numReplicaChanges.get(replica, 0) + result.numApplied()
+			if num_errors > 0 and num_errors == len(results):
+				num_total = -1
 		except:
 			num_total = -1
 			tb = sys.exc_info()[2]
@@ -151,10 +315,202 @@ class WarehouseToSde(object):
 			msg = "Error in " + func + ":\n" + tbinfo + "\nError Info:\n" + str(sys.exc_info()[1])
 			logging.error(msg)
 		finally:
-			if num_total > 0:
-				self._warehouse.clearChanges(deleteList, datasets)
+			if num_total > 0 or (num_total == 0 and len(deleteList) > 0):
+				if not self._clearCdcRecords():
+					deleteList = dict()
+				with self._metrics.timer('clearChanges'):
+					self._warehouse.clearChanges(deleteList, datasets)
+				if checkpoints is not None:
+					for dataset in datasets:
+						if dataset.get('end_lsn') is not None:
+							checkpoints.set(dataset['cdc_table'], dataset['end_lsn'])
+					with self._metrics.timer('checkpoint'):
+						checkpoints.save()
 			logging.info('End ' + func)
 		return num_total
+	
+	#Imports the datasets in a pool of worker processes, each with its own Warehouse connection
+	#and ArcGIS session. Returns the DatasetResults in the order of the datasets.
+	def _importParallel(self, datasets):
+		num_workers = min(self._maxWorkers(), len(datasets))
+		logging.info('Importing ' + str(len(datasets)) + ' datasets with ' + str(num_workers) + ' workers')
+		pool = multiprocessing.Pool(num_workers, _initWorker, (self._config['importLogFile'],))
+		try:
+			return pool.map(_importDatasetWorker, [(self._config, dataset) for dataset in datasets], 1)
+		finally:
+			pool.close()
+			pool.join()
+	
+	#Reads and applies the changes of one dataset, under cProfile if profile is dataset. Returns a DatasetResult.
+	def _importDataset(self, dataset):
+		if self._config['profile'] == 'dataset':
+			path = profiling.profilePath(self._config['importLogFile'], 'warehouse_to_sde.' + dataset['table'])
+			return profiling.profileCall(path, self._applyDataset, dataset)
+		return self._applyDataset(dataset)
+		
+	#The time spent in the read loop outside of applying the batches is reported as the fetch stage.
+	#Changes in the dead letter queue are retried before the new CDC records are read.
+	def _applyDataset(self, dataset):
+		func = 'WarehouseToSde._importDataset'
+		result = DatasetResult(dataset)
+		cursor = None
+		try:
+			queue = self._deadLetterQueue()
+			if queue is not None:
+				self._errors.start()
+				with metrics.Timer(result.timings, 'retry'):
+					self._retryDeadLetters(dataset, queue, result)
+			with metrics.Timer(result.timings, 'getChanges'):
+				cursor = self._warehouse.getChanges(dataset, self._netChanges())
+			if cursor is None:
+				#a failed read must not move LAST_SYNC_DATE or the checkpoint past the window
+				if dataset.get('read_error'):
+					logging.error('Failed to read the changes of ' + dataset['table'])
+					result.error = True
+				return result
+			fields = self._dbutil.getColumns(cursor)
+			logging.info("Begin iterating through change records for " + dataset['table'])
+			reader = changes.ChangeReader(self._warehouse, dataset, fields, self._appliedColumns(dataset, fields), self._readMode(), self._fetchSize())
+			fields = reader.fields
+			session = None
+			#arcpy.da cursors only write versioned data in an edit session, so bulk apply always opens one
+			if self._editOperationSize() > 0 or self._bulkApply():
+				session = sdeapply.EditSession(self._stagingWorkspace(), self._keyIndex(dataset), max(self._editOperationSize(), 1))
+				session.start()
+			start = time.time()
+			try:
+				for batch in reader.batches(cursor):
+					with metrics.Timer(result.timings, 'apply'):
+						self._applyBatch(dataset, batch, fields, session)
+					for change in batch:
+						queued = self._deadLetter(queue, dataset, change, fields)
+						result.add(change, change.applied == True, queued)
+			finally:
+				result.timings['fetch'] = time.time() - start - result.timings.get('apply', 0.0)
+				if session is not None:
+					with metrics.Timer(result.timings, 'saveEdits'):
+						session.stop()
+			result.log()
+			logging.info("End iterating through change records for " + dataset['table'])
+		except:
+			result.error = True
+			tb = sys.exc_info()[2]
+			tbinfo = traceback.format_tb(tb)[0]
+			msg = "Error in " + func + ":\n" + tbinfo + "\nError Info:\n" + str(sys.exc_info()[1])
+			logging.error(msg)
+		finally:
+			self._errors.stop()
+			self._dbutil.close(cursor)
+		return result
+		
+	#Applies the changes of a dataset that are due for a retry in the dead letter queue, row by row and in the order they
+	#were queued. Changes that fail again wait twice as long for the next retry.
+	def _retryDeadLetters(self, dataset, queue, result):
+		entries = queue.due(dataset)
+		if len(entries) == 0:
+			return
+		logging.info('Retrying ' + str(len(entries)) + ' queued changes for ' + dataset['table'])
+		plan_fields = None
+		for id, change, fields in entries:
+			#the plan is compiled for the columns of the queued rows, which may differ from those of the change cursor
+			if fields != plan_fields:
+				self._fieldPlans.pop(dataset['table'], None)
+				plan_fields = fields
+			if self._applyRow(dataset, change, fields) or self._isDeleted(dataset, change):
+				change.applied = True
+				queue.succeeded(dataset, id, change)
+			else:
+				queue.failed(id, change.error)
+			result.addRetry(change.applied == True)
+		self._fieldPlans.pop(dataset['table'], None)
+		
+	#Stores a change that failed to apply in the dead letter queue and returns True if it was stored. Drops the queued
+	#change of a key once a newer change for it was applied. A failed delete of a row that is not in SDE counts as applied.
+	def _deadLetter(self, queue, dataset, change, fields):
+		if queue is None or not change.operation:
+			return False
+		if change.applied != True and self._isDeleted(dataset, change):
+			change.applied = True
+		if change.applied == True:
+			queue.applied(dataset, change)
+			return False
+		return queue.add(dataset, change, fields, change.error)
+		
+	#Returns True if the change is a delete and its row is not in SDE, so there is nothing left to retry.
+	def _isDeleted(self, dataset, change):
+		return change.operation == 'delete' and not self._keyIndex(dataset).contains(change.key)
+			
+	#Returns how the changes of a dataset are read: "net", "coalesce" or "each".
+	#Bulk apply groups changes by operation, so it always works on net changes.
+	def _readMode(self):
+		if self._netChanges():
+			return 'net'
+		if self._coalesceChanges() or self._bulkApply():
+			return 'coalesce'
+		return 'each'
+		
+	#Returns the change cursor columns that are applied to the dataset's feature class.
+	def _appliedColumns(self, dataset, fields):
+		feature_class = os.path.join(self._stagingWorkspace(), dataset['table'])
+		names = set([field.name for field in arcpy.ListFields(feature_class)])
+		names.update([dataset['pkfield'], dataset['xfield'], dataset['yfield']])
+		return [name for name in fields if name in names]
+		
+	#Applies a batch of changes, in bulk if configured, and row by row for the changes that were not applied in bulk.
+	#The bulk apply is one edit operation of the session, and the rows are applied in operations of editOperationSize,
+	#or one operation per row if editOperationSize is 0.
+	def _applyBatch(self, dataset, batch, fields, session):
+		if self._bulkApply() and self._canApplyBulk(dataset, fields):
+			feature_class = os.path.join(self._stagingWorkspace(), dataset['table'])
+			applier = sdeapply.BulkApplier(dataset, feature_class, self._fieldPlan(dataset, fields), self._keyIndex(dataset), self._bulkChunkSize())
+			if not session.operation(batch, lambda changes: self._applyBulk(applier, changes)):
+				logging.warn('Bulk edit operation failed for ' + dataset['table'] + ', applying the batch row by row')
+		apply = lambda change: self._applyRow(dataset, change, fields)
+		if session is None:
+			for change in batch:
+				apply(change)
+		else:
+			session.apply([change for change in batch if change.applied is None], apply)
+		
+	#Returns True if the field plan of the dataset has its PK_FIELD, which the bulk apply matches changes to rows with.
+	#Otherwise logs an error once and the changes are applied row by row.
+	def _canApplyBulk(self, dataset, fields):
+		if dataset['pkfield'] in self._fieldPlan(dataset, fields).names:
+			return True
+		if not dataset.get('bulk_error'):
+			logging.error(dataset['pkfield'] + ' is not a field of ' + dataset['table'] + ' in SDE, applying its changes row by row')
+			dataset['bulk_error'] = True
+		return False
+		
+	#Applies changes with a sdeapply.BulkApplier and returns True if every change was applied.
+	def _applyBulk(self, applier, changes):
+		applier.apply(changes)
+		for change in changes:
+			if change.operation and change.applied != True:
+				return False
+		return True
+		
+	#Applies one change row by row and returns True if it was applied. Changes that cancelled out are always applied.
+	def _applyRow(self, dataset, change, fields):
+		operation = change.operation
+		if operation == "insert":
+			return self._applyChange(self._processInserts, dataset, change, fields)
+		elif operation == "update":
+			return self._applyChange(self._processUpdates, dataset, change, fields)
+		elif operation == "delete":
+			return self._applyChange(self._processDeletes, dataset, change, fields)
+		#changes for this key cancelled out, there is nothing to apply
+		change.applied = True
+		return True
+		
+	#Applies a change row by row with process, unless it has already been applied in bulk.
+	def _applyChange(self, process, dataset, change, fields):
+		if change.applied is None:
+			self._errors.message = None
+			change.applied = process(dataset, change.row, fields) == True
+			if not change.applied:
+				change.error = self._errors.message
+		return change.applied
 			
 	def _processInserts(self, dataset, row, fields):
 		func = 'WarehouseToSde._processInserts'
@@ -163,17 +519,20 @@ class WarehouseToSde(object):
 		bInsert = False
 		try:
 			key = row[fields[dataset['pkfield']]]
-			layer = self._makeLayer(dataset, row, key)
-			num_records = int(arcpy.GetCount_management(layer).getOutput(0))
-			if num_records > 0:
+			keyIndex = self._keyIndex(dataset)
+			if keyIndex.contains(key) and dataset.get('upsert'):
+				logging.debug('Record ' + str(key) + ' was loaded by a resync, updating it instead of inserting')
+				return self._processUpdates(dataset, row, fields)
+			if keyIndex.contains(key):
 				logging.error('Cannot insert record ' + str(key) + '. Record already exists')
 			else:
 				feature_class = os.path.join(self._stagingWorkspace(), dataset['table'])
 				features = arcpy.InsertCursor(feature_class)
-				field_names = self._getFieldNames(feature_class)
+				plan = self._fieldPlan(dataset, fields)
 				feature = features.newRow()
-				if self._loadFeature(feature, row, dataset, field_names, fields) == True:
+				if self._loadFeature(feature, row, plan) == True:
 					features.insertRow(feature)
+					keyIndex.add(key)
 					logging.debug('Successfully inserted record ' + str(key))
 					bInsert = True
 				else:
@@ -202,15 +561,18 @@ class WarehouseToSde(object):
 		bUpdate = False
 		try:
 			key = row[fields[dataset['pkfield']]]
+			if not self._keyIndex(dataset).contains(key):
+				logging.warn('Record ' + str(key) + ' does not exist, inserting it instead of updating')
+				return self._processInserts(dataset, row, fields)
 			where_clause = dataset['pkfield'] + " = " + str(key)
 			feature_class = os.path.join(self._stagingWorkspace(), dataset['table'])
 			features = arcpy.UpdateCursor(feature_class, where_clause)
-			field_names = self._getFieldNames(feature_class)
+			plan = self._fieldPlan(dataset, fields)
 			
 			num_features = 0
 			for feature in features:
 				num_features = num_features + 1
-				if self._loadFeature(feature, row, dataset, field_names, fields) == True:
+				if self._loadFeature(feature, row, plan) == True:
 					features.updateRow(feature)
 					logging.debug('Successfully updated record ' + str(key))
 					bUpdate = True
@@ -226,6 +588,7 @@ class WarehouseToSde(object):
 				if features:
 					del features
 					features = None
+				self._keyIndex(dataset).remove(key)
 				bUpdate = self._processInserts(dataset, row, fields)
 		except arcpy.ExecuteError:
 			msgs = arcpy.GetMessages(0)
@@ -262,6 +625,8 @@ class WarehouseToSde(object):
 				logging.debug('Successfully deleted record ' + str(key))
 				
 			bDelete = num_features > 0
+			if bDelete:
+				self._keyIndex(dataset).remove(key)
 		except arcpy.ExecuteError:
 			msgs = arcpy.GetMessages(0)
 			arcpy.AddError(msgs)
@@ -288,40 +653,75 @@ class WarehouseToSde(object):
 	def _bgbaseEditVersion(self):
 		return self._config['bgbaseEditVersion']
 		
-	def _replica(self):
-		return self._config['replica']
+	def _replicas(self):
+		return [replica.strip() for replica in self._config['replica'].split(',') if replica.strip()]
 		
-	def _makeLayer(self, dataset, row, key):
-		where_clause = dataset['pkfield'] + " = " + str(key)
-		feature_class = os.path.join(self._stagingWorkspace(), dataset['table'])
-		layer_name = "lyr" + str(uuid.uuid1()).replace("-", "")
-		arcpy.MakeFeatureLayer_management(feature_class, layer_name, where_clause)
-		arcpy.ChangeVersion_management(layer_name,'TRANSACTIONAL', self._bgbaseEditVersion(),'')
-		return layer_name
-		
-	def _getFieldNames(self, feature_class):
-		fields = arcpy.ListFields(feature_class)
-		names = []
-		for field in fields:
-			if field.type == "OID" or field.type == "Geometry":
-				continue
-			names.append(field.name)
-		return names
+	def _coalesceChanges(self):
+		return self._config['coalesceChanges'] == 'true'
+		
+	def _netChanges(self):
+		return self._config['netChanges'] == 'true'
+		
+	def _maxWorkers(self):
+		if self._config['maxWorkers']:
+			return int(self._config['maxWorkers'])
+		return 1
+		
+	def _checkpointPath(self):
+		return self._config['checkpointPath']
+		
+	#CDC records can only be kept when high-water marks are used, otherwise they would be read again
+	def _clearCdcRecords(self):
+		return self._config['clearCdcRecords'] != 'false' or not self._checkpointPath()
+		
+	def _bulkApply(self):
+		return self._config['bulkApply'] == 'true'
+		
+	def _editOperationSize(self):
+		if self._config['editOperationSize']:
+			return int(self._config['editOperationSize'])
+		return 0
+		
+	def _fetchSize(self):
+		if self._config['fetchSize']:
+			return int(self._config['fetchSize'])
+		return 1000
+		
+	def _bulkChunkSize(self):
+		if self._config['bulkChunkSize']:
+			return int(self._config['bulkChunkSize'])
+		return 500
+		
+	#Returns the DeadLetterQueue, opened on first use, or None if deadLetterPath is not set.
+	def _deadLetterQueue(self):
+		if self._deadLetters is None and self._config['deadLetterPath']:
+			backoff = float(self._config['deadLetterBackoff']) if self._config['deadLetterBackoff'] else 60
+			max_attempts = int(self._config['deadLetterMaxAttempts']) if self._config['deadLetterMaxAttempts'] else 10
+			self._deadLetters = deadletter.DeadLetterQueue(self._config['deadLetterPath'], backoff, max_attempts)
+		return self._deadLetters
+		
+	#Returns the KeyIndex of a dataset, loading it on first use in a run.
+	def _keyIndex(self, dataset):
+		keyIndex = self._keyIndexes.get(dataset['table'])
+		if keyIndex is None:
+			feature_class = os.path.join(self._stagingWorkspace(), dataset['table'])
+			keyIndex = sdeapply.KeyIndex(feature_class, dataset['pkfield'], self._bgbaseEditVersion())
+			self._keyIndexes[dataset['table']] = keyIndex
+		return keyIndex
+		
+	#Returns the FieldPlan of a dataset, compiled on first use in a run.
+	def _fieldPlan(self, dataset, fields):
+		plan = self._fieldPlans.get(dataset['table'])
+		if plan is None:
+			feature_class = os.path.join(self._stagingWorkspace(), dataset['table'])
+			plan = sdeapply.FieldPlan.get(dataset, feature_class, fields)
+			self._fieldPlans[dataset['table']] = plan
+		return plan
 	
-	def _loadFeature(self, feature, row, dataset, feature_fields, row_fields):
+	def _loadFeature(self, feature, row, plan):
+		func = 'WarehouseToSde._loadFeature'
 		try:
-			for field_name in feature_fields:
-				if row_fields.has_key(field_name):
-					new_value = row[row_fields[field_name]]
-					feature.setValue(field_name, new_value)
-				elif field_name != "GlobalID":
-					logging.warn(field_name + " not found in Warehouse")
-
-			if dataset['xfield'] is not None and dataset['yfield'] is not None:
-				x = row[row_fields[dataset['xfield']]]
-				y = row[row_fields[dataset['yfield']]]
-				if x is not None and y is not None:
-					feature.shape = arcpy.PointGeometry(arcpy.Point(x, y))
+			plan.load(feature, row)
 			return True
 		except arcpy.ExecuteError:
 			msgs = arcpy.GetMessages(0)
@@ -340,12 +740,13 @@ class WarehouseToSde(object):
 		logging.info("Begin " + func)
 		try:
 			logging.debug("Reconciling data from staging BG-BASE to staging DEFAULT")
-			arcpy.ReconcileVersions_management(self._stagingWorkspace(), "ALL_VERSIONS", "dbo.DEFAULT", self._bgbaseEditVersion(), "NO_LOCK_ACQUIRED", "NO_ABORT", "BY_OBJECT", "FAVOR_TARGET_VERSION", "POST", "KEEP_VERSION")
+			with self._metrics.timer('reconcile'):
+				arcpy.ReconcileVersions_management(self._stagingWorkspace(), "ALL_VERSIONS", "dbo.DEFAULT", self._bgbaseEditVersion(), "NO_LOCK_ACQUIRED", "NO_ABORT", "BY_OBJECT", "FAVOR_TARGET_VERSION", "POST", "KEEP_VERSION")
 			logging.debug("Finished reconciling data from staging GIS to staging DEFAULT")
 			
-			logging.debug("Compressing data in Staging SDE")
-			arcpy.Compress_management(self._stagingWorkspace())
-			logging.debug("Finished compressing data in Staging SDE")
+			with self._metrics.timer('compressStaging'):
+				if self._scheduler.compress(self._stagingWorkspace()):
+					logging.debug("Finished compressing data in Staging SDE")
 			return True
 		except arcpy.ExecuteError:
 			msgs = arcpy.GetMessages(2)
@@ -360,17 +761,14 @@ class WarehouseToSde(object):
 		logging.info("End " + func)
 		return False
 		
-	def _syncWithProd(self):
+	def _syncWithProd(self, replica):
 		func = '_syncWithProd'
 		logging.info("Begin " + func)
 		try:
 			logging.debug("Synchronizing data from staging to production")
-			arcpy.SynchronizeChanges_management(self._stagingWorkspace(), self._replica(), self._productionWorkspace(), "FROM_GEODATABASE1_TO_2", "IN_FAVOR_OF_GDB1", "BY_OBJECT", "DO_NOT_RECONCILE")
+			with self._metrics.timer('sync'):
+				arcpy.SynchronizeChanges_management(self._stagingWorkspace(), replica, self._productionWorkspace(), "FROM_GEODATABASE1_TO_2", "IN_FAVOR_OF_GDB1", "BY_OBJECT", "DO_NOT_RECONCILE")
 			logging.debug("Finished synchronizing data from production to staging")
-			
-			logging.debug("Compressing data in Production SDE")
-			arcpy.Compress_management(self._productionWorkspace())
-			logging.debug("Finished compressing data in Production SDE")
 			return True
 		except arcpy.ExecuteError:
 			msgs = arcpy.GetMessages(2)
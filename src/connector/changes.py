@@ -0,0 +1,211 @@
+import sys, traceback, logging, binascii
+from collections import OrderedDict
+from operator import itemgetter
+
+###################################################################################################
+###################################################################################################
+#
+# class:	Change
+# purpose:	A single net change for one primary key of a dataset. Holds the operation to apply,
+#			the CDC row with the image to apply, and the __$CDCKEY values of every CDC record that
+#			was folded into the change, so all of them can be acknowledged in clearChanges.
+#
+###################################################################################################
+
+class Change(object):
+	__slots__ = ('operation', 'key', 'row', 'cdcKeys', 'applied', 'error')
+	
+	#operation:	"insert", "update", "delete", or "" if the changes for the key cancelled out.
+	#key:		Value of the dataset's PK_FIELD.
+	#row:		CDC row that holds the image to apply.
+	#cdcKeys:	List of __$CDCKEY values of the CDC records folded into this change.
+	#applied:	None until the change is applied, then True or False.
+	#error:		Last error logged while the change was applied row by row, if it failed.
+	def __init__(self, operation, key, row, cdcKeys):
+		self.operation = operation
+		self.key = key
+		self.row = row
+		self.cdcKeys = cdcKeys
+		self.applied = None
+		self.error = None
+
+###################################################################################################
+###################################################################################################
+#
+# class:	ChangeCoalescer
+# purpose:	Turns the CDC records of a dataset into Change objects. In coalesce mode, all records
+#			for one PK_FIELD value are folded into a single net operation:
+#				insert + delete				-> nothing to apply, records are still acknowledged
+#				insert + update(s)			-> insert of the final image
+#				update(s)					-> update with the last after-image
+#				update(s) + delete			-> delete
+#				delete + insert				-> update with the inserted image
+#			Records must be read in __$start_lsn, __$seqval order.
+#
+###################################################################################################
+
+class ChangeCoalescer(object):
+	#(net operation so far, next operation) -> new net operation
+	_FOLD = {
+		('insert', 'insert'): 'insert',
+		('insert', 'update'): 'insert',
+		('insert', 'delete'): '',
+		('update', 'insert'): 'update',
+		('update', 'update'): 'update',
+		('update', 'delete'): 'delete',
+		('delete', 'insert'): 'update',
+		('delete', 'update'): 'update',
+		('delete', 'delete'): 'delete',
+		('', 'insert'): 'insert',
+		('', 'update'): 'update',
+		('', 'delete'): 'delete'
+	}
+
+	#warehouse:	bgbase.Warehouse object that returned the cursor.
+	#dataset:	Dataset dictionary from Warehouse.getSyncDatasets.
+	#fields:	Column name -> index dictionary of the change cursor.
+	def __init__(self, warehouse, dataset, fields):
+		self._warehouse = warehouse
+		self._dataset = dataset
+		self._fields = fields
+
+	#Yields one Change per CDC record, without folding.
+	def each(self, cursor):
+		pk = self._fields[self._dataset['pkfield']]
+		cdckey = self._fields['__$CDCKEY']
+		for row in cursor:
+			operation = self._warehouse.getOperationType(row)
+			if not operation:
+				continue
+			yield Change(operation, row[pk], row, [row[cdckey]])
+
+	#Returns a list of net Changes, one per PK_FIELD value, in order of first appearance.
+	def coalesce(self, cursor):
+		func = 'ChangeCoalescer.coalesce'
+		changes = OrderedDict()
+		num_records = 0
+		pk = self._fields[self._dataset['pkfield']]
+		cdckey = self._fields['__$CDCKEY']
+		try:
+			for row in cursor:
+				operation = self._warehouse.getOperationType(row)
+				if not operation:
+					continue
+				num_records = num_records + 1
+				key = row[pk]
+				change = changes.get(key)
+				if change is None:
+					changes[key] = Change(operation, key, row, [row[cdckey]])
+					continue
+				change.operation = self._FOLD[(change.operation, operation)]
+				change.row = row
+				change.cdcKeys.append(row[cdckey])
+		except:
+			tb = sys.exc_info()[2]
+			tbinfo = traceback.format_tb(tb)[0]
+			msg = "Error in " + func + ":\n" + tbinfo + "\nError Info:\n" + str(sys.exc_info()[1])
+			logging.error(msg)
+			raise
+		logging.debug('Coalesced ' + str(num_records) + ' change records into ' + str(len(changes)) + ' net changes')
+		return list(changes.values())
+
+	#Returns a list of Changes from a cursor returned by Warehouse.getChanges in net change mode.
+	#Each row holds the net operation for one key and a comma-delimited list of the folded CDC keys
+	#in hex. Keys whose changes cancelled out come back with no operation.
+	def net(self, cursor):
+		changes = []
+		pk = self._fields['__$PK']
+		cdckey = self._fields['__$CDCKEY']
+		for row in cursor:
+			operation = self._warehouse.getOperationType(row)
+			keys = [bytearray(binascii.unhexlify(key)) for key in row[cdckey].split(',')]
+			changes.append(Change(operation, row[pk], row, keys))
+		return changes
+
+###################################################################################################
+###################################################################################################
+#
+# class:	ChangeReader
+# purpose:	Streams the changes of a dataset from a change cursor in batches of batchSize rows
+#			with fetchmany, so memory stays flat however many changes a window holds. Each batch
+#			is turned into Changes by a ChangeCoalescer (folded per batch in coalesce mode), and
+#			each row is projected to the columns that are applied, so only those are kept.
+#			Batches must be applied in order, since a key can appear in more than one batch.
+#
+###################################################################################################
+
+class ChangeReader(object):
+	#warehouse:	bgbase.Warehouse object that returned the cursor.
+	#dataset:	Dataset dictionary from Warehouse.getSyncDatasets.
+	#fields:	Column name -> index dictionary of the change cursor.
+	#columns:	Names of the columns to keep in each row.
+	#mode:		"each", "coalesce" or "net", the ChangeCoalescer method to use.
+	#batchSize:	Number of rows to fetch at a time.
+	def __init__(self, warehouse, dataset, fields, columns, mode, batchSize = 1000):
+		self._coalescer = ChangeCoalescer(warehouse, dataset, fields)
+		self._mode = mode
+		self._batchSize = batchSize
+		indexes = [fields[name] for name in columns]
+		#column name -> index dictionary of the projected rows
+		self.fields = dict()
+		for i in range(len(columns)):
+			self.fields[columns[i]] = i
+		if len(indexes) == 1:
+			getter = itemgetter(indexes[0])
+			self._project = lambda row: (getter(row),)
+		else:
+			self._project = itemgetter(*indexes)
+			
+	#Yields lists of Changes, one list per batch of rows.
+	def batches(self, cursor):
+		cursor.arraysize = self._batchSize
+		while True:
+			rows = cursor.fetchmany(self._batchSize)
+			if not rows:
+				break
+			if self._mode == 'net':
+				batch = self._coalescer.net(rows)
+			elif self._mode == 'coalesce':
+				batch = self._coalescer.coalesce(rows)
+			else:
+				batch = list(self._coalescer.each(rows))
+			for change in batch:
+				change.row = self._project(change.row)
+			yield batch
+
+###################################################################################################
+###################################################################################################
+#
+# class:	AckList
+# purpose:	Compact acknowledgement state of one dataset's LSN window. Counts the CDC records that
+#			were read and acknowledged, and keeps only the keys of the records that were not
+#			applied, packed into one bytearray of 20 byte (__$start_lsn, __$seqval) keys. Clearing
+#			deletes the whole window except those keys.
+#
+###################################################################################################
+
+class AckList(object):
+	KEY_SIZE = 20
+	
+	def __init__(self):
+		self.read = 0
+		self.acknowledged = 0
+		self._failed = bytearray()
+		
+	def add(self, cdcKeys, applied):
+		self.read = self.read + len(cdcKeys)
+		if applied:
+			self.acknowledged = self.acknowledged + len(cdcKeys)
+		else:
+			for key in cdcKeys:
+				self._failed.extend(key)
+				
+	def numFailed(self):
+		return len(self._failed) // self.KEY_SIZE
+		
+	#Returns the keys of the records that were not applied.
+	def failed(self):
+		keys = []
+		for i in range(0, len(self._failed), self.KEY_SIZE):
+			keys.append(self._failed[i:i + self.KEY_SIZE])
+		return keys
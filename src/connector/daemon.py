@@ -0,0 +1,192 @@
+import sys, time, socket, threading
+import traceback, logging
+import bgimport
+
+###################################################################################################
+###################################################################################################
+#
+# class:	ImportDaemon
+# purpose:	Long-running import loop. Keeps one Warehouse connection and one WarehouseToSde for the
+#			life of the process, polls sys.fn_cdc_get_max_lsn and runs the import only when the
+#			LSN advances. The poll interval starts at pollIntervalMin, doubles on every poll that
+#			finds no new changes up to pollIntervalMax, and drops back to pollIntervalMin as soon
+#			as changes arrive. Replica changes that are still pending are synced between polls
+#			once they are due.
+#
+###################################################################################################
+
+class ImportDaemon(object):
+	#warehouse:	bgbase.Warehouse object, kept open between polls.
+	#config:	connector.util.Config object with the WarehouseToSde keys and the following optional keys:
+	#	pollIntervalMin:	Seconds between polls right after changes were found. Defaults to 1.
+	#	pollIntervalMax:	Longest number of seconds between polls when no changes are found. Defaults to 60.
+	def __init__(self, warehouse, config):
+		self._warehouse = warehouse
+		self._config = config
+		self._importer = bgimport.WarehouseToSde(warehouse, config)
+		self._lastLsn = None
+		self._interval = self._pollIntervalMin()
+		self._running = False
+
+	#Polls until stop is called or the process is interrupted.
+	def run(self):
+		func = 'ImportDaemon.run'
+		logging.info('Begin ' + func + ', polling every ' + str(self._pollIntervalMin()) + ' to ' + str(self._pollIntervalMax()) + ' seconds')
+		self._running = True
+		try:
+			while self._running:
+				self.poll()
+				time.sleep(self._interval)
+		except KeyboardInterrupt:
+			logging.info('Import daemon interrupted')
+		finally:
+			self._warehouse.close()
+			logging.info('End ' + func)
+		return
+
+	def stop(self):
+		self._running = False
+
+	#Runs the import if the maximum LSN moved since the last successful run, and adjusts the poll interval.
+	#Returns True if an import was run.
+	def poll(self):
+		func = 'ImportDaemon.poll'
+		try:
+			lsn = self._warehouse.getMaxLsn()
+			if lsn is None or lsn == self._lastLsn:
+				self._interval = min(self._interval * 2, self._pollIntervalMax())
+				self._importer.flushSync()
+				return False
+			logging.debug('CDC max LSN advanced, running import')
+			if self._importer.run():
+				self._lastLsn = lsn
+				self._interval = self._pollIntervalMin()
+			else:
+				#the LSN is not recorded, so the import is retried on the next poll
+				self._interval = min(self._interval * 2, self._pollIntervalMax())
+			return True
+		except:
+			tb = sys.exc_info()[2]
+			tbinfo = traceback.format_tb(tb)[0]
+			msg = "Error in " + func + ":\n" + tbinfo + "\nError Info:\n" + str(sys.exc_info()[1])
+			logging.error(msg)
+			self._interval = self._pollIntervalMax()
+		return False
+
+	def _pollIntervalMin(self):
+		if self._config['pollIntervalMin']:
+			return float(self._config['pollIntervalMin'])
+		return 1.0
+
+	def _pollIntervalMax(self):
+		if self._config['pollIntervalMax']:
+			return max(float(self._config['pollIntervalMax']), self._pollIntervalMin())
+		return max(60.0, self._pollIntervalMin())
+
+###################################################################################################
+###################################################################################################
+#
+# class:	JobServer
+# purpose:	Resident import server. Accepts trigger requests from util.JobClient on a local TCP
+#			socket and runs WarehouseToSde in the main thread, so arcpy and the Warehouse
+#			connection stay loaded between runs. Triggers that arrive within debounceSeconds of
+#			the first one are merged into one run. Triggers that arrive during a run schedule
+#			exactly one follow-up run, so changes committed during a run are not dropped.
+#
+###################################################################################################
+
+class JobServer(object):
+	#warehouse:	bgbase.Warehouse object, kept open between runs.
+	#config:	connector.util.Config object with the WarehouseToSde keys and the following keys:
+	#	jobServerPort:		Port to listen on, on localhost only.
+	#	debounceSeconds:	Optional. Seconds to wait after a trigger for more triggers before running. Defaults to 2.
+	def __init__(self, warehouse, config):
+		self._warehouse = warehouse
+		self._config = config
+		self._importer = bgimport.WarehouseToSde(warehouse, config)
+		self._trigger = threading.Event()
+		self._socket = None
+		self._running = False
+
+	#Serves triggers until stop is called or the process is interrupted.
+	def run(self):
+		func = 'JobServer.run'
+		logging.info('Begin ' + func + ', listening on port ' + str(self._jobServerPort()))
+		self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		self._socket.bind(('127.0.0.1', self._jobServerPort()))
+		self._socket.listen(5)
+		self._running = True
+		listener = threading.Thread(target = self._listen, name = 'JobServerListener')
+		listener.daemon = True
+		listener.start()
+		try:
+			while self._running:
+				#wait with a timeout, so the loop stays responsive to interrupts
+				self._trigger.wait(1.0)
+				if not self._trigger.is_set():
+					self._flushSync()
+					continue
+				time.sleep(self._debounceSeconds())
+				#triggers from here on schedule the follow-up run
+				self._trigger.clear()
+				self._runImport()
+		except KeyboardInterrupt:
+			logging.info('Job server interrupted')
+		finally:
+			self._running = False
+			self._socket.close()
+			self._warehouse.close()
+			logging.info('End ' + func)
+		return
+
+	def stop(self):
+		self._running = False
+
+	def _runImport(self):
+		func = 'JobServer._runImport'
+		try:
+			self._importer.run()
+		except:
+			tb = sys.exc_info()[2]
+			tbinfo = traceback.format_tb(tb)[0]
+			msg = "Error in " + func + ":\n" + tbinfo + "\nError Info:\n" + str(sys.exc_info()[1])
+			logging.error(msg)
+
+	#Syncs replica changes that became due while no triggers arrived.
+	def _flushSync(self):
+		func = 'JobServer._flushSync'
+		try:
+			self._importer.flushSync()
+		except:
+			tb = sys.exc_info()[2]
+			tbinfo = traceback.format_tb(tb)[0]
+			msg = "Error in " + func + ":\n" + tbinfo + "\nError Info:\n" + str(sys.exc_info()[1])
+			logging.error(msg)
+
+	#Accepts trigger requests until the server stops. Runs in a background thread and never touches arcpy.
+	def _listen(self):
+		while self._running:
+			try:
+				connection, address = self._socket.accept()
+			except socket.error:
+				continue
+			try:
+				connection.settimeout(2.0)
+				request = connection.recv(64).strip()
+				if request == b'run':
+					self._trigger.set()
+					connection.sendall(b'queued\n')
+				else:
+					connection.sendall(b'unknown\n')
+			except socket.error as e:
+				logging.debug('Error reading trigger request: ' + str(e))
+			finally:
+				connection.close()
+
+	def _jobServerPort(self):
+		return int(self._config['jobServerPort'])
+
+	def _debounceSeconds(self):
+		if self._config['debounceSeconds']:
+			return float(self._config['debounceSeconds'])
+		return 2.0
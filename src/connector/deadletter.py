@@ -0,0 +1,210 @@
+import sys, time, sqlite3
+import traceback, logging
+try:
+	import cPickle as pickle
+except ImportError:
+	import pickle
+import util
+import changes
+
+_SCHEMA = '''CREATE TABLE IF NOT EXISTS dead_letters (
+	id INTEGER PRIMARY KEY AUTOINCREMENT,
+	cdc_table TEXT NOT NULL,
+	table_name TEXT NOT NULL,
+	key_text TEXT NOT NULL,
+	operation TEXT NOT NULL,
+	image BLOB NOT NULL,
+	error TEXT,
+	attempts INTEGER NOT NULL,
+	first_failed TEXT NOT NULL,
+	last_failed TEXT NOT NULL,
+	next_attempt REAL,
+	UNIQUE (cdc_table, key_text)
+)'''
+
+#Longest wait between two retries of a change, in seconds.
+MAX_BACKOFF = 86400
+
+###################################################################################################
+###################################################################################################
+#
+# class:	DeadLetterQueue
+# purpose:	Local SQLite store of the changes that failed to apply to SDE. Each entry holds the
+#			row image of the change with its column names, the operation, the last error and
+#			the number of attempts, one entry per key of a dataset. Since the image is kept, the
+#			CDC records of a queued change are acknowledged and the change is retried on later
+#			runs without reading CDC again. The wait before the next retry doubles with every
+#			failed attempt, and after maxAttempts the entry is parked until it is replayed.
+#			A change for a key that is already queued is folded into the entry like coalesced
+#			CDC records, and a newer change that is applied replaces it.
+#
+###################################################################################################
+
+class DeadLetterQueue(object):
+	#path:			Path to the SQLite file, created if it does not exist.
+	#backoff:		Seconds to wait before the first retry of a change.
+	#maxAttempts:	Number of attempts after which a change is parked until it is replayed.
+	def __init__(self, path, backoff = 60, maxAttempts = 10):
+		self._path = path
+		self._backoff = backoff
+		self._maxAttempts = maxAttempts
+		#cdc_table -> keys queued for the dataset, as text
+		self._queued = dict()
+		self._connection = sqlite3.connect(path, timeout = 30)
+		self._connection.execute(_SCHEMA)
+		self._connection.commit()
+
+	def close(self):
+		self._connection.close()
+
+	#Queues a change that failed to apply, or folds it into the entry already queued for its key.
+	#Returns False if the change could not be stored, in which case its CDC records must not be acknowledged.
+	#fields:	Column name -> index dictionary of the change's row.
+	def add(self, dataset, change, fields, error):
+		func = 'DeadLetterQueue.add'
+		try:
+			now = util.DateUtil().now()
+			key_text = _keyText(change.key)
+			row = self._connection.execute('SELECT operation, attempts, first_failed FROM dead_letters WHERE cdc_table = ? AND key_text = ?', (dataset['cdc_table'], key_text)).fetchone()
+			if row is None:
+				operation = change.operation
+				attempts = 1
+				first_failed = now
+			else:
+				operation = changes.ChangeCoalescer._FOLD[(row[0], change.operation)]
+				attempts = row[1] + 1
+				first_failed = row[2]
+			with self._connection:
+				self._connection.execute('DELETE FROM dead_letters WHERE cdc_table = ? AND key_text = ?', (dataset['cdc_table'], key_text))
+				self._keys(dataset).discard(key_text)
+				if operation:
+					self._keys(dataset).add(key_text)
+					image = sqlite3.Binary(pickle.dumps((change.key, fields, tuple(change.row)), 2))
+					self._connection.execute('INSERT INTO dead_letters (cdc_table, table_name, key_text, operation, image, error, attempts, first_failed, last_failed, next_attempt) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+						(dataset['cdc_table'], dataset['table'], key_text, operation, image, error, attempts, first_failed, now, self._nextAttempt(attempts)))
+			return True
+		except:
+			tb = sys.exc_info()[2]
+			tbinfo = traceback.format_tb(tb)[0]
+			msg = "Error in " + func + ":\n" + tbinfo + "\nError Info:\n" + str(sys.exc_info()[1])
+			logging.error(msg)
+		return False
+
+	#Returns the entries of a dataset that are due for a retry, as (id, Change, fields) in the order they were queued.
+	#The Changes have no CDC records to acknowledge.
+	def due(self, dataset):
+		self._queued.pop(dataset['cdc_table'], None)
+		entries = []
+		sql = 'SELECT id, operation, image FROM dead_letters WHERE cdc_table = ? AND next_attempt IS NOT NULL AND next_attempt <= ? ORDER BY id'
+		for id, operation, image in self._connection.execute(sql, (dataset['cdc_table'], time.time())).fetchall():
+			key, fields, row = pickle.loads(bytes(image))
+			entries.append((id, changes.Change(operation, key, row, []), fields))
+		return entries
+
+	#Removes an entry that was applied on retry.
+	def succeeded(self, dataset, id, change):
+		with self._connection:
+			self._connection.execute('DELETE FROM dead_letters WHERE id = ?', (id,))
+		self._keys(dataset).discard(_keyText(change.key))
+
+	#Counts a failed retry of an entry and schedules the next one, or parks the entry after maxAttempts.
+	def failed(self, id, error):
+		row = self._connection.execute('SELECT attempts FROM dead_letters WHERE id = ?', (id,)).fetchone()
+		if row is None:
+			return
+		attempts = row[0] + 1
+		next_attempt = self._nextAttempt(attempts)
+		with self._connection:
+			self._connection.execute('UPDATE dead_letters SET attempts = ?, error = ?, last_failed = ?, next_attempt = ? WHERE id = ?',
+				(attempts, error, util.DateUtil().now(), next_attempt, id))
+		if next_attempt is None:
+			logging.warn('Queued change ' + str(id) + ' failed ' + str(attempts) + ' times and is only retried when it is replayed')
+
+	#Removes the entry of the change's key after the change, which is newer, was applied. Only costs a lookup in the
+	#keys queued for the dataset if the key is not queued.
+	def applied(self, dataset, change):
+		key_text = _keyText(change.key)
+		keys = self._keys(dataset)
+		if not key_text in keys:
+			return
+		with self._connection:
+			self._connection.execute('DELETE FROM dead_letters WHERE cdc_table = ? AND key_text = ?', (dataset['cdc_table'], key_text))
+		keys.discard(key_text)
+		logging.debug('Dropped the queued change for ' + key_text + ' of ' + dataset['table'] + ', a newer change was applied')
+
+	#Returns the entries as dictionaries, without their images, for all datasets or only the matching ones.
+	#match:	TABLE_NAME of a dataset, or the id of an entry.
+	def list(self, match = None):
+		where, params = self._where(match)
+		sql = 'SELECT id, table_name, key_text, operation, attempts, first_failed, last_failed, next_attempt, error FROM dead_letters' + where + ' ORDER BY table_name, id'
+		entries = []
+		for row in self._connection.execute(sql, params).fetchall():
+			entries.append({'id': row[0], 'table': row[1], 'key': row[2], 'operation': row[3], 'attempts': row[4], 'firstFailed': row[5],
+				'lastFailed': row[6], 'nextAttempt': row[7], 'parked': row[7] is None, 'error': row[8]})
+		return entries
+
+	#Makes the entries due now, including parked ones, so the next import retries them. Returns the number of entries.
+	def replay(self, match = None):
+		where, params = self._where(match)
+		with self._connection:
+			return self._connection.execute('UPDATE dead_letters SET next_attempt = 0' + where, params).rowcount
+
+	#Deletes the entries, which are then never applied. Returns the number of entries.
+	def purge(self, match = None):
+		where, params = self._where(match)
+		with self._connection:
+			return self._connection.execute('DELETE FROM dead_letters' + where, params).rowcount
+
+	#Returns the keys queued for a dataset, read once.
+	def _keys(self, dataset):
+		keys = self._queued.get(dataset['cdc_table'])
+		if keys is None:
+			rows = self._connection.execute('SELECT key_text FROM dead_letters WHERE cdc_table = ?', (dataset['cdc_table'],))
+			keys = set([row[0] for row in rows])
+			self._queued[dataset['cdc_table']] = keys
+		return keys
+
+	def _where(self, match):
+		if match is None:
+			return ('', ())
+		if str(match).isdigit():
+			return (' WHERE id = ?', (int(match),))
+		return (' WHERE lower(table_name) = ?', (match.lower(),))
+
+	#Returns the time of the next retry after a number of attempts, or None if the entry is parked.
+	def _nextAttempt(self, attempts):
+		if attempts >= self._maxAttempts:
+			return None
+		return time.time() + min(self._backoff * 2 ** (attempts - 1), MAX_BACKOFF)
+
+###################################################################################################
+###################################################################################################
+#
+# class:	ErrorCapture
+# purpose:	Logging handler that keeps the last error logged, so the error of a change that
+#			failed to apply can be stored with it. Installed on the root logger between start
+#			and stop.
+#
+###################################################################################################
+
+class ErrorCapture(logging.Handler):
+	def __init__(self):
+		logging.Handler.__init__(self, logging.ERROR)
+		self.message = None
+
+	def emit(self, record):
+		try:
+			self.message = record.getMessage()
+		except:
+			self.message = str(record.msg)
+
+	def start(self):
+		self.message = None
+		logging.getLogger('').addHandler(self)
+
+	def stop(self):
+		logging.getLogger('').removeHandler(self)
+
+#Returns a key as the text it is stored with.
+def _keyText(key):
+	return unicode(key)
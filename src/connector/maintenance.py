@@ -0,0 +1,325 @@
+import os, sys, time, errno, arcpy
+import traceback, logging, json
+import util
+from datetime import datetime
+from datetime import timedelta
+
+#Returns the maintenance state stored in path, or an empty state if there is none.
+def _loadState(path):
+	try:
+		existing = util.existingFile(path) if path else None
+		if existing:
+			with open(existing, 'r') as f:
+				return json.load(f)
+	except Exception as e:
+		logging.error('Error reading maintenance state file ' + path)
+		logging.exception(e)
+	return {}
+
+#Writes the maintenance state to a temp file and replaces the state file with it.
+#Read, change and save the state under a _StateLock, since the import and the export share the file.
+def _saveState(path, data):
+	if not path:
+		return
+	try:
+		temp = path + '.tmp'
+		with open(temp, 'w') as f:
+			json.dump(data, f, indent = 1, sort_keys = True)
+			f.flush()
+			os.fsync(f.fileno())
+		util.replaceFile(temp, path)
+	except Exception as e:
+		logging.error('Error writing maintenance state file ' + path)
+		logging.exception(e)
+	return
+
+###################################################################################################
+###################################################################################################
+#
+# class:	_StateLock
+# purpose:	Context manager that holds the lock of the maintenance state file, path.lock, so that
+#			the import and the export do not overwrite each other's changes to the state. The lock
+#			file is created exclusively and removed on exit. A lock held for longer than timeout
+#			was left by a process that stopped, and is taken over. Without a path, or if the lock
+#			file cannot be created, the block runs without the lock.
+#
+###################################################################################################
+
+class _StateLock(object):
+	#path:		Path to the maintenance state file.
+	#timeout:	Seconds to wait for the lock.
+	def __init__(self, path, timeout = 10.0):
+		self._path = path + '.lock' if path else None
+		self._timeout = timeout
+		self._fd = None
+
+	def __enter__(self):
+		if self._path is None:
+			return self
+		start = time.time()
+		while True:
+			try:
+				self._fd = os.open(self._path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+				return self
+			except OSError as e:
+				#Windows reports a lock file that is being removed as EACCES
+				if e.errno != errno.EEXIST and e.errno != errno.EACCES:
+					logging.warn('Cannot lock the maintenance state file ' + self._path + ': ' + str(e))
+					return self
+			if time.time() - start >= self._timeout:
+				logging.warn('Taking over the maintenance state lock ' + self._path + ', held for more than ' + str(self._timeout) + ' seconds')
+				self._remove()
+				start = time.time()
+			time.sleep(0.05)
+
+	def __exit__(self, type, value, tb):
+		if self._fd is not None:
+			os.close(self._fd)
+			self._fd = None
+			self._remove()
+		return False
+
+	def _remove(self):
+		try:
+			os.remove(self._path)
+		except OSError:
+			pass
+
+###################################################################################################
+###################################################################################################
+#
+# class:	CompressScheduler
+# purpose:	Decides when to compress a geodatabase instead of compressing after every run. Keeps
+#			the rows applied and the time of the last compress of each workspace in the local
+#			maintenance state file, shared by the import and the export under a _StateLock, and reads the state
+#			count from the state table with ArcSDESQLExecute. Compress runs when one of the configured thresholds is
+#			crossed, or once per quiet window. Every decision is logged with its reason.
+#			If no threshold is configured, every call compresses, as before.
+#
+###################################################################################################
+
+class CompressScheduler(object):
+	#config: connector.util.Config object with the following optional keys:
+	#	maintenanceStatePath:	Path to the file that stores the compress state of each workspace.
+	#	compressStateCount:		Compress when the state table has at least this many states.
+	#	compressRowCount:		Compress when at least this many rows were applied since the last compress.
+	#	compressMaxHours:		Compress when the last compress is at least this many hours old.
+	#	compressQuietHours:		Hours of the day, as start-end (e.g. 22-5), in which to compress once.
+	#	stateTable:				Name of the geodatabase state table. Defaults to sde.SDE_states.
+	def __init__(self, config):
+		self._config = config
+
+	#Adds the number of rows applied to a workspace since its last compress.
+	def record(self, workspace, rows):
+		if not self._maintenanceStatePath() or rows <= 0:
+			return
+		with _StateLock(self._maintenanceStatePath()):
+			data = _loadState(self._maintenanceStatePath())
+			state = data.setdefault('compress', {}).setdefault(workspace, {})
+			state['rows'] = state.get('rows', 0) + rows
+			_saveState(self._maintenanceStatePath(), data)
+
+	#Compresses the workspace if it is due. Returns True if it was compressed.
+	#Errors from Compress_management are raised to the caller.
+	#The state is not locked while compressing, rows the other process records in the meantime are kept.
+	def compress(self, workspace):
+		state = _loadState(self._maintenanceStatePath()).get('compress', {}).get(workspace, {})
+		states = self._stateCount(workspace)
+		due, reason = self._decide(state, states)
+		if not due:
+			logging.info('Skipping compress of ' + workspace + ': ' + reason)
+			if states is not None:
+				self._saveCompress(workspace, {'states': states})
+			return False
+
+		logging.info('Compressing ' + workspace + ': ' + reason)
+		arcpy.Compress_management(workspace)
+		after = self._stateCount(workspace)
+		if states is not None and after is not None:
+			logging.debug('Compress of ' + workspace + ' reduced the state count from ' + str(states) + ' to ' + str(after))
+		self._saveCompress(workspace, {'last_compress': datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 'states': after}, state.get('rows', 0))
+		return True
+
+	#Sets values in the compress state of a workspace and subtracts the rows that were compressed.
+	def _saveCompress(self, workspace, values, compressed = 0):
+		with _StateLock(self._maintenanceStatePath()):
+			data = _loadState(self._maintenanceStatePath())
+			state = data.setdefault('compress', {}).setdefault(workspace, {})
+			state.update(values)
+			state['rows'] = max(state.get('rows', 0) - compressed, 0)
+			_saveState(self._maintenanceStatePath(), data)
+
+	#Returns (due, reason) for a workspace state and its current state count.
+	def _decide(self, state, states):
+		if not self._hasThresholds():
+			return (True, 'no compress thresholds are configured')
+		rows = state.get('rows', 0)
+		last = None
+		if state.get('last_compress'):
+			last = datetime.strptime(state['last_compress'], '%Y-%m-%d %H:%M:%S')
+		now = datetime.now()
+
+		if self._compressStateCount() and states is not None and states >= self._compressStateCount():
+			return (True, 'state count ' + str(states) + ' reached the threshold of ' + str(self._compressStateCount()))
+		if self._compressRowCount() and rows >= self._compressRowCount():
+			return (True, str(rows) + ' rows applied since the last compress reached the threshold of ' + str(self._compressRowCount()))
+		if self._compressMaxHours():
+			if last is None:
+				return (True, 'no previous compress is recorded')
+			if now - last >= timedelta(hours = self._compressMaxHours()):
+				return (True, 'last compress at ' + state['last_compress'] + ' is older than ' + str(self._compressMaxHours()) + ' hours')
+		window = self._quietWindowStart(now)
+		if window is not None and (last is None or last < window):
+			return (True, 'in quiet hours ' + self._config['compressQuietHours'] + ' and not compressed since ' + window.strftime('%Y-%m-%d %H:%M'))
+
+		since = 'never compressed' if last is None else 'last compressed at ' + state['last_compress']
+		return (False, str(states if states is not None else 'unknown') + ' states, ' + str(rows) + ' rows applied, ' + since + ', below the thresholds')
+
+	#Returns the start of the quiet window that contains now, or None if now is outside the quiet hours.
+	def _quietWindowStart(self, now):
+		if not self._config['compressQuietHours']:
+			return None
+		start, end = [int(hour) for hour in self._config['compressQuietHours'].split('-')]
+		today = now.replace(hour = start, minute = 0, second = 0, microsecond = 0)
+		if start <= end:
+			if start <= now.hour < end:
+				return today
+			return None
+		#window crosses midnight
+		if now.hour >= start:
+			return today
+		if now.hour < end:
+			return today - timedelta(days = 1)
+		return None
+
+	#Returns the number of states in the workspace's state table, or None if it cannot be read.
+	def _stateCount(self, workspace):
+		if not self._compressStateCount():
+			return None
+		try:
+			sde = arcpy.ArcSDESQLExecute(workspace)
+			return int(sde.execute('SELECT COUNT(*) FROM ' + self._stateTable()))
+		except:
+			logging.warn('Cannot read the state count of ' + workspace + ': ' + str(sys.exc_info()[1]))
+		return None
+
+	def _hasThresholds(self):
+		return bool(self._maintenanceStatePath() and (self._compressStateCount() or self._compressRowCount() or self._compressMaxHours() or self._config['compressQuietHours']))
+
+	def _maintenanceStatePath(self):
+		return self._config['maintenanceStatePath']
+
+	def _compressStateCount(self):
+		if self._config['compressStateCount']:
+			return int(self._config['compressStateCount'])
+		return 0
+
+	def _compressRowCount(self):
+		if self._config['compressRowCount']:
+			return int(self._config['compressRowCount'])
+		return 0
+
+	def _compressMaxHours(self):
+		if self._config['compressMaxHours']:
+			return float(self._config['compressMaxHours'])
+		return 0
+
+	def _stateTable(self):
+		if self._config['stateTable']:
+			return self._config['stateTable']
+		return 'sde.SDE_states'
+
+###################################################################################################
+###################################################################################################
+#
+# class:	SyncScheduler
+# purpose:	Micro-batches replica synchronization. Counts the changes applied to datasets in the
+#			replica since the last sync, in the local maintenance state file, and reports a sync as
+#			due when syncChangeCount changes are pending or the oldest pending change is
+#			syncMaxSeconds old. Changes to datasets outside the replica never make a sync due.
+#			If no threshold is configured, a sync is due whenever a change is pending.
+#
+###################################################################################################
+
+class SyncScheduler(object):
+	#config: connector.util.Config object with the following optional keys:
+	#	maintenanceStatePath:	Path to the file that stores the pending changes of each replica.
+	#	syncChangeCount:		Sync when at least this many changes are pending.
+	#	syncMaxSeconds:			Sync when the oldest pending change is at least this many seconds old.
+	def __init__(self, config):
+		self._config = config
+		self._pending = dict()
+
+	#Returns the unqualified, lower case names of the datasets in a replica, or None if they cannot be listed.
+	def replicaDatasets(self, workspace, replica):
+		try:
+			for item in arcpy.da.ListReplicas(workspace):
+				if item.name.lower() == replica.lower() or item.name.lower().endswith('.' + replica.lower()):
+					return set([name.split('.')[-1].lower() for name in item.datasets])
+			logging.warn('Replica ' + replica + ' was not found in ' + workspace)
+		except:
+			logging.warn('Cannot list the datasets of replica ' + replica + ': ' + str(sys.exc_info()[1]))
+		return None
+
+	#Adds the number of changes applied to the replica's datasets.
+	def record(self, replica, changes):
+		if changes <= 0:
+			return
+		with _StateLock(self._config['maintenanceStatePath']):
+			data = self._load()
+			state = data.setdefault(replica, {})
+			state['pending'] = state.get('pending', 0) + changes
+			if not state.get('first_pending'):
+				state['first_pending'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+			self._save(data)
+
+	#Returns (due, reason) for the replica.
+	def due(self, replica):
+		state = self._load().get(replica, {})
+		pending = state.get('pending', 0)
+		if pending <= 0:
+			return (False, 'no replica changes are pending')
+		if not self._syncChangeCount() and not self._syncMaxSeconds():
+			return (True, str(pending) + ' replica changes are pending')
+		if self._syncChangeCount() and pending >= self._syncChangeCount():
+			return (True, str(pending) + ' pending changes reached the threshold of ' + str(self._syncChangeCount()))
+		first = datetime.strptime(state['first_pending'], '%Y-%m-%d %H:%M:%S')
+		age = datetime.now() - first
+		if self._syncMaxSeconds() and age >= timedelta(seconds = self._syncMaxSeconds()):
+			return (True, 'oldest pending change from ' + state['first_pending'] + ' is older than ' + str(self._syncMaxSeconds()) + ' seconds')
+		return (False, str(pending) + ' changes pending since ' + state['first_pending'] + ', below the thresholds')
+
+	#Returns the number of changes pending for the replica.
+	def pending(self, replica):
+		return self._load().get(replica, {}).get('pending', 0)
+
+	#Clears the pending changes of the replica after a successful sync.
+	def synced(self, replica):
+		with _StateLock(self._config['maintenanceStatePath']):
+			data = self._load()
+			data[replica] = {'pending': 0, 'first_pending': None, 'last_sync': datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+			self._save(data)
+
+	#Without a state file, pending changes are only kept in memory.
+	def _load(self):
+		if not self._config['maintenanceStatePath']:
+			return self._pending
+		return _loadState(self._config['maintenanceStatePath']).get('sync', {})
+
+	def _save(self, sync):
+		if not self._config['maintenanceStatePath']:
+			self._pending = sync
+			return
+		data = _loadState(self._config['maintenanceStatePath'])
+		data['sync'] = sync
+		_saveState(self._config['maintenanceStatePath'], data)
+
+	def _syncChangeCount(self):
+		if self._config['syncChangeCount']:
+			return int(self._config['syncChangeCount'])
+		return 0
+
+	def _syncMaxSeconds(self):
+		if self._config['syncMaxSeconds']:
+			return float(self._config['syncMaxSeconds'])
+		return 0
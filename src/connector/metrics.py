@@ -0,0 +1,185 @@
+import os, sys, time, json, socket
+import traceback, logging
+import util
+from datetime import datetime
+
+###################################################################################################
+###################################################################################################
+#
+# class:	Timer
+# purpose:	Context manager that adds the seconds spent in a with block to timings[name], so a
+#			stage that runs several times in a run is reported as its total.
+#
+###################################################################################################
+
+class Timer(object):
+	#timings:	Dictionary of stage name to seconds.
+	#name:		Name of the stage.
+	def __init__(self, timings, name):
+		self._timings = timings
+		self._name = name
+		self._start = None
+
+	def __enter__(self):
+		self._start = time.time()
+		return self
+
+	def __exit__(self, type, value, tb):
+		self._timings[self._name] = self._timings.get(self._name, 0.0) + time.time() - self._start
+		return False
+
+###################################################################################################
+###################################################################################################
+#
+# class:	RunMetrics
+# purpose:	Collects the stage timings of one import or export run and the rows of each dataset by
+#			operation and outcome, and writes them when the run ends, either as one JSON line
+#			appended to the metrics file or as a Prometheus textfile that replaces it. Rows are
+#			counted from the totals of each dataset, so nothing is added to the per-row loop.
+#			An export of several replicas also reports the outcome and stages of each replica.
+#
+###################################################################################################
+
+class RunMetrics(object):
+	#job:		Name of the run, import or export.
+	#path:		Path to the metrics file. If empty, nothing is written.
+	#format:	json|prometheus. Defaults to json.
+	def __init__(self, job, path, format = 'json'):
+		self.job = job
+		self.stages = dict()
+		self.counts = dict()
+		self.datasets = dict()
+		self.replicas = dict()
+		self._path = path
+		self._format = format or 'json'
+		self._start = time.time()
+
+	#Returns a Timer for a stage of the run.
+	def timer(self, stage):
+		return Timer(self.stages, stage)
+
+	#Adds n to a count of the run, e.g. the bytes delivered.
+	def count(self, name, n = 1):
+		self.counts[name] = self.counts.get(name, 0) + n
+
+	#Adds the timings and row counts of one dataset.
+	#applied, total:	Dictionaries of operation to the number of changes applied and read.
+	#cancelled:		Number of CDC records that cancelled out.
+	def addDataset(self, table, timings, applied, total, cancelled, error = False):
+		rows = dict()
+		for operation in total:
+			rows[operation] = {'applied': applied.get(operation, 0), 'failed': total[operation] - applied.get(operation, 0)}
+		seconds = timings.get('fetch', 0.0) + timings.get('apply', 0.0)
+		num_rows = sum(total.values())
+		self.datasets[table] = {
+			'stages': dict([(stage, round(seconds, 3)) for stage, seconds in timings.items()]),
+			'rows': rows,
+			'cancelled': cancelled,
+			'error': error,
+			'rows_per_sec': round(num_rows / seconds, 3) if seconds > 0 else 0.0
+		}
+
+	#Adds the outcome, stage timings and counts of the pipeline of one replica. The counts are added to the run's counts.
+	def addReplica(self, replica, success, stages, counts):
+		self.replicas[replica] = {
+			'success': success == True,
+			'stages': dict([(stage, round(seconds, 3)) for stage, seconds in stages.items()]),
+			'counts': counts
+		}
+		for name, n in counts.items():
+			self.count(name, n)
+
+	#Writes the metrics of the run. Errors are logged, a run never fails because of its metrics.
+	def write(self, success):
+		func = 'RunMetrics.write'
+		if not self._path:
+			return
+		try:
+			if self._format == 'prometheus':
+				self._writePrometheus(success)
+			else:
+				self._writeJson(success)
+		except:
+			tb = sys.exc_info()[2]
+			tbinfo = traceback.format_tb(tb)[0]
+			msg = "Error in " + func + ":\n" + tbinfo + "\nError Info:\n" + str(sys.exc_info()[1])
+			logging.error(msg)
+
+	def _record(self, success):
+		return {
+			'job': self.job,
+			'host': socket.gethostname(),
+			'start': datetime.fromtimestamp(self._start).strftime('%Y-%m-%d %H:%M:%S'),
+			'seconds': round(time.time() - self._start, 3),
+			'success': success == True,
+			'stages': dict([(stage, round(seconds, 3)) for stage, seconds in self.stages.items()]),
+			'counts': self.counts,
+			'datasets': self.datasets,
+			'replicas': self.replicas
+		}
+
+	def _writeJson(self, success):
+		with open(self._path, 'a') as f:
+			f.write(json.dumps(self._record(success), sort_keys = True) + '\n')
+
+	#Writes the textfile to a temp file and replaces the metrics file with it, so the collector never reads half a file.
+	def _writePrometheus(self, success):
+		record = self._record(success)
+		job = 'job="' + _escape(self.job) + '"'
+		lines = []
+		lines.append('# HELP bgconnector_run_success 1 if the last run succeeded.')
+		lines.append('# TYPE bgconnector_run_success gauge')
+		lines.append('bgconnector_run_success{' + job + '} ' + ('1' if record['success'] else '0'))
+		lines.append('# HELP bgconnector_run_timestamp_seconds Start time of the last run.')
+		lines.append('# TYPE bgconnector_run_timestamp_seconds gauge')
+		lines.append('bgconnector_run_timestamp_seconds{' + job + '} ' + str(int(self._start)))
+		lines.append('# HELP bgconnector_run_duration_seconds Duration of the last run.')
+		lines.append('# TYPE bgconnector_run_duration_seconds gauge')
+		lines.append('bgconnector_run_duration_seconds{' + job + '} ' + str(record['seconds']))
+		lines.append('# HELP bgconnector_stage_duration_seconds Duration of each stage of the last run.')
+		lines.append('# TYPE bgconnector_stage_duration_seconds gauge')
+		for stage in sorted(record['stages'].keys()):
+			lines.append('bgconnector_stage_duration_seconds{' + job + ',stage="' + _escape(stage) + '"} ' + str(record['stages'][stage]))
+		if len(self.counts) > 0:
+			lines.append('# HELP bgconnector_run_count Counts of the last run, e.g. the bytes delivered.')
+			lines.append('# TYPE bgconnector_run_count gauge')
+			for name in sorted(self.counts.keys()):
+				lines.append('bgconnector_run_count{' + job + ',name="' + _escape(name) + '"} ' + str(self.counts[name]))
+		if len(self.datasets) > 0:
+			lines.append('# HELP bgconnector_dataset_stage_duration_seconds Duration of each stage of each dataset in the last run.')
+			lines.append('# TYPE bgconnector_dataset_stage_duration_seconds gauge')
+			for table in sorted(self.datasets.keys()):
+				stages = self.datasets[table]['stages']
+				for stage in sorted(stages.keys()):
+					lines.append('bgconnector_dataset_stage_duration_seconds{' + job + ',dataset="' + _escape(table) + '",stage="' + _escape(stage) + '"} ' + str(stages[stage]))
+			lines.append('# HELP bgconnector_dataset_rows Changes of each dataset in the last run by operation and outcome.')
+			lines.append('# TYPE bgconnector_dataset_rows gauge')
+			for table in sorted(self.datasets.keys()):
+				rows = self.datasets[table]['rows']
+				for operation in sorted(rows.keys()):
+					for outcome in ('applied', 'failed'):
+						lines.append('bgconnector_dataset_rows{' + job + ',dataset="' + _escape(table) + '",operation="' + operation + '",outcome="' + outcome + '"} ' + str(rows[operation][outcome]))
+			lines.append('# HELP bgconnector_dataset_rows_per_second Changes read and applied per second for each dataset in the last run.')
+			lines.append('# TYPE bgconnector_dataset_rows_per_second gauge')
+			for table in sorted(self.datasets.keys()):
+				lines.append('bgconnector_dataset_rows_per_second{' + job + ',dataset="' + _escape(table) + '"} ' + str(self.datasets[table]['rows_per_sec']))
+		if len(self.replicas) > 0:
+			lines.append('# HELP bgconnector_replica_success 1 if the pipeline of the replica succeeded in the last run.')
+			lines.append('# TYPE bgconnector_replica_success gauge')
+			for replica in sorted(self.replicas.keys()):
+				lines.append('bgconnector_replica_success{' + job + ',replica="' + _escape(replica) + '"} ' + ('1' if self.replicas[replica]['success'] else '0'))
+			lines.append('# HELP bgconnector_replica_stage_duration_seconds Duration of each stage of each replica in the last run.')
+			lines.append('# TYPE bgconnector_replica_stage_duration_seconds gauge')
+			for replica in sorted(self.replicas.keys()):
+				stages = self.replicas[replica]['stages']
+				for stage in sorted(stages.keys()):
+					lines.append('bgconnector_replica_stage_duration_seconds{' + job + ',replica="' + _escape(replica) + '",stage="' + _escape(stage) + '"} ' + str(stages[stage]))
+
+		temp = self._path + '.tmp'
+		with open(temp, 'w') as f:
+			f.write('\n'.join(lines) + '\n')
+		util.replaceFile(temp, self._path)
+
+#Escapes a Prometheus label value.
+def _escape(value):
+	return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
@@ -0,0 +1,115 @@
+import os, sys, threading, cProfile
+import traceback, logging
+from time import strftime
+
+#Returns the path of a timestamped profile file in the folder of logFile, e.g. C:\logs\warehouse_to_sde.10182026_220000.pstats
+def profilePath(logFile, name, extension = 'pstats'):
+	folder = os.path.dirname(os.path.abspath(logFile)) if logFile else os.getcwd()
+	return os.path.join(folder, name + '.' + strftime("%m%d%Y_%H%M%S") + '.' + extension)
+
+#Calls func under cProfile and writes the stats to path, also if func raises. Returns what func returned.
+def profileCall(path, func, *args):
+	profiler = cProfile.Profile()
+	try:
+		return profiler.runcall(func, *args)
+	finally:
+		try:
+			profiler.dump_stats(path)
+			logging.info('Wrote profile ' + path)
+		except:
+			logging.error('Error writing profile ' + path + ': ' + str(sys.exc_info()[1]))
+
+#Calls func the way the profile settings ask for and returns what it returned:
+#	under cProfile if the profile property is true,
+#	with a SlowRunSampler if profileThresholdSeconds is set,
+#	or unprofiled.
+#name:	Prefix of the profile file, written in the folder of logFile.
+def runProfiled(config, name, logFile, func):
+	if config['profile'] == 'true':
+		return profileCall(profilePath(logFile, name), func)
+	if config['profileThresholdSeconds']:
+		sampler = SlowRunSampler(profilePath(logFile, name, 'stacks'), float(config['profileThresholdSeconds']))
+		sampler.start()
+		try:
+			return func()
+		finally:
+			sampler.stop()
+	return func()
+
+###################################################################################################
+###################################################################################################
+#
+# class:	SlowRunSampler
+# purpose:	Captures where a slow run spends its time without profiling the runs that are not slow.
+#			A background thread waits for the threshold and, only if the run is still going,
+#			samples the stack of the run's thread with sys._current_frames at a fixed interval.
+#			cProfile cannot be attached to a thread that is already running, so the samples are
+#			written as collapsed stacks (one "outer;...;inner count" line per stack), which
+#			flamegraph.pl and speedscope read.
+#
+###################################################################################################
+
+class SlowRunSampler(object):
+	#path:				Path to the collapsed stacks file, only written if the threshold is reached.
+	#thresholdSeconds:	Seconds the run may take before sampling starts.
+	#interval:			Seconds between samples.
+	def __init__(self, path, thresholdSeconds, interval = 0.01):
+		self._path = path
+		self._threshold = thresholdSeconds
+		self._interval = interval
+		self._stopped = threading.Event()
+		self._thread = None
+		self._ident = None
+		self._samples = dict()
+
+	#Starts watching the calling thread.
+	def start(self):
+		self._ident = threading.current_thread().ident
+		self._thread = threading.Thread(target = self._run, name = 'SlowRunSampler')
+		self._thread.daemon = True
+		self._thread.start()
+
+	#Stops sampling and writes the samples, if the threshold was reached.
+	def stop(self):
+		self._stopped.set()
+		self._thread.join()
+		if len(self._samples) == 0:
+			return
+		num_samples = sum(self._samples.values())
+		try:
+			with open(self._path, 'w') as f:
+				for stack in sorted(self._samples.keys()):
+					f.write(stack + ' ' + str(self._samples[stack]) + '\n')
+			logging.info('Run took longer than ' + str(self._threshold) + ' seconds, wrote ' + str(num_samples) + ' stack samples to ' + self._path)
+		except:
+			logging.error('Error writing stack samples ' + self._path + ': ' + str(sys.exc_info()[1]))
+
+	def _run(self):
+		func = 'SlowRunSampler._run'
+		try:
+			self._stopped.wait(self._threshold)
+			if self._stopped.is_set():
+				return
+			logging.warn('Run is taking longer than ' + str(self._threshold) + ' seconds, sampling its stack')
+			while not self._stopped.is_set():
+				frame = sys._current_frames().get(self._ident)
+				if frame is not None:
+					stack = self._stack(frame)
+					self._samples[stack] = self._samples.get(stack, 0) + 1
+				frame = None
+				self._stopped.wait(self._interval)
+		except:
+			tb = sys.exc_info()[2]
+			tbinfo = traceback.format_tb(tb)[0]
+			msg = "Error in " + func + ":\n" + tbinfo + "\nError Info:\n" + str(sys.exc_info()[1])
+			logging.error(msg)
+
+	#Returns the stack of a frame from the outermost call to the frame, as function (file:line) joined by ;
+	def _stack(self, frame):
+		names = []
+		while frame is not None:
+			code = frame.f_code
+			names.append(code.co_name + ' (' + os.path.basename(code.co_filename) + ':' + str(code.co_firstlineno) + ')')
+			frame = frame.f_back
+		names.reverse()
+		return ';'.join(names)
@@ -0,0 +1,691 @@
+import os, sys, arcpy
+import traceback, logging, hashlib, zlib, json, uuid
+import numpy
+from datetime import datetime
+from decimal import Decimal
+from time import strftime
+import util
+import sdeapply
+import metrics
+
+#Column types that are loaded into NumPy arrays as numbers, with the value that fills NULLs. Other columns are kept as objects.
+_NUMERIC_TYPES = ((bool, '?', False), (int, 'i8', 0), (long, 'i8', 0), (float, 'f8', 0.0))
+
+###################################################################################################
+###################################################################################################
+#
+# class:	DatasetResync
+# purpose:	Reloads one dataset of SDE_SYNC_TABLES from the table its CDC table captures, for a
+#			table that was just enabled or has drifted, instead of replaying CDC row by row. The
+#			Warehouse table is read in fetchmany blocks into masked NumPy structured arrays, with
+#			NULLs masked. The keys of each block are matched against the keys in SDE with
+#			numpy.in1d and the point geometry is built from the X/Y columns with array operations.
+#			The rows are loaded in one edit session, with one edit operation per block.
+#			New rows are loaded through one arcpy.da.InsertCursor per block, existing rows are
+#			compared and only rewritten if they differ, and rows that are no longer in the
+#			Warehouse are deleted. Once every row is loaded, the dataset's LAST_SYNC_DATE and
+#			checkpoint are set to the CDC LSN the rows were read at, so the import resumes
+#			with the changes after it. Changes committed before the rows were read but captured
+#			after are read again, so the import applies inserts of keys that exist as updates
+#			until its checkpoint passes the maximum LSN once the rows are loaded.
+#
+###################################################################################################
+
+class DatasetResync(object):
+	#warehouse:	Warehouse object that the table is read from.
+	#config: connector.util.Config object with the following keys:
+	#	lockFilePath:			Path for lock file, shared with the import so both never run at once.
+	#	stagingWorkspace:		Path to the Staging Workspace
+	#	bgbaseEditVersion:		Version name to perform the edits in
+	#	checkpointPath:			Optional. Path to the file that stores the last applied LSN of each dataset.
+	#	clearCdcRecords:		Optional. true|false. If false and checkpointPath is set, the CDC records up to the resync are not deleted.
+	#	resyncFetchSize:		Optional. Number of rows to read and load at a time. Defaults to 10000.
+	#	bulkChunkSize:			Optional. Number of keys per update and delete cursor. Defaults to 500.
+	#	importMetricsFile:		Optional. Path to the file that receives the stage timings and row counts of the resync.
+	#	metricsFormat:			Optional. json|prometheus. Defaults to json.
+	def __init__(self, warehouse, config):
+		self._warehouse = warehouse
+		self._config = config
+		self._dbutil = util.DBUtil()
+		self._metrics = metrics.RunMetrics('resync', '')
+
+	#Reloads the dataset whose TABLE_NAME is table. Returns False if it failed, in which case the watermark is not moved
+	#and the resync can be run again.
+	def run(self, table):
+		func = 'DatasetResync.run'
+		logging.info(" ")
+		logging.info(" ")
+		logging.info("******************************************************************************")
+		logging.info("Begin " + func + " " + table)
+
+		keys = ["lockFilePath", "stagingWorkspace", "bgbaseEditVersion"]
+		if not self._config.hasValues(keys):
+			logging.error('Invalid config file.')
+			logging.info('End ' + func);
+			logging.info("******************************************************************************")
+			return False
+
+		datasets = [dataset for dataset in self._warehouse.getSyncDatasets() if dataset['table'].lower() == table.lower()]
+		if len(datasets) == 0:
+			logging.error(table + ' is not in the sync table')
+			logging.info('End ' + func);
+			logging.info("******************************************************************************")
+			return False
+
+		lockfile = util.LockFile(self._config['lockFilePath'])
+		if lockfile.locked():
+			logging.error("WarehouseToSde is already running")
+			logging.info('If WarehouseToSde is not running, then delete the file %s', self._config['lockFilePath'])
+			logging.info('End ' + func);
+			logging.info("******************************************************************************")
+			return False
+		lockfile.lock()
+		self._metrics = metrics.RunMetrics('resync', self._config['importMetricsFile'], self._config['metricsFormat'])
+		result = False
+		try:
+			result = self._resync(datasets[0])
+		finally:
+			lockfile.unlock()
+			self._metrics.write(result)
+		logging.info("End " + func)
+		logging.info("******************************************************************************")
+		return result
+
+	def _resync(self, dataset):
+		func = 'DatasetResync._resync'
+		feature_class = os.path.join(self._stagingWorkspace(), dataset['table'])
+		with self._metrics.timer('readKeys'):
+			keyIndex = sdeapply.KeyIndex(feature_class, dataset['pkfield'], self._bgbaseEditVersion())
+			existing = numpy.array(keyIndex.keys())
+		seen = []
+		num_failed = 0
+		cursor = self._warehouse.getTable(dataset)
+		if cursor is None:
+			return False
+		#arcpy.da cursors only write versioned data in an edit session, each block is one edit operation
+		session = sdeapply.EditSession(self._stagingWorkspace(), keyIndex)
+		session.start()
+		try:
+			fields = self._dbutil.getColumns(cursor)
+			plan = sdeapply.FieldPlan.get(dataset, feature_class, fields)
+			loader = _BlockLoader(dataset, feature_class, plan, self._bulkChunkSize())
+			dtypes = self._dtypes(cursor, plan)
+			while True:
+				with self._metrics.timer('fetch'):
+					rows = cursor.fetchmany(self._fetchSize())
+				if len(rows) == 0:
+					break
+				with self._metrics.timer('convert'):
+					block = _toArray(rows, plan.columns, plan.names, dtypes)
+					shapes = self._shapes(rows, plan) if plan.hasXY else [None] * len(rows)
+					keys = block[dataset['pkfield']].data
+					new = ~numpy.in1d(keys, existing)
+					values = block.tolist()
+				seen.append(keys)
+				with session.editOperation():
+					with self._metrics.timer('update'):
+						num_failed = num_failed + loader.update([(values[i], shapes[i]) for i in numpy.flatnonzero(~new)])
+					with self._metrics.timer('insert'):
+						num_failed = num_failed + loader.insert([(values[i], shapes[i]) for i in numpy.flatnonzero(new)])
+				logging.debug('Loaded ' + str(sum([len(item) for item in seen])) + ' rows into ' + dataset['table'])
+		except:
+			tb = sys.exc_info()[2]
+			tbinfo = traceback.format_tb(tb)[0]
+			msg = "Error in " + func + ":\n" + tbinfo + "\nError Info:\n" + str(sys.exc_info()[1])
+			arcpy.AddError(msg)
+			logging.error(msg)
+			session.stop(False)
+			return False
+		finally:
+			self._warehouse.endTableRead()
+
+		try:
+			with self._metrics.timer('delete'):
+				stale = numpy.setdiff1d(existing, numpy.concatenate(seen)) if len(seen) > 0 else existing
+				with session.editOperation():
+					num_failed = num_failed + loader.delete(stale.tolist())
+		finally:
+			with self._metrics.timer('saveEdits'):
+				session.stop()
+		for name, n in loader.counts.items():
+			self._metrics.count(name, n)
+		logging.info('Resync of ' + dataset['table'] + ': ' + ', '.join([str(n) + ' ' + name for name, n in sorted(loader.counts.items())]))
+		if num_failed > 0:
+			logging.error(str(num_failed) + ' rows of ' + dataset['table'] + ' failed to load. The watermark is not moved, run the resync again')
+			return False
+
+		with self._metrics.timer('watermark'):
+			if not self._warehouse.setWatermark(dataset, self._clearCdcRecords()):
+				return False
+			if self._checkpointPath() and dataset.get('resync_lsn') is not None:
+				checkpoints = util.CheckpointStore(self._checkpointPath())
+				checkpoints.set(dataset['cdc_table'], dataset['resync_lsn'], self._upsertUntil(dataset))
+				checkpoints.save()
+		logging.info('Set the watermark of ' + dataset['table'] + ' to ' + str(dataset.get('resync_time')))
+		return True
+
+	#Returns the LSN up to which the import applies inserts of keys that exist as updates. resync_lsn is the last LSN
+	#captured when the rows were read, so changes committed before the read but captured after it are read again from
+	#CDC. The maximum LSN once the rows are loaded covers the changes capture caught up with in the meantime.
+	def _upsertUntil(self, dataset):
+		lsn = self._warehouse.getMaxLsn()
+		if lsn is None or lsn < dataset['resync_lsn']:
+			return dataset['resync_lsn']
+		return lsn
+
+	#Returns the NumPy type and NULL fill value of each column of the plan, from the Python types of the cursor description.
+	def _dtypes(self, cursor, plan):
+		description = cursor.description
+		dtypes = []
+		for column in plan.columns:
+			dtype = ('O', None)
+			for type, code, fill in _NUMERIC_TYPES:
+				if description[column][1] is type:
+					dtype = (code, fill)
+			dtypes.append(dtype)
+		return dtypes
+
+	#Returns the (x, y) of each row, or None for rows whose X or Y is NULL or not a finite number.
+	def _shapes(self, rows, plan):
+		xy = _toArray(rows, (plan.xColumn, plan.yColumn), ('x', 'y'), [('f8', 0.0), ('f8', 0.0)])
+		mask = numpy.ma.getmaskarray(xy['x']) | numpy.ma.getmaskarray(xy['y'])
+		valid = ~mask & numpy.isfinite(xy['x'].data) & numpy.isfinite(xy['y'].data)
+		points = numpy.column_stack((xy['x'].data, xy['y'].data)).tolist()
+		return [tuple(point) if ok else None for point, ok in zip(points, valid.tolist())]
+
+	def _stagingWorkspace(self):
+		return self._config['stagingWorkspace']
+
+	def _bgbaseEditVersion(self):
+		return self._config['bgbaseEditVersion']
+
+	def _checkpointPath(self):
+		return self._config['checkpointPath']
+
+	#CDC records can only be kept when high-water marks are used, otherwise they would be read again
+	def _clearCdcRecords(self):
+		return self._config['clearCdcRecords'] != 'false' or not self._checkpointPath()
+
+	def _fetchSize(self):
+		if self._config['resyncFetchSize']:
+			return int(self._config['resyncFetchSize'])
+		return 10000
+
+	def _bulkChunkSize(self):
+		if self._config['bulkChunkSize']:
+			return int(self._config['bulkChunkSize'])
+		return 500
+
+###################################################################################################
+###################################################################################################
+#
+# class:	DatasetVerify
+# purpose:	Finds the rows of one dataset that differ between its Warehouse table and SDE without
+#			copying either side. Each row is hashed from its primary key and the values of the
+#			fields both sides have, canonicalized so that e.g. a Decimal and a Double compare
+#			equal, and the hashes are rolled up into verifyBuckets digests (the XOR of the row
+#			hashes and the number of rows) by key range, or by a hash of the key if the key is
+#			not a number. Only the buckets whose digests differ are read again, with the rows
+#			of both sides, to find the rows to insert, update and delete in SDE. Rows with CDC
+#			records that have not been imported yet are left to the import. The repair set is
+#			written to a JSON report in the folder of the import log, and applied if asked to,
+#			in one edit session.
+#
+###################################################################################################
+
+class DatasetVerify(object):
+	#warehouse:	Warehouse object that the table is read from.
+	#config: connector.util.Config object with the keys of DatasetResync, and:
+	#	verifyBuckets:			Optional. Number of buckets the row hashes are rolled up into. Defaults to 1024.
+	#	importLogFile:			The report is written to the folder of this file.
+	def __init__(self, warehouse, config):
+		self._warehouse = warehouse
+		self._config = config
+		self._dbutil = util.DBUtil()
+		self._metrics = metrics.RunMetrics('verify', '')
+		self._range = None
+
+	#Verifies the dataset whose TABLE_NAME is table, and repairs SDE if repair is True.
+	#Returns the repair set, a dictionary of insert, update, delete and pending keys, or None if the verify failed.
+	def run(self, table, repair = False):
+		func = 'DatasetVerify.run'
+		logging.info(" ")
+		logging.info(" ")
+		logging.info("******************************************************************************")
+		logging.info("Begin " + func + " " + table)
+
+		keys = ["lockFilePath", "stagingWorkspace", "bgbaseEditVersion"]
+		if not self._config.hasValues(keys):
+			logging.error('Invalid config file.')
+			logging.info('End ' + func);
+			logging.info("******************************************************************************")
+			return None
+
+		datasets = [dataset for dataset in self._warehouse.getSyncDatasets() if dataset['table'].lower() == table.lower()]
+		if len(datasets) == 0:
+			logging.error(table + ' is not in the sync table')
+			logging.info('End ' + func);
+			logging.info("******************************************************************************")
+			return None
+
+		lockfile = util.LockFile(self._config['lockFilePath'])
+		if lockfile.locked():
+			logging.error("WarehouseToSde is already running")
+			logging.info('If WarehouseToSde is not running, then delete the file %s', self._config['lockFilePath'])
+			logging.info('End ' + func);
+			logging.info("******************************************************************************")
+			return None
+		lockfile.lock()
+		self._metrics = metrics.RunMetrics('verify', self._config['importMetricsFile'], self._config['metricsFormat'])
+		result = None
+		try:
+			result = self._verify(datasets[0], repair)
+		except:
+			tb = sys.exc_info()[2]
+			tbinfo = traceback.format_tb(tb)[0]
+			msg = "Error in " + func + ":\n" + tbinfo + "\nError Info:\n" + str(sys.exc_info()[1])
+			arcpy.AddError(msg)
+			logging.error(msg)
+		finally:
+			lockfile.unlock()
+			self._metrics.write(result is not None)
+		logging.info("End " + func)
+		logging.info("******************************************************************************")
+		return result
+
+	def _verify(self, dataset, repair):
+		feature_class = os.path.join(self._stagingWorkspace(), dataset['table'])
+		self._range = self._keyRange(dataset)
+		with self._metrics.timer('hash'):
+			warehouse = self._digests(self._warehouseRows(dataset, feature_class, None))
+			sde = self._digests(self._sdeRows(dataset, feature_class, None))
+		self._metrics.count('warehouseRows', int(warehouse[1].sum()))
+		self._metrics.count('sdeRows', int(sde[1].sum()))
+		differ = numpy.flatnonzero((warehouse[0] != sde[0]) | (warehouse[1] != sde[1])).tolist()
+		logging.info(dataset['table'] + ' has ' + str(int(warehouse[1].sum())) + ' rows in the Warehouse and ' + str(int(sde[1].sum())) + ' in SDE, ' + str(len(differ)) + ' of ' + str(self._buckets()) + ' buckets differ')
+		self._metrics.count('differentBuckets', len(differ))
+
+		repairs = {'insert': [], 'update': [], 'delete': [], 'pending': []}
+		if len(differ) > 0:
+			with self._metrics.timer('drillDown'):
+				rows = self._drillDown(dataset, feature_class, differ)
+			pending = self._pendingKeys(dataset)
+			for key in sorted(set(rows[0].keys()) | set(rows[1].keys())):
+				if key in rows[0] and key in rows[1] and rows[0][key][0] == rows[1][key][0]:
+					continue
+				if key in pending:
+					repairs['pending'].append(key)
+				elif not key in rows[1]:
+					repairs['insert'].append(key)
+				elif not key in rows[0]:
+					repairs['delete'].append(key)
+				else:
+					repairs['update'].append(key)
+			if repair:
+				with self._metrics.timer('repair'):
+					self._repair(dataset, feature_class, repairs, rows[0])
+		for action in ('insert', 'update', 'delete', 'pending'):
+			self._metrics.count(action, len(repairs[action]))
+		logging.info('Repair set of ' + dataset['table'] + ': ' + ', '.join([str(len(repairs[action])) + ' to ' + action for action in ('insert', 'update', 'delete')]) + ', ' + str(len(repairs['pending'])) + ' with pending CDC records')
+		self._writeReport(dataset, repairs, repair)
+		return repairs
+
+	#Returns the bucket digests of rows, (key, hash) blocks, as the XOR of the row hashes and the number of rows of each bucket.
+	def _digests(self, rows):
+		digests = numpy.zeros(self._buckets(), 'u8')
+		counts = numpy.zeros(self._buckets(), 'i8')
+		for keys, hashes in rows:
+			buckets = self._bucketsOf(keys)
+			numpy.bitwise_xor.at(digests, buckets, numpy.array(hashes, 'u8'))
+			numpy.add.at(counts, buckets, 1)
+		return (digests, counts)
+
+	#Reads the rows of the buckets that differ on both sides. Returns two dictionaries of key -> (hash, values, shape),
+	#for the Warehouse and for SDE.
+	def _drillDown(self, dataset, feature_class, differ):
+		result = []
+		for read in (self._warehouseRows, self._sdeRows):
+			rows = dict()
+			wanted = set(differ)
+			for where in self._whereClauses(dataset, differ):
+				for keys, hashes, values, shapes in read(dataset, feature_class, where, True):
+					buckets = self._bucketsOf(keys).tolist()
+					for i in range(len(keys)):
+						if buckets[i] in wanted:
+							rows[keys[i]] = (hashes[i], values[i], shapes[i])
+			result.append(rows)
+		return result
+
+	#Yields (keys, hashes) blocks of the Warehouse rows that match where, with the values and shapes if values is True.
+	def _warehouseRows(self, dataset, feature_class, where, values = False):
+		cursor = self._warehouse.getRows(dataset, where)
+		if cursor is None:
+			raise ValueError('Cannot read the Warehouse table of ' + dataset['table'])
+		try:
+			fields = self._dbutil.getColumns(cursor)
+			plan = sdeapply.FieldPlan.get(dataset, feature_class, fields)
+			pk = fields[dataset['pkfield']]
+			while True:
+				rows = cursor.fetchmany(self._fetchSize())
+				if len(rows) == 0:
+					break
+				keys = [row[pk] for row in rows]
+				items = [plan.values(row) for row in rows]
+				shapes = [plan.xy(row) for row in rows]
+				hashes = self._hashes(dataset, plan, items, shapes)
+				if values:
+					yield (keys, hashes, items, shapes)
+				else:
+					yield (keys, hashes)
+		finally:
+			self._warehouse.endTableRead()
+
+	#Yields (keys, hashes) blocks of the SDE rows in the BG-BASE version that match where, with the values and shapes if values is True.
+	def _sdeRows(self, dataset, feature_class, where, values = False):
+		fields = self._warehouseFields(dataset)
+		plan = sdeapply.FieldPlan.get(dataset, feature_class, fields)
+		names = list(plan.names)
+		if plan.hasXY:
+			names.append('SHAPE@XY')
+		pk = plan.names.index(dataset['pkfield'])
+		view = "verify" + str(uuid.uuid1()).replace("-", "")
+		if plan.hasXY:
+			arcpy.MakeFeatureLayer_management(feature_class, view)
+		else:
+			arcpy.MakeTableView_management(feature_class, view)
+		try:
+			arcpy.ChangeVersion_management(view, 'TRANSACTIONAL', self._bgbaseEditVersion(), '')
+			with arcpy.da.SearchCursor(view, names, where) as features:
+				block = []
+				for feature in features:
+					block.append(feature)
+					if len(block) >= self._fetchSize():
+						yield self._sdeBlock(dataset, plan, pk, block, values)
+						block = []
+				if len(block) > 0:
+					yield self._sdeBlock(dataset, plan, pk, block, values)
+		finally:
+			arcpy.Delete_management(view)
+
+	def _sdeBlock(self, dataset, plan, pk, block, values):
+		keys = [feature[pk] for feature in block]
+		if plan.hasXY:
+			items = [tuple(feature[:-1]) for feature in block]
+			shapes = [feature[-1] for feature in block]
+		else:
+			items = [tuple(feature) for feature in block]
+			shapes = [None] * len(block)
+		hashes = self._hashes(dataset, plan, items, shapes)
+		if values:
+			return (keys, hashes, items, shapes)
+		return (keys, hashes)
+
+	#Returns the column name -> index dictionary of the Warehouse table, so SDE is hashed with the same fields.
+	def _warehouseFields(self, dataset):
+		if not 'verify_fields' in dataset:
+			cursor = self._warehouse.getRows(dataset, '1 = 0')
+			if cursor is None:
+				raise ValueError('Cannot read the Warehouse table of ' + dataset['table'])
+			try:
+				dataset['verify_fields'] = self._dbutil.getColumns(cursor)
+			finally:
+				self._warehouse.endTableRead()
+		return dataset['verify_fields']
+
+	#Returns the hash of each row. The shape is only hashed if the feature class does not have the X/Y fields, which are
+	#hashed as values otherwise.
+	def _hashes(self, dataset, plan, items, shapes):
+		if plan.hasXY and not (dataset['xfield'] in plan.names and dataset['yfield'] in plan.names):
+			return [_rowHash(item, shape) for item, shape in zip(items, shapes)]
+		return [_rowHash(item) for item in items]
+
+	#Returns the (smallest, span) of the Warehouse keys if they are numbers, so buckets are key ranges, otherwise None.
+	def _keyRange(self, dataset):
+		keys = self._warehouse.getKeyRange(dataset)
+		if keys is None or keys[0] is None or isinstance(keys[0], bool) or not isinstance(keys[0], (int, long)):
+			return None
+		return (keys[0], keys[1] - keys[0] + 1)
+
+	#Returns the bucket of each key as an array. Keys outside the Warehouse range are in the first or the last bucket.
+	def _bucketsOf(self, keys):
+		if self._range is None:
+			return numpy.array([zlib.crc32(_canonical(key).encode('utf-8')) & 0xffffffff for key in keys], 'i8') % self._buckets()
+		lo, span = self._range
+		return numpy.clip((numpy.array(keys, 'i8') - lo) * self._buckets() // span, 0, self._buckets() - 1)
+
+	#Returns where clauses that select the key ranges of the buckets, 50 ranges per clause,
+	#or [None] if the buckets are not key ranges and the whole table has to be read again.
+	def _whereClauses(self, dataset, buckets):
+		if self._range is None:
+			return [None]
+		lo, span = self._range
+		field = dataset['pkfield']
+		ranges = []
+		for bucket in buckets:
+			if len(ranges) > 0 and ranges[-1][1] == bucket:
+				ranges[-1][1] = bucket + 1
+			else:
+				ranges.append([bucket, bucket + 1])
+		clauses = []
+		for start, end in ranges:
+			conditions = []
+			if start > 0:
+				conditions.append(field + ' >= ' + str(lo - (-start * span // self._buckets())))
+			if end < self._buckets():
+				conditions.append(field + ' < ' + str(lo - (-end * span // self._buckets())))
+			clauses.append('(' + ' AND '.join(conditions) + ')' if len(conditions) > 0 else '(1 = 1)')
+		return [' OR '.join(clauses[i:i + 50]) for i in range(0, len(clauses), 50)]
+
+	#Returns the keys that have CDC records the import has not applied yet.
+	def _pendingKeys(self, dataset):
+		keys = set()
+		if self._config['checkpointPath']:
+			dataset['last_lsn'] = util.CheckpointStore(self._config['checkpointPath']).get(dataset['cdc_table'])
+		cursor = self._warehouse.getChanges(dataset)
+		if cursor is None:
+			if dataset.get('read_error'):
+				raise ValueError('Cannot read the CDC records of ' + dataset['table'])
+			return keys
+		fields = self._dbutil.getColumns(cursor)
+		for row in cursor:
+			keys.add(row[fields[dataset['pkfield']]])
+		return keys
+
+	#Applies the repair set to SDE with the Warehouse values of the rows.
+	def _repair(self, dataset, feature_class, repairs, rows):
+		plan = sdeapply.FieldPlan.get(dataset, feature_class, self._warehouseFields(dataset))
+		loader = _BlockLoader(dataset, feature_class, plan, self._bulkChunkSize())
+		keyIndex = sdeapply.KeyIndex(feature_class, dataset['pkfield'], self._bgbaseEditVersion())
+		#arcpy.da cursors only write versioned data in an edit session, the repair set is one edit operation
+		session = sdeapply.EditSession(self._stagingWorkspace(), keyIndex)
+		session.start()
+		saved = False
+		try:
+			with session.editOperation():
+				num_failed = loader.insert([rows[key][1:] for key in repairs['insert']])
+				num_failed = num_failed + loader.update([rows[key][1:] for key in repairs['update']])
+				num_failed = num_failed + loader.delete(repairs['delete'])
+			saved = True
+		finally:
+			session.stop(saved)
+		for name, n in loader.counts.items():
+			self._metrics.count(name, n)
+		logging.info('Repaired ' + dataset['table'] + ': ' + ', '.join([str(n) + ' ' + name for name, n in sorted(loader.counts.items())]))
+		if num_failed > 0:
+			logging.error(str(num_failed) + ' rows of ' + dataset['table'] + ' failed to repair')
+
+	#Writes the repair set to verify.<table>.<timestamp>.json in the folder of the import log.
+	def _writeReport(self, dataset, repairs, repaired):
+		logFile = self._config['importLogFile']
+		folder = os.path.dirname(os.path.abspath(logFile)) if logFile else os.getcwd()
+		path = os.path.join(folder, 'verify.' + dataset['table'] + '.' + strftime("%m%d%Y_%H%M%S") + '.json')
+		report = {'table': dataset['table'], 'buckets': self._buckets(), 'repaired': repaired, 'counts': self._metrics.counts}
+		report.update(repairs)
+		try:
+			with open(path, 'w') as f:
+				json.dump(report, f, indent = 1, sort_keys = True, default = str)
+			logging.info('Wrote the repair set to ' + path)
+		except:
+			logging.error('Error writing ' + path + ': ' + str(sys.exc_info()[1]))
+
+	def _stagingWorkspace(self):
+		return self._config['stagingWorkspace']
+
+	def _bgbaseEditVersion(self):
+		return self._config['bgbaseEditVersion']
+
+	def _buckets(self):
+		if self._config['verifyBuckets']:
+			return int(self._config['verifyBuckets'])
+		return 1024
+
+	def _fetchSize(self):
+		if self._config['resyncFetchSize']:
+			return int(self._config['resyncFetchSize'])
+		return 10000
+
+	def _bulkChunkSize(self):
+		if self._config['bulkChunkSize']:
+			return int(self._config['bulkChunkSize'])
+		return 500
+
+#Returns a row value as text that is the same for the Warehouse and SDE types of the value. Numbers are compared to
+#7 decimals, dates to the second and text without trailing blanks.
+def _canonical(value):
+	if value is None:
+		return u'\x00'
+	if isinstance(value, bool):
+		return unicode(int(value))
+	if isinstance(value, (int, long)):
+		return unicode(value)
+	if isinstance(value, (float, Decimal)):
+		number = round(float(value), 7)
+		if number == int(number):
+			return unicode(int(number))
+		return unicode(repr(number))
+	if isinstance(value, datetime):
+		return unicode(value.strftime('%Y-%m-%d %H:%M:%S'))
+	if isinstance(value, str):
+		return value.decode('utf-8', 'replace').rstrip()
+	return unicode(value).rstrip()
+
+#Returns the 64 bit hash of the values of a row and, if given, its shape. Each value is preceded by its length, so
+#values that hold the separator cannot run into the next one.
+def _rowHash(values, shape = None):
+	text = u'\x1f'.join([_sized(_canonical(value)) for value in values])
+	if shape is not None and shape[0] is not None and shape[1] is not None:
+		text = text + u'\x1e' + _sized(_canonical(shape[0])) + u'\x1f' + _sized(_canonical(shape[1]))
+	return int(hashlib.sha1(text.encode('utf-8')).hexdigest()[:16], 16)
+
+def _sized(text):
+	return unicode(len(text)) + u':' + text
+
+#Returns a masked structured array with a field for each column of the rows, and NULLs masked.
+#columns:	Indices of the columns in the rows.
+#names:		Field names of the columns.
+#dtypes:	(NumPy type, NULL fill value) of each column.
+def _toArray(rows, columns, names, dtypes):
+	data = numpy.empty(len(rows), [(str(name), dtype[0]) for name, dtype in zip(names, dtypes)])
+	mask = numpy.empty(len(rows), [(str(name), '?') for name in names])
+	for column, name, dtype in zip(columns, names, dtypes):
+		values = [row[column] for row in rows]
+		nulls = numpy.array([value is None for value in values], '?')
+		mask[str(name)] = nulls
+		if nulls.any() and dtype[0] != 'O':
+			values = [dtype[1] if value is None else value for value in values]
+		data[str(name)] = values
+	return numpy.ma.array(data, mask = mask)
+
+###################################################################################################
+###################################################################################################
+#
+# class:	_BlockLoader
+# purpose:	Loads blocks of (values, shape) rows into a feature class with arcpy.da cursors and
+#			counts the rows inserted, updated, unchanged and deleted.
+#
+###################################################################################################
+
+class _BlockLoader(object):
+	def __init__(self, dataset, featureClass, plan, chunkSize):
+		self._dataset = dataset
+		self._featureClass = featureClass
+		self._plan = plan
+		self._chunkSize = chunkSize
+		self._pkField = dataset['pkfield']
+		self._pkIndex = plan.names.index(self._pkField)
+		self._cursorFields = list(plan.names)
+		if plan.hasXY:
+			self._cursorFields.append('SHAPE@XY')
+		self.counts = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'deleted': 0}
+
+	#Inserts the rows through one insert cursor. Returns the number of rows that failed.
+	def insert(self, rows):
+		num_failed = 0
+		if len(rows) == 0:
+			return num_failed
+		with arcpy.da.InsertCursor(self._featureClass, self._cursorFields) as features:
+			for values, shape in rows:
+				try:
+					features.insertRow(self._values(values, shape))
+					self.counts['inserted'] = self.counts['inserted'] + 1
+				except:
+					num_failed = num_failed + 1
+					logging.error("Insert failed for " + str(values[self._pkIndex]) + ": " + str(sys.exc_info()[1]))
+		return num_failed
+
+	#Rewrites the rows that differ from the features with their key. Returns the number of rows that failed.
+	def update(self, rows):
+		num_failed = 0
+		for i in range(0, len(rows), self._chunkSize):
+			byKey = dict()
+			for values, shape in rows[i:i + self._chunkSize]:
+				byKey[values[self._pkIndex]] = (values, shape)
+			with arcpy.da.UpdateCursor(self._featureClass, self._cursorFields, sdeapply.whereClause(self._featureClass, self._pkField, byKey.keys())) as features:
+				for feature in features:
+					row = byKey.pop(feature[self._pkIndex], None)
+					if row is None:
+						continue
+					values = self._values(row[0], row[1] if row[1] is not None or not self._plan.hasXY else feature[-1])
+					if self._same(feature, values):
+						self.counts['unchanged'] = self.counts['unchanged'] + 1
+						continue
+					try:
+						features.updateRow(values)
+						self.counts['updated'] = self.counts['updated'] + 1
+					except:
+						num_failed = num_failed + 1
+						logging.error("Update failed for " + str(row[0][self._pkIndex]) + ": " + str(sys.exc_info()[1]))
+			#a key in the version but not found by the cursor, e.g. deleted since the keys were read
+			num_failed = num_failed + self.insert(byKey.values())
+		return num_failed
+
+	#Deletes the features with the keys. Returns the number of features that failed to delete.
+	def delete(self, keys):
+		num_failed = 0
+		for i in range(0, len(keys), self._chunkSize):
+			with arcpy.da.UpdateCursor(self._featureClass, [self._pkField], sdeapply.whereClause(self._featureClass, self._pkField, keys[i:i + self._chunkSize])) as features:
+				for feature in features:
+					try:
+						features.deleteRow()
+						self.counts['deleted'] = self.counts['deleted'] + 1
+					except:
+						num_failed = num_failed + 1
+						logging.error("Delete failed for " + str(feature[0]) + ": " + str(sys.exc_info()[1]))
+		return num_failed
+
+	def _values(self, values, shape):
+		if self._plan.hasXY:
+			return tuple(values) + (shape,)
+		return tuple(values)
+
+	#Returns True if a feature already holds the values, with points compared to 1e-9.
+	def _same(self, feature, values):
+		if self._plan.hasXY:
+			a = feature[-1]
+			b = values[-1]
+			if (a is None) != (b is None):
+				return False
+			if a is not None and (abs(float(a[0]) - float(b[0])) > 1e-9 or abs(float(a[1]) - float(b[1])) > 1e-9):
+				return False
+			return tuple(feature[:-1]) == values[:-1]
+		return tuple(feature) == values
@@ -0,0 +1,453 @@
+import os, sys, arcpy
+import traceback, logging, uuid
+from operator import itemgetter
+
+###################################################################################################
+###################################################################################################
+#
+# class:	FieldPlan
+# purpose:	Mapping from the columns of a change cursor to the fields of a feature class, compiled
+#			once per dataset. Holds the ordered target fields, the matching cursor column indices,
+#			the X/Y column indices and the fields that are missing from the Warehouse, which are
+#			logged once when the plan is compiled. Plans are cached for the life of the process,
+#			keyed on the feature class schema and the cursor columns, so a schema change compiles
+#			a new plan.
+#
+###################################################################################################
+
+class FieldPlan(object):
+	_cache = dict()
+
+	#Returns the plan for a dataset. Costs one ListFields call to read the feature class schema.
+	#dataset:		Dataset dictionary from Warehouse.getSyncDatasets.
+	#featureClass:	Path to the feature class or table in SDE.
+	#fields:		Column name -> index dictionary of the change cursor.
+	@classmethod
+	def get(cls, dataset, featureClass, fields):
+		schema = tuple([(field.name, field.type) for field in arcpy.ListFields(featureClass)])
+		key = (featureClass, schema, tuple(sorted(fields.items())), dataset['xfield'], dataset['yfield'])
+		plan = cls._cache.get(key)
+		if plan is None:
+			plan = FieldPlan(dataset, featureClass, schema, fields)
+			cls._cache[key] = plan
+		return plan
+
+	def __init__(self, dataset, featureClass, schema, fields):
+		self.names = []
+		self.missing = []
+		columns = []
+		for name, type in schema:
+			if type == "OID" or type == "Geometry":
+				continue
+			if name in fields:
+				self.names.append(name)
+				columns.append(fields[name])
+			elif name != "GlobalID":
+				self.missing.append(name)
+		if len(self.missing) > 0:
+			logging.warn('Fields not found in Warehouse for ' + featureClass + ': ' + ', '.join(self.missing))
+		self.columns = tuple(columns)
+		self.hasXY = dataset['xfield'] is not None and dataset['yfield'] is not None
+		self.xColumn = fields[dataset['xfield']] if self.hasXY else None
+		self.yColumn = fields[dataset['yfield']] if self.hasXY else None
+		if len(columns) == 1:
+			getter = itemgetter(columns[0])
+			self.values = lambda row: (getter(row),)
+		elif len(columns) > 1:
+			self.values = itemgetter(*columns)
+		else:
+			self.values = lambda row: ()
+
+	#Returns the (x, y) of a row, or None if the dataset has no XY fields or the row has no coordinates.
+	def xy(self, row):
+		if not self.hasXY:
+			return None
+		x = row[self.xColumn]
+		y = row[self.yColumn]
+		if x is None or y is None:
+			return None
+		return (x, y)
+
+	#Loads a row into a feature of an arcpy.InsertCursor or arcpy.UpdateCursor.
+	def load(self, feature, row):
+		for name, value in zip(self.names, self.values(row)):
+			feature.setValue(name, value)
+		xy = self.xy(row)
+		if xy is not None:
+			feature.shape = arcpy.PointGeometry(arcpy.Point(xy[0], xy[1]))
+
+###################################################################################################
+###################################################################################################
+#
+# class:	KeyIndex
+# purpose:	In-memory index of the primary keys of a dataset in the BG-BASE version. Loaded once
+#			with a single search cursor and kept current as inserts and deletes are applied, so
+#			existence checks do not need a feature layer and GetCount per row. Changes made
+#			between begin and rollback are undone when an edit operation is aborted.
+#
+###################################################################################################
+
+class KeyIndex(object):
+	#featureClass:	Path to the feature class or table in SDE.
+	#pkField:		Name of the primary key field.
+	#version:		Name of the version to read the keys from.
+	def __init__(self, featureClass, pkField, version):
+		self._featureClass = featureClass
+		self._pkField = pkField
+		self._version = version
+		self._keys = set()
+		self._journal = None
+		self._load()
+
+	def __len__(self):
+		return len(self._keys)
+
+	def _load(self):
+		view = "keys" + str(uuid.uuid1()).replace("-", "")
+		arcpy.MakeTableView_management(self._featureClass, view)
+		try:
+			arcpy.ChangeVersion_management(view, 'TRANSACTIONAL', self._version, '')
+			with arcpy.da.SearchCursor(view, [self._pkField]) as rows:
+				for row in rows:
+					self._keys.add(row[0])
+		finally:
+			arcpy.Delete_management(view)
+		logging.debug('Loaded ' + str(len(self._keys)) + ' keys from ' + self._featureClass)
+
+	def contains(self, key):
+		return key in self._keys
+
+	def keys(self):
+		return list(self._keys)
+
+	def add(self, key):
+		if self._journal is not None and not key in self._keys:
+			self._journal.append((key, False))
+		self._keys.add(key)
+
+	def remove(self, key):
+		if self._journal is not None and key in self._keys:
+			self._journal.append((key, True))
+		self._keys.discard(key)
+
+	#Starts recording adds and removes, so they can be rolled back with an aborted edit operation.
+	def begin(self):
+		self._journal = []
+
+	def commit(self):
+		self._journal = None
+
+	#Undoes the adds and removes since begin.
+	def rollback(self):
+		if self._journal is None:
+			return
+		for key, existed in reversed(self._journal):
+			if existed:
+				self._keys.add(key)
+			else:
+				self._keys.discard(key)
+		self._journal = None
+
+###################################################################################################
+###################################################################################################
+#
+# class:	BulkApplier
+# purpose:	Applies the net changes of one dataset to SDE set-based instead of row by row.
+#			Changes are grouped by operation. Inserts go through one arcpy.da.InsertCursor per
+#			batch, updates and deletes through one arcpy.da.UpdateCursor per batch with a
+#			PK IN (...) where clause, matched back to the changes with a key -> change dictionary.
+#			Each change's applied flag is set to True or False, so only the changes that were
+#			actually applied are acknowledged.
+#			Changes must be coalesced, one change per key, since grouping reorders them.
+#			If the dataset's upsert flag is set, inserts of keys that exist are applied as updates.
+#
+###################################################################################################
+
+class BulkApplier(object):
+	#dataset:		Dataset dictionary from Warehouse.getSyncDatasets.
+	#featureClass:	Path to the feature class or table in SDE.
+	#plan:			FieldPlan of the dataset.
+	#keyIndex:		KeyIndex of the dataset.
+	#chunkSize:		Maximum number of rows per cursor (and keys per IN clause).
+	def __init__(self, dataset, featureClass, plan, keyIndex, chunkSize = 500):
+		self._dataset = dataset
+		self._featureClass = featureClass
+		self._plan = plan
+		self._keyIndex = keyIndex
+		self._chunkSize = chunkSize
+		self._pkField = dataset['pkfield']
+		self._pkIndex = plan.names.index(self._pkField)
+		self._cursorFields = list(plan.names)
+		if plan.hasXY:
+			self._cursorFields.append('SHAPE@XY')
+
+	#Applies the changes and returns them with their applied flag set.
+	def apply(self, changes):
+		func = 'BulkApplier.apply'
+		inserts = []
+		updates = []
+		deletes = []
+		missing = []
+		for change in changes:
+			if change.operation == "insert":
+				#after a resync, the rows it loaded may already hold the insert
+				if self._dataset.get('upsert') and self._keyIndex.contains(change.key):
+					updates.append(change)
+				else:
+					inserts.append(change)
+			elif change.operation == "update":
+				if self._keyIndex.contains(change.key):
+					updates.append(change)
+				else:
+					missing.append(change)
+			elif change.operation == "delete":
+				deletes.append(change)
+
+		try:
+			logging.debug('Bulk applying ' + str(len(inserts)) + ' inserts, ' + str(len(updates) + len(missing)) + ' updates and ' + str(len(deletes)) + ' deletes to ' + self._dataset['table'])
+			for chunk in self._chunks(deletes):
+				self._applyDeletes(chunk)
+			for chunk in self._chunks(updates):
+				missing.extend(self._applyUpdates(chunk))
+			if len(missing) > 0:
+				logging.warn(str(len(missing)) + ' updated records were not found in ' + self._dataset['table'] + ', attempting to insert them instead')
+			for chunk in self._chunks(self._checkInserts(inserts) + missing):
+				self._applyInserts(chunk)
+		except:
+			tb = sys.exc_info()[2]
+			tbinfo = traceback.format_tb(tb)[0]
+			msg = "Error in " + func + ":\n" + tbinfo + "\nError Info:\n" + str(sys.exc_info()[1])
+			arcpy.AddError(msg)
+			logging.error(msg)
+
+		for change in changes:
+			if change.operation and change.applied is None:
+				change.applied = False
+		return changes
+
+	#Returns the cursor values for a change. shape is kept if the change has no coordinates.
+	def _values(self, change, shape = None):
+		values = self._plan.values(change.row)
+		if self._plan.hasXY:
+			xy = self._plan.xy(change.row)
+			values = values + ((xy if xy is not None else shape),)
+		return values
+
+	def _chunks(self, changes):
+		for i in range(0, len(changes), self._chunkSize):
+			yield changes[i:i + self._chunkSize]
+
+	#Fails inserts for keys that already exist and returns the remaining ones.
+	def _checkInserts(self, changes):
+		result = []
+		for change in changes:
+			if self._keyIndex.contains(change.key):
+				logging.error('Cannot insert record ' + str(change.key) + '. Record already exists')
+				change.applied = False
+			else:
+				result.append(change)
+		return result
+
+	def _applyInserts(self, changes):
+		func = 'BulkApplier._applyInserts'
+		try:
+			with arcpy.da.InsertCursor(self._featureClass, self._cursorFields) as features:
+				for change in changes:
+					try:
+						features.insertRow(self._values(change))
+						self._keyIndex.add(change.key)
+						change.applied = True
+					except:
+						change.applied = False
+						logging.error("Insert failed for " + str(change.key) + ": " + str(sys.exc_info()[1]))
+		except:
+			tb = sys.exc_info()[2]
+			tbinfo = traceback.format_tb(tb)[0]
+			msg = "Error in " + func + ":\n" + tbinfo + "\nError Info:\n" + str(sys.exc_info()[1])
+			arcpy.AddError(msg)
+			logging.error(msg)
+
+	#Returns the changes whose key was not found.
+	def _applyUpdates(self, changes):
+		func = 'BulkApplier._applyUpdates'
+		byKey = dict()
+		for change in changes:
+			byKey[change.key] = change
+		found = set()
+		try:
+			with arcpy.da.UpdateCursor(self._featureClass, self._cursorFields, whereClause(self._featureClass, self._pkField, byKey.keys())) as features:
+				for feature in features:
+					change = byKey.get(feature[self._pkIndex])
+					if change is None:
+						continue
+					found.add(change.key)
+					try:
+						shape = feature[-1] if self._plan.hasXY else None
+						features.updateRow(self._values(change, shape))
+						if change.applied is None:
+							change.applied = True
+					except:
+						change.applied = False
+						logging.error("Update failed for " + str(change.key) + ": " + str(sys.exc_info()[1]))
+		except:
+			tb = sys.exc_info()[2]
+			tbinfo = traceback.format_tb(tb)[0]
+			msg = "Error in " + func + ":\n" + tbinfo + "\nError Info:\n" + str(sys.exc_info()[1])
+			arcpy.AddError(msg)
+			logging.error(msg)
+			return []
+		return [change for change in changes if not change.key in found]
+
+	def _applyDeletes(self, changes):
+		func = 'BulkApplier._applyDeletes'
+		byKey = dict()
+		for change in changes:
+			byKey[change.key] = change
+		try:
+			with arcpy.da.UpdateCursor(self._featureClass, [self._pkField], whereClause(self._featureClass, self._pkField, byKey.keys())) as features:
+				for feature in features:
+					change = byKey.get(feature[0])
+					if change is None:
+						continue
+					try:
+						features.deleteRow()
+						self._keyIndex.remove(change.key)
+						if change.applied is None:
+							change.applied = True
+					except:
+						change.applied = False
+						logging.error("Delete failed for " + str(change.key) + ": " + str(sys.exc_info()[1]))
+		except:
+			tb = sys.exc_info()[2]
+			tbinfo = traceback.format_tb(tb)[0]
+			msg = "Error in " + func + ":\n" + tbinfo + "\nError Info:\n" + str(sys.exc_info()[1])
+			arcpy.AddError(msg)
+			logging.error(msg)
+		for change in changes:
+			if change.applied is None:
+				logging.error('Delete failed for ' + str(change.key) + ', record not found')
+				change.applied = False
+
+###################################################################################################
+###################################################################################################
+#
+# class:	EditSession
+# purpose:	Applies the changes of one dataset inside an arcpy.da.Editor session, grouped into edit
+#			operations of operationSize changes instead of one implicit edit per row. If a change
+#			in an operation fails, the operation is aborted and its changes are retried one per
+#			operation, so only the failed change is left unapplied. The KeyIndex is rolled back
+#			with each aborted operation.
+#
+###################################################################################################
+
+class EditSession(object):
+	#workspace:		Path to the workspace to edit, connected to the version to edit.
+	#keyIndex:		KeyIndex of the dataset.
+	#operationSize:	Maximum number of changes per edit operation.
+	def __init__(self, workspace, keyIndex, operationSize = 500):
+		self._workspace = workspace
+		self._keyIndex = keyIndex
+		self._operationSize = operationSize
+		self._editor = None
+
+	def start(self):
+		self._editor = arcpy.da.Editor(self._workspace)
+		#no undo stack, multiuser mode for versioned data
+		self._editor.startEditing(False, True)
+
+	#Stops the session, saving the edits of the operations that were completed.
+	def stop(self, save = True):
+		if self._editor is None:
+			return
+		try:
+			if self._editor.isEditing:
+				self._editor.stopEditing(save)
+		finally:
+			self._editor = None
+
+	#Applies the changes with apply(change), which returns True if the change was applied.
+	#Sets each change's applied flag.
+	def apply(self, changes, apply):
+		applyAll = lambda chunk: self._applyEach(chunk, apply)
+		for i in range(0, len(changes), self._operationSize):
+			chunk = changes[i:i + self._operationSize]
+			if self.operation(chunk, applyAll):
+				continue
+			logging.warn('Edit operation of ' + str(len(chunk)) + ' changes failed, retrying them one at a time')
+			for change in chunk:
+				if not self.operation([change], applyAll):
+					change.applied = False
+		return changes
+
+	#Applies the changes in one edit operation with applyAll(changes), which returns True if every change
+	#was applied. Otherwise aborts the operation and resets the applied flag of the changes.
+	def operation(self, changes, applyAll):
+		func = 'EditSession.operation'
+		self._editor.startOperation()
+		self._keyIndex.begin()
+		bApplied = False
+		try:
+			bApplied = applyAll(changes)
+		except:
+			tb = sys.exc_info()[2]
+			tbinfo = traceback.format_tb(tb)[0]
+			msg = "Error in " + func + ":\n" + tbinfo + "\nError Info:\n" + str(sys.exc_info()[1])
+			logging.error(msg)
+		if bApplied:
+			self._editor.stopOperation()
+			self._keyIndex.commit()
+			return True
+		self._editor.abortOperation()
+		self._keyIndex.rollback()
+		for change in changes:
+			change.applied = None
+		return False
+
+	#Returns an _EditOperation, a context manager for one edit operation of the session.
+	def editOperation(self):
+		return _EditOperation(self._editor, self._keyIndex)
+
+	#Applies the changes in order and stops at the first one that fails.
+	def _applyEach(self, changes, apply):
+		for change in changes:
+			if not apply(change):
+				return False
+		return True
+
+###################################################################################################
+###################################################################################################
+#
+# class:	_EditOperation
+# purpose:	Context manager for one edit operation of an EditSession. The operation is stopped
+#			when the with block ends, or aborted with the changes to the KeyIndex if it raises.
+#
+###################################################################################################
+
+class _EditOperation(object):
+	def __init__(self, editor, keyIndex):
+		self._editor = editor
+		self._keyIndex = keyIndex
+
+	def __enter__(self):
+		self._editor.startOperation()
+		self._keyIndex.begin()
+		return self
+
+	def __exit__(self, type, value, tb):
+		if type is None:
+			self._editor.stopOperation()
+			self._keyIndex.commit()
+		else:
+			self._editor.abortOperation()
+			self._keyIndex.rollback()
+		return False
+
+#Returns a where clause that selects the rows whose field is one of the keys.
+def whereClause(featureClass, field, keys):
+	return arcpy.AddFieldDelimiters(featureClass, field) + ' IN (' + ','.join([sqlValue(key) for key in keys]) + ')'
+
+#Returns a key as a SQL literal.
+def sqlValue(value):
+	if isinstance(value, basestring):
+		return "'" + value.replace("'", "''") + "'"
+	return str(value)
@@ -0,0 +1,345 @@
+import os, json, gzip, re, hashlib, logging
+from xml.etree import ElementTree
+from xml.sax.saxutils import quoteattr
+try:
+	from xml.etree import cElementTree as _parser
+except ImportError:
+	_parser = ElementTree
+
+#Elements whose children are the records of a dataset, by local name.
+RECORD_CONTAINERS = ('Records', 'IDs')
+
+def _localName(tag):
+	return tag.split('}')[-1]
+
+#Returns True if the data change message at path has at least one record. Reading stops at the first record,
+#so a message with changes costs little more than reading its header.
+def hasRecords(path):
+	with open(path, 'rb') as f:
+		container = False
+		for event, elem in _parser.iterparse(f, ('start', 'end')):
+			if event == 'start':
+				if container:
+					return True
+				container = _localName(elem.tag) in RECORD_CONTAINERS
+			else:
+				container = False
+	return False
+
+#Field types that identify a record, in order of preference.
+KEY_FIELD_TYPES = ('esriFieldTypeGlobalID', 'esriFieldTypeOID')
+
+#Returns the position of the key field in the Fields element of a record set, or 0 if it has none. ArcGIS writes
+#the ObjectID as the first value of a record.
+def _keyIndex(fields):
+	types = []
+	for field in fields.iter():
+		if _localName(field.tag) == 'Type':
+			types.append((field.text or '').strip())
+	for type in KEY_FIELD_TYPES:
+		if type in types:
+			return types.index(type)
+	return 0
+
+#Returns the text that identifies a record, the value of its key field or the ID of a deleted record, or None.
+def _recordKey(record, index):
+	if _localName(record.tag) == 'ID':
+		return (record.text or '').strip()
+	for values in record:
+		if _localName(values.tag) == 'Values':
+			items = list(values)
+			if index < len(items):
+				return (items[index].text or '').strip()
+	return None
+
+#Returns (key, hash) for each record of the data change message at path, reading the message as a stream. The
+#key is the dataset name and the ObjectID or GlobalID of the record, or None if the record has neither. The hash
+#is a hash of the dataset name, the elements that lead to the record (e.g. Inserts/Records) and its XML.
+def recordHashes(path):
+	hashes = []
+	stack = []
+	dataset = ''
+	#record set element (e.g. Inserts) -> position of its key field
+	keyIndex = dict()
+	with open(path, 'rb') as f:
+		for event, elem in _parser.iterparse(f, ('start', 'end')):
+			if event == 'start':
+				stack.append(elem)
+				continue
+			stack.pop()
+			if len(stack) == 0:
+				break
+			parent = stack[-1]
+			if _localName(elem.tag) == 'DatasetName' and _localName(parent.tag) == 'DatasetChanges':
+				dataset = (elem.text or '').strip()
+			elif _localName(elem.tag) == 'Fields' and len(stack) > 3:
+				keyIndex[parent] = _keyIndex(elem)
+			elif _localName(parent.tag) in RECORD_CONTAINERS:
+				elem.tail = None
+				prefix = dataset + '/' + '/'.join([_localName(item.tag) for item in stack[3:]]) + '/'
+				key = _recordKey(elem, keyIndex.get(stack[-2], 0))
+				if key is not None:
+					key = dataset + '/' + key
+				hashes.append((key, hashlib.sha1(prefix.encode('utf-8') + ElementTree.tostring(elem, encoding = 'utf-8')).hexdigest()[:16]))
+				parent.remove(elem)
+			elif len(stack) <= 3:
+				keyIndex.pop(elem, None)
+				parent.remove(elem)
+	return hashes
+
+###################################################################################################
+###################################################################################################
+#
+# class:	MessageSplitter
+# purpose:	Splits a data change message into shards of at most maxRecords records of one dataset,
+#			so BG-BASE can start loading before the whole message is read and can load datasets in
+#			parallel. Each shard is a complete data change message with the header of the original
+#			message, one DatasetChanges element with its DatasetName and other leading elements,
+#			and a slice of its records. The message is read twice with iterparse, once for the
+#			header and once for the records, and every element is dropped once it is written, so
+#			memory does not grow with the size of the message. A JSON manifest lists the shards in
+#			the order they are to be loaded, with their dataset and record count.
+#
+###################################################################################################
+
+class MessageSplitter(object):
+	#maxRecords:	Largest number of records in a shard.
+	#compress:		If true, shards are written gzip compressed, with a .xml.gz extension.
+	def __init__(self, maxRecords, compress = False):
+		self._maxRecords = maxRecords
+		self._compress = compress
+		self._prefixes = dict()
+		self._namespaces = []
+		self._root = None
+		self._before = []
+		self._after = []
+
+	#Splits the message at path into shards named <name>_<order>_<dataset>.xml in folder, and writes <name>.manifest.json.
+	#Returns the paths of the shards in load order, followed by the path of the manifest.
+	def split(self, path, folder, name):
+		self._readHeader(path)
+		shards = []
+		dataset = None
+		num_datasets = 0
+		shard = None
+		stack = []
+		for event, elem in _parser.iterparse(path, ('start', 'end')):
+			if event == 'start':
+				stack.append(elem)
+				if len(stack) == 3 and _localName(elem.tag) == 'DatasetChanges':
+					num_datasets = num_datasets + 1
+					dataset = _Dataset(elem, num_datasets)
+				elif dataset is not None and _localName(elem.tag) in RECORD_CONTAINERS:
+					#every element between DatasetChanges and the records is reopened in each shard
+					dataset.wrappers.update(stack[3:])
+				continue
+
+			depth = len(stack)
+			stack.pop()
+			if dataset is None:
+				if depth == 3 and _localName(stack[1].tag) == 'DataChanges':
+					logging.warn('Dropping ' + _localName(elem.tag) + ' element of DataChanges, only DatasetChanges elements are split')
+					stack[1].remove(elem)
+				elif depth == 2:
+					stack[0].remove(elem)
+				continue
+			parent = stack[-1]
+			if depth == 3:
+				if shard is None and len(dataset.shards) == 0:
+					shard = self._openShard(folder, name, dataset, len(shards) + 1)
+				if shard is not None:
+					self._closeShard(shard, shards)
+					shard = None
+				dataset = None
+				parent.remove(elem)
+			elif parent in dataset.wrappers and _localName(parent.tag) in RECORD_CONTAINERS:
+				if shard is not None and shard.records >= self._maxRecords:
+					self._closeShard(shard, shards)
+					shard = None
+				if shard is None:
+					shard = self._openShard(folder, name, dataset, len(shards) + 1)
+				shard.moveTo(stack[3:], self)
+				shard.write(self._serialize(elem))
+				shard.records = shard.records + 1
+				parent.remove(elem)
+			elif elem in dataset.wrappers:
+				parent.remove(elem)
+			elif depth == 4:
+				#leading elements such as DatasetName are repeated in every shard of the dataset
+				if shard is None:
+					dataset.add(elem, self._serialize(elem))
+				else:
+					shard.moveTo([], self)
+					shard.write(self._serialize(elem))
+				parent.remove(elem)
+
+		manifest = os.path.join(folder, name + '.manifest.json')
+		self._writeManifest(manifest, os.path.basename(path), shards)
+		return [shard['path'] for shard in shards] + [manifest]
+
+	#Reads the namespaces, the root element and the elements around DataChanges, dropping the data changes as they are read.
+	def _readHeader(self, path):
+		self._namespaces = []
+		self._before = []
+		self._after = []
+		stack = []
+		found = False
+		for event, item in _parser.iterparse(path, ('start', 'end', 'start-ns')):
+			if event == 'start-ns':
+				prefix, uri = item
+				if not uri in self._prefixes:
+					self._prefixes[uri] = prefix
+					self._namespaces.append(item)
+					if prefix and not re.match(r'ns\d+$', prefix):
+						ElementTree.register_namespace(prefix, uri)
+				continue
+			if event == 'start':
+				if len(stack) == 0:
+					self._root = item
+				stack.append(item)
+				continue
+			stack.pop()
+			if len(stack) == 1:
+				if _localName(item.tag) == 'DataChanges':
+					self._dataChanges = (item.tag, dict(item.attrib))
+					found = True
+				elif found:
+					self._after.append(self._serialize(item))
+				else:
+					self._before.append(self._serialize(item))
+				stack[0].remove(item)
+			elif len(stack) > 1 and _localName(stack[1].tag) == 'DataChanges':
+				stack[-1].remove(item)
+		if not found:
+			raise ValueError('No DataChanges element in ' + path)
+
+	def _openShard(self, folder, name, dataset, order):
+		dataset_name = re.sub(r'[^\w.-]', '_', dataset.name or 'dataset' + str(dataset.number))
+		file_name = name + '_' + ('%04d' % order) + '_' + dataset_name + ('.xml.gz' if self._compress else '.xml')
+		shard = _Shard(os.path.join(folder, file_name), dataset, self._compress)
+		shard.write(b'<?xml version="1.0" encoding="UTF-8"?>\n')
+		declarations = ''
+		for prefix, uri in self._namespaces:
+			declarations = declarations + ' ' + ('xmlns:' + prefix if prefix else 'xmlns') + '=' + quoteattr(uri)
+		shard.write(self.startTag(self._root.tag, self._root.attrib, declarations) + b'\n')
+		for text in self._before:
+			shard.write(text)
+		shard.write(self.startTag(self._dataChanges[0], self._dataChanges[1]) + b'\n')
+		shard.write(self.startTag(dataset.tag, dataset.attrib) + b'\n')
+		for text in dataset.leading:
+			shard.write(text)
+		dataset.shards.append(shard)
+		return shard
+
+	def _closeShard(self, shard, shards):
+		shard.moveTo([], self)
+		shard.write(self.endTag(shard.dataset.tag) + b'\n')
+		shard.write(self.endTag(self._dataChanges[0]) + b'\n')
+		for text in self._after:
+			shard.write(text)
+		shard.write(self.endTag(self._root.tag) + b'\n')
+		shard.close()
+		shards.append({'order': len(shards) + 1, 'path': shard.path, 'file': os.path.basename(shard.path), 'dataset': shard.dataset.name, 'records': shard.records, 'bytes': os.path.getsize(shard.path)})
+
+	def _writeManifest(self, path, message, shards):
+		datasets = dict()
+		for shard in shards:
+			summary = datasets.setdefault(shard['dataset'], {'shards': 0, 'records': 0})
+			summary['shards'] = summary['shards'] + 1
+			summary['records'] = summary['records'] + shard['records']
+		manifest = {
+			'message': message,
+			'maxRecords': self._maxRecords,
+			'compressed': self._compress,
+			'records': sum([shard['records'] for shard in shards]),
+			'datasets': datasets,
+			'shards': [dict([(key, value) for key, value in shard.items() if key != 'path']) for shard in shards]
+		}
+		with open(path, 'w') as f:
+			json.dump(manifest, f, indent = 1, sort_keys = True)
+
+	#Returns an element with its children as UTF-8, without its tail.
+	def _serialize(self, elem):
+		elem.tail = None
+		return ElementTree.tostring(elem, encoding = 'utf-8') + b'\n'
+
+	def startTag(self, tag, attrib, declarations = ''):
+		text = '<' + self._qualify(tag) + declarations
+		for key, value in attrib.items():
+			text = text + ' ' + self._qualify(key) + '=' + quoteattr(value)
+		return (text + '>').encode('utf-8')
+
+	def endTag(self, tag):
+		return ('</' + self._qualify(tag) + '>').encode('utf-8')
+
+	#Returns a {uri}name tag with the prefix the message declared for uri.
+	def _qualify(self, tag):
+		if not tag.startswith('{'):
+			return tag
+		uri, name = tag[1:].split('}', 1)
+		prefix = self._prefixes.get(uri)
+		if prefix is None:
+			raise ValueError('Undeclared namespace ' + uri)
+		return prefix + ':' + name if prefix else name
+
+###################################################################################################
+###################################################################################################
+#
+# class:	_Dataset
+# purpose:	A DatasetChanges element being split: its tag and attributes, the elements repeated in
+#			each of its shards, and the elements that lead from it to its records.
+#
+###################################################################################################
+
+class _Dataset(object):
+	def __init__(self, elem, number):
+		self.tag = elem.tag
+		self.attrib = dict(elem.attrib)
+		self.number = number
+		self.name = None
+		self.leading = []
+		self.wrappers = set()
+		self.shards = []
+
+	#Adds an element that leads the records, with its serialized text.
+	def add(self, elem, text):
+		if _localName(elem.tag) == 'DatasetName' and elem.text:
+			self.name = elem.text.strip()
+		self.leading.append(text)
+
+###################################################################################################
+###################################################################################################
+#
+# class:	_Shard
+# purpose:	A shard file being written, and the elements between DatasetChanges and the records
+#			that are open in it.
+#
+###################################################################################################
+
+class _Shard(object):
+	def __init__(self, path, dataset, compress):
+		self.path = path
+		self.dataset = dataset
+		self.records = 0
+		self._open = []
+		if compress:
+			self._file = gzip.open(path, 'wb')
+		else:
+			self._file = open(path, 'wb')
+
+	def write(self, data):
+		self._file.write(data)
+
+	#Closes the open elements that are not in path and opens the ones that are not open yet.
+	def moveTo(self, path, splitter):
+		common = 0
+		while common < len(self._open) and common < len(path) and self._open[common] is path[common]:
+			common = common + 1
+		for elem in reversed(self._open[common:]):
+			self.write(splitter.endTag(elem.tag) + b'\n')
+		for elem in path[common:]:
+			self.write(splitter.startTag(elem.tag, elem.attrib) + b'\n')
+		self._open = list(path)
+
+	def close(self):
+		self._file.close()
@@ -1,4 +1,4 @@
-import traceback, os, sys, logging
+import traceback, os, sys, logging, json, binascii, socket
 from datetime import datetime
 from datetime import timedelta
 
@@ -163,3 +163,276 @@ class LockFile(object):
 			logging.error('Error removing lock file')
 			logging.exception(e)
 		return
+
+
+###################################################################################################
+###################################################################################################
+#
+# class:	CheckpointStore
+# purpose:	Helper class that persists the last applied CDC LSN of each dataset in a local file,
+#			so the import reads strictly after it instead of mapping LAST_SYNC_DATE to an LSN.
+#			After a resync, a dataset also has the LSN up to which its CDC records may already be
+#			in SDE, so the import applies inserts of keys that exist as updates until it gets there.
+#
+###################################################################################################
+
+class CheckpointStore(object):
+	def __init__(self, path):
+		self._path = path
+		self._data = {}
+		try:
+			existing = existingFile(path)
+			if existing:
+				with open(existing, 'r') as f:
+					self._data = json.load(f)
+		except Exception as e:
+			logging.error('Error reading checkpoint file ' + path)
+			logging.exception(e)
+		return
+		
+	#Returns the last applied LSN of a CDC table as binary, or None.
+	def get(self, name):
+		checkpoint = self._data.get(name)
+		if checkpoint is None:
+			return None
+		return bytearray(binascii.unhexlify(checkpoint['lsn']))
+		
+	#Returns the LSN up to which inserts of keys that already exist are applied as updates, as binary, or None.
+	def upsertUntil(self, name):
+		checkpoint = self._data.get(name)
+		if checkpoint is None or checkpoint.get('upsertUntil') is None:
+			return None
+		return bytearray(binascii.unhexlify(checkpoint['upsertUntil']))
+		
+	#upsertUntil:	Optional. LSN up to which inserts of keys that already exist are applied as updates. A mark set
+	#				before is kept until lsn passes it.
+	def set(self, name, lsn, upsertUntil = None):
+		dateutil = DateUtil()
+		if upsertUntil is None:
+			upsertUntil = self.upsertUntil(name)
+		checkpoint = {'lsn': binascii.hexlify(lsn).upper(), 'updated': dateutil.now()}
+		if upsertUntil is not None and bytearray(lsn) <= bytearray(upsertUntil):
+			checkpoint['upsertUntil'] = binascii.hexlify(upsertUntil).upper()
+		self._data[name] = checkpoint
+		return
+		
+	#Writes the checkpoints to a temp file and replaces the checkpoint file with it.
+	def save(self):
+		try:
+			temp = self._path + '.tmp'
+			with open(temp, 'w') as f:
+				json.dump(self._data, f, indent = 1, sort_keys = True)
+				f.flush()
+				os.fsync(f.fileno())
+			replaceFile(temp, self._path)
+		except Exception as e:
+			logging.error('Error writing checkpoint file ' + self._path)
+			logging.exception(e)
+		return
+
+###################################################################################################
+###################################################################################################
+#
+# class:	FileDelivery
+# purpose:	Helper class that delivers a file into a folder that another process picks files up
+#			from, so the file only ever appears there complete. The file is copied in binary blocks
+#			to a hidden temp name (a leading dot and a .part extension) in the destination folder,
+#			flushed to disk and renamed into place. When the source may be moved and is on the
+#			same volume as the destination, it is flushed and renamed without copying.
+#
+###################################################################################################
+
+class FileDelivery(object):
+	#blockSize:	Number of bytes copied at a time.
+	def __init__(self, blockSize = 1048576):
+		self._blockSize = blockSize
+		
+	#Delivers source to dest and returns the number of bytes delivered. If move is true, source may be renamed to dest.
+	#Errors are raised to the caller, after the temp file is removed.
+	def deliver(self, source, dest, move = False):
+		folder = os.path.dirname(os.path.abspath(dest))
+		size = os.path.getsize(source)
+		if move and self.sameVolume(os.path.dirname(os.path.abspath(source)), folder):
+			logging.debug('Moving ' + source + ' to ' + dest + ' on the same volume')
+			self._flush(source)
+			self._replace(source, dest)
+			return size
+		
+		temp = os.path.join(folder, '.' + os.path.basename(dest) + '.part')
+		try:
+			with open(source, 'rb') as s:
+				with open(temp, 'wb') as d:
+					block = s.read(self._blockSize)
+					while block:
+						d.write(block)
+						block = s.read(self._blockSize)
+					d.flush()
+					os.fsync(d.fileno())
+			self._replace(temp, dest)
+		except:
+			if os.path.exists(temp):
+				os.remove(temp)
+			raise
+		return size
+		
+	#Returns True if both folders are on the same volume, so a file can be renamed from one to the other.
+	def sameVolume(self, folder1, folder2):
+		if os.name == 'nt':
+			drive1 = os.path.splitdrive(os.path.abspath(folder1))[0]
+			drive2 = os.path.splitdrive(os.path.abspath(folder2))[0]
+			return drive1 != '' and os.path.normcase(drive1) == os.path.normcase(drive2)
+		return os.stat(folder1).st_dev == os.stat(folder2).st_dev
+		
+	#Flushes a file written by another process to disk.
+	def _flush(self, path):
+		with open(path, 'rb+') as f:
+			os.fsync(f.fileno())
+		
+	def _replace(self, source, dest):
+		replaceFile(source, dest)
+
+###################################################################################################
+###################################################################################################
+#
+# class:	DeliveryManifest
+# purpose:	Helper class that persists the change messages delivered to BG-BASE and not yet
+#			acknowledged, with the sequence number of each message and the hash of each of its
+#			records by record key, in a local file. The export uses it to skip messages whose
+#			records all match the latest record delivered for their key, so a record that changed
+#			back to a state delivered earlier is delivered again. An acknowledgement drops the
+#			acknowledged message and every message delivered before it.
+#
+###################################################################################################
+
+class DeliveryManifest(object):
+	def __init__(self, path):
+		self._path = path
+		self._data = {'sequence': 0, 'messages': []}
+		try:
+			existing = existingFile(path)
+			if existing:
+				with open(existing, 'r') as f:
+					self._data = json.load(f)
+		except Exception as e:
+			logging.error('Error reading delivery manifest ' + path)
+			logging.exception(e)
+		self._latest = self._latestHashes()
+		return
+		
+	#Returns the number of records whose key was not delivered, or whose hash differs from the latest one
+	#delivered for their key.
+	#hashes:	(key, hash) of each record of a message, as returned by splitter.recordHashes.
+	def numNew(self, hashes):
+		byKey = self._byKey(hashes)
+		return len([key for key, h in hashes if key is None or self._latest.get(key) != byKey[key]])
+		
+	#Adds a delivered message, with the next sequence number.
+	#name:	Name of the message, the change file name without extension.
+	def add(self, name, hashes):
+		dateutil = DateUtil()
+		sequence = self._data.get('sequence', 0) + 1
+		byKey = self._byKey(hashes)
+		self._data['sequence'] = sequence
+		self._data['messages'].append({'name': name, 'sequence': sequence, 'delivered': dateutil.now(), 'records': len(hashes), 'keys': byKey})
+		self._latest.update(byKey)
+		return
+		
+	#Drops the message whose name starts the acknowledgement name, and the messages delivered before it.
+	#Returns the number of messages dropped.
+	def acknowledge(self, name):
+		messages = self._data['messages']
+		for i in range(len(messages) - 1, -1, -1):
+			if name.startswith(messages[i]['name']):
+				dropped = messages[:i + 1]
+				self._data['messages'] = messages[i + 1:]
+				self._data['acknowledged'] = {'name': messages[i]['name'], 'sequence': messages[i].get('sequence'), 'time': DateUtil().now()}
+				self._latest = self._latestHashes()
+				return len(dropped)
+		return 0
+		
+	#Returns key -> hash of the records of a message. The hashes of a key that has several records in the message
+	#are joined, and records without a key are left out.
+	def _byKey(self, hashes):
+		byKey = dict()
+		for key, h in hashes:
+			if key is not None:
+				byKey.setdefault(key, []).append(h)
+		return dict([(key, ','.join(sorted(items))) for key, items in byKey.items()])
+		
+	#Returns key -> hash of the latest record delivered for each key, from the messages in sequence order.
+	#Messages written before records had keys only hold hashes and are left out, so their records count as new.
+	def _latestHashes(self):
+		latest = dict()
+		for message in sorted(self._data['messages'], key = lambda message: message.get('sequence', 0)):
+			latest.update(message.get('keys', {}))
+		return latest
+		
+	#Writes the manifest to a temp file and replaces the manifest file with it.
+	def save(self):
+		try:
+			temp = self._path + '.tmp'
+			with open(temp, 'w') as f:
+				json.dump(self._data, f, indent = 1, sort_keys = True)
+				f.flush()
+				os.fsync(f.fileno())
+			replaceFile(temp, self._path)
+		except Exception as e:
+			logging.error('Error writing delivery manifest ' + self._path)
+			logging.exception(e)
+		return
+
+###################################################################################################
+###################################################################################################
+#
+# class:	JobClient
+# purpose:	Helper class that asks a running daemon.JobServer for an import run over a local TCP
+#			socket. Does not import arcpy, so a launcher that only triggers returns in milliseconds.
+#
+###################################################################################################
+
+class JobClient(object):
+	#port:		Port of the job server on localhost.
+	#timeout:	Seconds to wait for the server to accept the request.
+	def __init__(self, port, timeout = 2.0):
+		self._port = port
+		self._timeout = timeout
+		
+	#Returns True if the server queued a run, False if no server answered.
+	def trigger(self):
+		connection = None
+		try:
+			connection = socket.create_connection(('127.0.0.1', self._port), self._timeout)
+			connection.sendall(b'run\n')
+			return connection.recv(64).strip() == b'queued'
+		except socket.error as e:
+			logging.debug('Job server is not available on port ' + str(self._port) + ': ' + str(e))
+		finally:
+			if connection is not None:
+				connection.close()
+		return False
+
+#Replaces dest with source, a file written next to it. Where the OS can rename over an existing file, this is one
+#atomic rename. On Windows it cannot, so dest is renamed to dest.bak first and only removed once source is in
+#place. If the process stops in between, existingFile returns the backup. Errors are raised to the caller.
+def replaceFile(source, dest):
+	if os.name != 'nt' or not os.path.exists(dest):
+		os.rename(source, dest)
+		return
+	backup = dest + '.bak'
+	if os.path.exists(backup):
+		os.remove(backup)
+	os.rename(dest, backup)
+	try:
+		os.rename(source, dest)
+	except:
+		os.rename(backup, dest)
+		raise
+	os.remove(backup)
+
+#Returns path if the file exists, its backup if replaceFile was interrupted before the new file was in place, or None.
+def existingFile(path):
+	if os.path.exists(path):
+		return path
+	if os.path.exists(path + '.bak'):
+		return path + '.bak'
+	return None
@@ -0,0 +1 @@
+C:\Python27\ArcGIS10.1\python.exe "C:\Users\Public\Documents\BGBase Connector\import_daemon.py"
\ No newline at end of file
@@ -0,0 +1,16 @@
+from connector import util
+from connector import bgbase
+from connector import daemon
+from warehouse_to_sde import configure_logger
+
+def run(config):
+	warehouse = bgbase.Warehouse.fromConfig(config)
+	server = daemon.JobServer(warehouse, config)
+	server.run()
+	return
+		
+if __name__ == "__main__":
+	config_file = "bgbase.properties"
+	config = util.Config(config_file)
+	configure_logger(config['importLogFile'])
+	run(config)
\ No newline at end of file
@@ -1 +1 @@
-C:\Python27\ArcGIS10.1\python.exe "C:\Users\Public\Documents\BGBase Connector\sde_to_warehouse.py"
\ No newline at end of file
+C:\Python27\ArcGIS10.1\python.exe "C:\Users\Public\Documents\BGBase Connector\sde_to_warehouse.py" %*
\ No newline at end of file
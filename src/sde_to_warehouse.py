@@ -1,5 +1,6 @@
-import logging, logging.handlers
+import sys, logging, logging.handlers
 from connector import util
+from connector import profiling
 from connector import bgbase
 from connector import bgexport
 
@@ -14,11 +15,13 @@ def configure_logger(path):
 	
 def run(config):
 	exporter = bgexport.SdeToWarehouse(config)
-	exporter.run()
+	profiling.runProfiled(config, 'sde_to_warehouse', config['exportLogFile'], exporter.run)
 	return
 		
 if __name__ == "__main__":
 	config_file = "bgbase.properties"
 	config = util.Config(config_file)
 	configure_logger(config['exportLogFile'])
+	if '--profile' in sys.argv[1:]:
+		config['profile'] = 'true'
 	run(config)
\ No newline at end of file
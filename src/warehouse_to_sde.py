@@ -1,7 +1,6 @@
-import logging, logging.handlers
+import sys, time, logging, logging.handlers
 from connector import util
-from connector import bgbase
-from connector import bgimport
+from connector import profiling
 
 def configure_logger(path):
 	msg_format = "%(asctime)s %(levelname)s \t %(message)s";
@@ -12,17 +11,95 @@ def configure_logger(path):
 	logging.getLogger('').addHandler(handler);
 	return;
 	
+#Asks the job server to run the import. Returns False if no job server is configured or running.
+def trigger(config):
+	if not config['jobServerPort']:
+		return False
+	client = util.JobClient(int(config['jobServerPort']))
+	return client.trigger()
+	
 def run(config):
-	server = config['server']
-	database = config['database']
-	adminTable = config['adminTable']
-	warehouse = bgbase.Warehouse(server, database, adminTable)
+	#imported here, so a triggered run does not pay for importing arcpy
+	from connector import bgbase
+	from connector import bgimport
+	warehouse = bgbase.Warehouse.fromConfig(config)
 	importer = bgimport.WarehouseToSde(warehouse, config)
-	importer.run()
+	profiling.runProfiled(config, 'warehouse_to_sde', config['importLogFile'], importer.run)
 	return
+	
+#Reloads one dataset from its Warehouse table and moves its watermark, see resync.DatasetResync.
+def run_resync(config, table):
+	from connector import bgbase
+	from connector import resync
+	warehouse = bgbase.Warehouse.fromConfig(config)
+	try:
+		return resync.DatasetResync(warehouse, config).run(table)
+	finally:
+		warehouse.close()
+	
+#Compares one dataset in the Warehouse and SDE and writes the rows that differ, see resync.DatasetVerify.
+#If repair is True, the rows that differ are also applied to SDE.
+def run_verify(config, table, repair):
+	from connector import bgbase
+	from connector import resync
+	warehouse = bgbase.Warehouse.fromConfig(config)
+	try:
+		return resync.DatasetVerify(warehouse, config).run(table, repair)
+	finally:
+		warehouse.close()
+	
+#Lists, replays or purges the changes in the dead letter queue, see deadletter.DeadLetterQueue. match is a TABLE_NAME
+#or the id of an entry, or None for every entry. Replayed changes are retried by an import run right away.
+def run_deadletter(config, command, match):
+	from connector import deadletter
+	if not config['deadLetterPath']:
+		logging.error('deadLetterPath is not set')
+		return False
+	if not command in ('list', 'replay', 'purge'):
+		logging.error('Unknown deadletter command ' + command + ', use list, replay or purge')
+		return False
+	queue = deadletter.DeadLetterQueue(config['deadLetterPath'])
+	try:
+		if command == 'list':
+			for entry in queue.list(match):
+				next_attempt = 'parked' if entry['parked'] else time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry['nextAttempt']))
+				error = (entry['error'] or '').strip().split('\n')[-1]
+				sys.stdout.write('\t'.join([str(entry['id']), entry['table'], entry['key'], entry['operation'], str(entry['attempts']), entry['lastFailed'], next_attempt, error]) + '\n')
+		elif command == 'replay':
+			logging.info('Replaying ' + str(queue.replay(match)) + ' queued changes')
+		else:
+			logging.info('Purged ' + str(queue.purge(match)) + ' queued changes')
+	finally:
+		queue.close()
+	if command == 'replay':
+		run(config)
+	return True
+	
+#Sets the profile property from --profile (the whole run) or --profile=dataset (each dataset) on the command line.
+#Returns True if profiling was asked for on the command line.
+def read_profile_option(config, args):
+	for arg in args:
+		if arg == '--profile':
+			config['profile'] = 'true'
+			return True
+		if arg.startswith('--profile='):
+			config['profile'] = arg.split('=', 1)[1]
+			return True
+	return False
 		
 if __name__ == "__main__":
 	config_file = "bgbase.properties"
 	config = util.Config(config_file)
 	configure_logger(config['importLogFile'])
-	run(config)
\ No newline at end of file
+	args = sys.argv[1:]
+	if len(args) >= 2 and args[0] == 'resync':
+		run_resync(config, args[1])
+	elif len(args) >= 2 and args[0] == 'verify':
+		run_verify(config, args[1], '--repair' in args[2:])
+	elif len(args) >= 2 and args[0] == 'deadletter':
+		run_deadletter(config, args[1], args[2] if len(args) > 2 else None)
+	#a profiled run has to run in this process, not on the job server
+	elif not read_profile_option(config, args) and trigger(config):
+		logging.info('Import queued on job server')
+	else:
+		run(config)
\ No newline at end of file
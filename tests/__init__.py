@@ -0,0 +1,23 @@
+import os, sys
+
+###################################################################################################
+###################################################################################################
+#
+# package:	tests
+# purpose:	Unit tests of the connector, run under Python 2.7 like the connector:
+#
+#			python -m unittest discover -s tests -t .
+#
+#			The connector modules are imported like the benchmark imports them, with the arcpy
+#			stand-in of bench/arcpy, and the pyodbc stand-in if pyodbc is not installed.
+#
+###################################################################################################
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH = os.path.join(ROOT, 'bench')
+sys.path.insert(0, os.path.join(ROOT, 'src', 'connector'))
+sys.path.insert(0, BENCH)
+try:
+	import pyodbc
+except ImportError:
+	sys.path.insert(0, os.path.join(BENCH, 'stubs'))
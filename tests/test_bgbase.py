@@ -0,0 +1,80 @@
+import unittest, logging
+import tests
+import pyodbc
+import bgbase, util
+
+logging.disable(logging.CRITICAL)
+
+class _Cursor(object):
+	def __init__(self, row, description = ()):
+		self._row = row
+		self.description = description
+
+	def fetchone(self):
+		return self._row
+
+	def close(self):
+		return
+
+#Connection that answers the LSN window query with window and fails the change query if fail is True.
+class _Connection(object):
+	def __init__(self, window, fail):
+		self._window = window
+		self._fail = fail
+
+	def execute(self, sql, *params):
+		if 'fn_cdc_map_time_to_lsn' in sql:
+			return _Cursor(self._window)
+		if self._fail:
+			raise pyodbc.Error('42000', 'Invalid object name')
+		return _Cursor(None, (('__$operation',), ('PLANT_ID',), ('__$CDCKEY',)))
+
+class _Pool(object):
+	def validate(self, connection):
+		return True
+
+	def release(self, connection):
+		return
+
+#Returns a Warehouse on a fake connection, without connecting to SQL Server.
+def _warehouse(connection):
+	warehouse = bgbase.Warehouse.__new__(bgbase.Warehouse)
+	warehouse._server = 'server'
+	warehouse._pool = _Pool()
+	warehouse._connection = connection
+	warehouse._changeCursor = None
+	warehouse._changeCursorFields = None
+	warehouse._tableCursor = None
+	warehouse._dbutil = util.DBUtil()
+	return warehouse
+
+def _dataset():
+	return {'table': 'PLANTS', 'cdc_table': 'cdc.dbo_PLANTS_CT', 'func': 'cdc.fn_cdc_get_all_changes_dbo_PLANTS', 'last_run': '2020-01-01 00:00:00'}
+
+###################################################################################################
+###################################################################################################
+#
+# class:	GetChangesTest
+# purpose:	Warehouse.getChanges tells a failed read apart from an empty LSN window.
+#
+###################################################################################################
+
+class GetChangesTest(unittest.TestCase):
+	def test_failed_query(self):
+		dataset = _dataset()
+		self.assertIsNone(_warehouse(_Connection((bytearray(b'\x01'), bytearray(b'\x02')), True)).getChanges(dataset))
+		self.assertTrue(dataset['read_error'])
+
+	def test_empty_window(self):
+		dataset = _dataset()
+		self.assertIsNone(_warehouse(_Connection((None, None), True)).getChanges(dataset))
+		self.assertFalse(dataset['read_error'])
+
+	def test_changes(self):
+		dataset = _dataset()
+		self.assertIsNotNone(_warehouse(_Connection((bytearray(b'\x01'), bytearray(b'\x02')), False)).getChanges(dataset))
+		self.assertFalse(dataset['read_error'])
+		self.assertEqual(dataset['end_lsn'], bytearray(b'\x02'))
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,60 @@
+import os, shutil, tempfile, unittest, logging
+import tests
+import arcpy
+import bgexport
+import run_bench
+
+logging.disable(logging.CRITICAL)
+
+###################################################################################################
+###################################################################################################
+#
+# class:	ExportTest
+# purpose:	Runs SdeToWarehouse against the arcpy stand-in, which writes a change file with
+#			records, and checks that a failed sync or delivery fails the replica.
+#
+###################################################################################################
+
+class ExportTest(unittest.TestCase):
+	def setUp(self):
+		self.workdir = tempfile.mkdtemp(prefix = 'bgtest')
+		self.exportdir = os.path.join(self.workdir, 'export')
+		os.mkdir(self.exportdir)
+		arcpy.reset()
+		arcpy.configure(exportRecords = 5)
+		arcpy.REPLICAS.append(arcpy.da.Replica('DBO.StagingToProduction', []))
+
+	def tearDown(self):
+		arcpy.configure()
+		arcpy.reset()
+		shutil.rmtree(self.workdir, True)
+
+	#The connector joins the export path and the file name with a backslash, so on this platform the change files are
+	#written to exportdir with the last part of the export path before their name.
+	def _run(self, options = []):
+		config = run_bench._config(self.workdir, ['exportPath=' + os.path.join(self.exportdir, 'out')] + options)
+		return bgexport.SdeToWarehouse(config).run()
+
+	def _delivered(self):
+		return [name for name in os.listdir(self.exportdir) if 'changes_' in name]
+
+	def test_delivered(self):
+		self.assertTrue(self._run())
+		self.assertEqual(len(self._delivered()), 1)
+
+	def test_failed_sync(self):
+		arcpy.FAILING.add('SynchronizeChanges_management')
+		self.assertFalse(self._run())
+		self.assertEqual(self._delivered(), [])
+
+	def test_failed_delivery(self):
+		self.assertFalse(self._run(['exportPath=' + os.path.join(self.workdir, 'missing', 'out')]))
+
+	def test_failed_sync_of_replicas(self):
+		arcpy.REPLICAS.append(arcpy.da.Replica('DBO.StagingToOther', []))
+		arcpy.FAILING.add('SynchronizeChanges_management')
+		self.assertFalse(self._run(['replica=DBO.StagingToProduction,DBO.StagingToOther', 'exportWorkers=1']))
+		self.assertEqual(self._delivered(), [])
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,162 @@
+import os, json, shutil, sqlite3, tempfile, unittest, logging
+import tests
+import arcpy
+import util, bgimport, deadletter, maintenance
+import run_bench, workloads
+from warehouse import SqliteWarehouse
+
+logging.disable(logging.CRITICAL)
+
+#Connection wrapper that fails the statements that start with one of the prefixes, like a failed CDC query.
+class _FailingConnection(object):
+	def __init__(self, connection):
+		self._connection = connection
+		self.failing = []
+
+	def execute(self, sql, *args):
+		for prefix in self.failing:
+			if sql.startswith(prefix):
+				raise sqlite3.OperationalError('Injected failure')
+		return self._connection.execute(sql, *args)
+
+	def __getattr__(self, name):
+		return getattr(self._connection, name)
+
+###################################################################################################
+###################################################################################################
+#
+# class:	ImportTest
+# purpose:	Runs WarehouseToSde against the arcpy stand-in and the SQLite Warehouse of the
+#			benchmark.
+#
+###################################################################################################
+
+class ImportTest(unittest.TestCase):
+	def setUp(self):
+		self.workdir = tempfile.mkdtemp(prefix = 'bgtest')
+		arcpy.reset()
+		self.workload = workloads.build('mixed', 40, 1) + workloads.build('line_seq_storm', 40, 1)
+		self.warehouse = SqliteWarehouse(os.path.join(self.workdir, 'warehouse.db'))
+		run_bench._load(self.workload, self.warehouse)
+		self.connection = _FailingConnection(self.warehouse._connection)
+		self.warehouse._connection = self.connection
+		self.config = run_bench._config(self.workdir, ['checkpointPath=${workdir}/checkpoints', 'clearCdcRecords=false'])
+
+	def tearDown(self):
+		shutil.rmtree(self.workdir, True)
+
+	def _run(self):
+		return bgimport.WarehouseToSde(self.warehouse, self.config).run()
+
+	def _lastSyncDate(self, table):
+		return self.connection.execute('SELECT LAST_SYNC_DATE FROM SDE_SYNC_TABLES WHERE TABLE_NAME = ?', (table,)).fetchone()[0]
+
+	#The other dataset is imported, so the run acknowledges windows and saves checkpoints.
+	def test_failed_change_query_does_not_advance(self):
+		self.connection.failing = ['SELECT * FROM cdc_PLANTS ']
+		self._run()
+		checkpoints = util.CheckpointStore(self.config['checkpointPath'])
+		self.assertIsNone(checkpoints.get('cdc_PLANTS'))
+		self.assertIsNone(self._lastSyncDate('PLANTS'))
+		self.assertIsNotNone(checkpoints.get('cdc_PLANTS_OBS'))
+		self.assertEqual(run_bench._verify(self.workload[1:]), 0)
+		self.assertTrue(run_bench._verify(self.workload[:1]) > 0)
+
+		self.connection.failing = []
+		self.assertTrue(self._run())
+		self.assertIsNotNone(util.CheckpointStore(self.config['checkpointPath']).get('cdc_PLANTS'))
+		self.assertEqual(run_bench._verify(self.workload), 0)
+
+	def test_empty_window_is_not_an_error(self):
+		self.assertTrue(self._run())
+		checkpoint = util.CheckpointStore(self.config['checkpointPath']).get('cdc_PLANTS')
+		self.assertTrue(self._run())
+		self.assertEqual(util.CheckpointStore(self.config['checkpointPath']).get('cdc_PLANTS'), checkpoint)
+		self.assertEqual(run_bench._verify(self.workload), 0)
+
+	#arcpy.da cursors only write versioned data in an edit session, so bulk apply opens one without editOperationSize.
+	def test_bulk_apply_in_edit_session(self):
+		self.config = run_bench._config(self.workdir, ['bulkApply=true', 'editOperationSize=0'])
+		self.assertTrue(self._run())
+		self.assertEqual(arcpy.CALLS['da.Editor.startEditing'], 2)
+		self.assertEqual(arcpy.CALLS['da.Editor.startOperation'], arcpy.CALLS['da.Editor.stopOperation'])
+		self.assertEqual(run_bench._verify(self.workload), 0)
+
+	#A PK_FIELD that is not in the field plan, here since SDE has it as the ObjectID, cannot be bulk applied.
+	def test_bulk_apply_without_key_field(self):
+		table = arcpy.TABLES['plants']
+		table.fields = [(name, 'OID' if name == 'PLANT_ID' else type) for name, type in table.fields]
+		self.config = run_bench._config(self.workdir, ['checkpointPath=${workdir}/checkpoints', 'bulkApply=true'])
+		self.assertTrue(self._run())
+		self.assertIsNotNone(util.CheckpointStore(self.config['checkpointPath']).get('cdc_PLANTS'))
+		self.assertTrue(arcpy.CALLS['UpdateCursor'] > 0)
+
+	#Changes left pending by an earlier run are synced once they are due, even by a run whose import fails.
+	def test_due_sync_runs_before_import(self):
+		self.config = run_bench._config(self.workdir, ['maintenanceStatePath=${workdir}/maintenance.json', 'syncChangeCount=100000', 'syncMaxSeconds=60'])
+		scheduler = maintenance.SyncScheduler(self.config)
+		self.assertTrue(self._run())
+		self.assertEqual(arcpy.CALLS['SynchronizeChanges_management'], 0)
+		self.assertTrue(scheduler.pending('DBO.StagingToProduction') > 0)
+
+		data = maintenance._loadState(self.config['maintenanceStatePath'])
+		data['sync']['DBO.StagingToProduction']['first_pending'] = '2000-01-01 00:00:00'
+		maintenance._saveState(self.config['maintenanceStatePath'], data)
+		self.connection.failing = ['SELECT TABLE_NAME']
+		self.assertFalse(self._run())
+		self.assertEqual(arcpy.CALLS['SynchronizeChanges_management'], 1)
+		self.assertEqual(scheduler.pending('DBO.StagingToProduction'), 0)
+
+	#Replays every CDC record of PLANTS, like the records a resync loaded but CDC captured after it, and returns the
+	#changes that failed to apply.
+	def _replay(self, upsert, options = []):
+		self.config = run_bench._config(self.workdir, ['checkpointPath=${workdir}/checkpoints', 'clearCdcRecords=false', 'deadLetterPath=${workdir}/deadletters.db'] + options)
+		self.assertTrue(self._run())
+		checkpoints = util.CheckpointStore(self.config['checkpointPath'])
+		checkpoints.set('cdc_PLANTS', bytearray(10), self.warehouse.getMaxLsn() if upsert else None)
+		checkpoints.save()
+		self.assertTrue(self._run())
+		self.assertEqual(run_bench._verify(self.workload), 0)
+		queue = deadletter.DeadLetterQueue(self.config['deadLetterPath'])
+		try:
+			return queue.list()
+		finally:
+			queue.close()
+
+	def test_replayed_inserts_are_updates_after_resync(self):
+		self.assertEqual(self._replay(True), [])
+		self.assertIsNone(util.CheckpointStore(self.config['checkpointPath']).upsertUntil('cdc_PLANTS_OBS'))
+
+	def test_replayed_inserts_are_updates_after_resync_in_bulk(self):
+		self.assertEqual(self._replay(True, ['bulkApply=true']), [])
+
+	def test_replayed_inserts_fail_without_resync(self):
+		failed = self._replay(False)
+		self.assertTrue(len(failed) > 0)
+		self.assertEqual(set([entry['operation'] for entry in failed]), set(['insert']))
+
+	#Queued changes that apply on retry are counted as retried and recovered, not as changes read from CDC.
+	def test_retried_changes_are_counted_apart(self):
+		failed = self._replay(False)
+		self.assertTrue(len(failed) > 0)
+		keys = set([entry['key'] for entry in failed])
+		table = arcpy.TABLES['plants']
+		for oid, row in list(table.rows.items()):
+			if str(row['PLANT_ID']) in keys:
+				table.delete(oid)
+		queue = deadletter.DeadLetterQueue(self.config['deadLetterPath'])
+		try:
+			queue.replay()
+		finally:
+			queue.close()
+		self.config['importMetricsFile'] = os.path.join(self.workdir, 'metrics.json')
+		self.assertTrue(self._run())
+		with open(self.config['importMetricsFile'], 'r') as f:
+			record = json.loads(f.readlines()[-1])
+		self.assertEqual(record['counts']['deadLetterRetried'], len(failed))
+		self.assertEqual(record['counts']['deadLetterRecovered'], len(failed))
+		rows = record['datasets']['PLANTS']['rows']
+		self.assertEqual(sum([rows[operation]['applied'] + rows[operation]['failed'] for operation in rows]), 0)
+
+if __name__ == '__main__':
+	unittest.main()
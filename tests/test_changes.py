@@ -0,0 +1,155 @@
+import unittest, logging, itertools, binascii
+import tests
+import changes
+
+logging.disable(logging.CRITICAL)
+
+OPERATIONS = ('insert', 'update', 'delete')
+
+#Warehouse stand-in whose change rows hold their operation in the first column.
+class _Warehouse(object):
+	def getOperationType(self, row):
+		return row[0]
+
+#Cursor over a list of rows that counts the fetchmany calls.
+class _Cursor(object):
+	def __init__(self, rows):
+		self._rows = list(rows)
+		self.arraysize = 1
+		self.fetches = 0
+
+	def fetchmany(self, size):
+		self.fetches = self.fetches + 1
+		rows = self._rows[:size]
+		self._rows = self._rows[size:]
+		return rows
+
+FIELDS = {'__$operation': 0, 'PLANT_ID': 1, 'NAME': 2, '__$CDCKEY': 3}
+
+def _dataset():
+	return {'table': 'PLANTS', 'pkfield': 'PLANT_ID'}
+
+#Returns a change row with a 20 byte CDC key made of n.
+def _row(operation, key, name, n):
+	return (operation, key, name, bytearray(binascii.unhexlify('%040x' % n)))
+
+#Returns whether a key exists after an operation, None if the operation does not change that.
+def _exists(operation, before):
+	if operation == '':
+		return before
+	return operation != 'delete'
+
+###################################################################################################
+###################################################################################################
+#
+# class:	FoldTest
+# purpose:	ChangeCoalescer._FOLD gives the net operation of two CDC records of one key.
+#
+###################################################################################################
+
+class FoldTest(unittest.TestCase):
+	def test_table_is_complete(self):
+		pairs = set(itertools.product(OPERATIONS + ('',), OPERATIONS))
+		self.assertEqual(set(changes.ChangeCoalescer._FOLD.keys()), pairs)
+
+	#Applying the net operation leaves the key in the state the second record leaves it in, from every state in
+	#which the first record could have been captured.
+	def test_fold_keeps_the_final_state(self):
+		for (first, second), net in changes.ChangeCoalescer._FOLD.items():
+			for before in (True, False):
+				if first == 'insert' and before or first in ('update', 'delete') and not before:
+					continue
+				self.assertEqual(_exists(net, before), _exists(second, _exists(first, before)), (first, second, before))
+
+	def test_cancelled_out(self):
+		coalescer = changes.ChangeCoalescer(_Warehouse(), _dataset(), FIELDS)
+		result = coalescer.coalesce([_row('insert', 1, 'a', 1), _row('update', 1, 'b', 2), _row('delete', 1, 'b', 3)])
+		self.assertEqual(len(result), 1)
+		self.assertEqual(result[0].operation, '')
+		self.assertEqual(len(result[0].cdcKeys), 3)
+
+	def test_last_image(self):
+		coalescer = changes.ChangeCoalescer(_Warehouse(), _dataset(), FIELDS)
+		result = coalescer.coalesce([_row('delete', 1, 'a', 1), _row('insert', 1, 'b', 2), _row('insert', 2, 'c', 3), _row('update', 1, 'd', 4)])
+		self.assertEqual([(change.key, change.operation, change.row[2]) for change in result], [(1, 'update', 'd'), (2, 'insert', 'c')])
+
+###################################################################################################
+###################################################################################################
+#
+# class:	ChangeReaderTest
+# purpose:	ChangeReader folds each fetchmany batch on its own, so a key can have a change in
+#			more than one batch.
+#
+###################################################################################################
+
+class ChangeReaderTest(unittest.TestCase):
+	def _batches(self, rows, mode):
+		reader = changes.ChangeReader(_Warehouse(), _dataset(), FIELDS, ['PLANT_ID', 'NAME'], mode, 3)
+		cursor = _Cursor(rows)
+		batches = list(reader.batches(cursor))
+		self.assertEqual(cursor.arraysize, 3)
+		self.assertEqual(reader.fields, {'PLANT_ID': 0, 'NAME': 1})
+		return batches
+
+	def test_key_in_two_batches(self):
+		rows = [_row('insert', 1, 'a', 1), _row('insert', 2, 'b', 2), _row('update', 1, 'c', 3), _row('delete', 1, 'c', 4), _row('insert', 3, 'd', 5)]
+		batches = self._batches(rows, 'coalesce')
+		self.assertEqual([[(change.operation, change.row) for change in batch] for batch in batches],
+			[[('insert', (1, 'c')), ('insert', (2, 'b'))], [('delete', (1, 'c')), ('insert', (3, 'd'))]])
+		self.assertEqual(batches[0][0].cdcKeys, [rows[0][3], rows[2][3]])
+		self.assertEqual(batches[1][0].cdcKeys, [rows[3][3]])
+
+	#Applied in order, the batches leave the keys as the records do.
+	def test_batches_in_order(self):
+		rows = [_row('update', 1, 'a', 1), _row('delete', 1, 'a', 2), _row('update', 2, 'b', 3), _row('insert', 1, 'c', 4), _row('update', 1, 'd', 5), _row('delete', 2, 'b', 6), _row('insert', 2, 'e', 7)]
+		table = {1: 'x', 2: 'y'}
+		for batch in self._batches(rows, 'coalesce'):
+			for change in batch:
+				if change.operation == 'delete':
+					del table[change.key]
+				elif change.operation:
+					table[change.key] = change.row[1]
+		self.assertEqual(table, {1: 'd', 2: 'e'})
+
+	def test_each(self):
+		rows = [_row('insert', 1, 'a', 1), _row('update', 1, 'b', 2), _row('delete', 1, 'b', 3), _row('insert', 1, 'c', 4)]
+		batches = self._batches(rows, 'each')
+		self.assertEqual([len(batch) for batch in batches], [3, 1])
+		self.assertEqual([change.operation for batch in batches for change in batch], ['insert', 'update', 'delete', 'insert'])
+
+###################################################################################################
+###################################################################################################
+#
+# class:	AckListTest
+# purpose:	AckList packs the CDC keys of the records that were not applied into 20 bytes each.
+#
+###################################################################################################
+
+class AckListTest(unittest.TestCase):
+	def test_failed_keys(self):
+		keys = [_row('insert', n, '', n)[3] for n in range(1, 6)]
+		acks = changes.AckList()
+		acks.add(keys[:2], True)
+		acks.add(keys[2:4], False)
+		acks.add(keys[4:], False)
+		self.assertEqual(acks.read, 5)
+		self.assertEqual(acks.acknowledged, 2)
+		self.assertEqual(acks.numFailed(), 3)
+		self.assertEqual(acks.failed(), keys[2:])
+		self.assertEqual([len(key) for key in acks.failed()], [changes.AckList.KEY_SIZE] * 3)
+
+	#Keys of the net change mode are read from hex, and keys with zero bytes keep them.
+	def test_net_keys(self):
+		rows = [(None, 7, '00000000000000000001' + '0' * 20 + ',' + 'FF' * 20)]
+		result = changes.ChangeCoalescer(_Warehouse(), _dataset(), {'__$PK': 1, '__$CDCKEY': 2}).net(rows)
+		acks = changes.AckList()
+		acks.add(result[0].cdcKeys, False)
+		self.assertEqual(acks.failed(), [bytearray(b'\x00' * 9 + b'\x01' + b'\x00' * 10), bytearray(b'\xff' * 20)])
+
+	def test_empty(self):
+		acks = changes.AckList()
+		acks.add([], False)
+		self.assertEqual((acks.read, acks.numFailed(), acks.failed()), (0, 0, []))
+
+if __name__ == '__main__':
+	unittest.main()
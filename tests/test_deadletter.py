@@ -0,0 +1,103 @@
+import os, shutil, tempfile, time, unittest, logging
+import tests
+import changes, deadletter
+
+logging.disable(logging.CRITICAL)
+
+FIELDS = {'PLANT_ID': 0, 'NAME': 1}
+
+def _dataset(table = 'PLANTS'):
+	return {'table': table, 'cdc_table': 'cdc_' + table}
+
+def _change(operation, key, name = 'a'):
+	return changes.Change(operation, key, (key, name), [])
+
+###################################################################################################
+###################################################################################################
+#
+# class:	DeadLetterQueueTest
+# purpose:	DeadLetterQueue doubles the wait between retries, parks entries after maxAttempts
+#			and folds the changes of a key into one entry.
+#
+###################################################################################################
+
+class DeadLetterQueueTest(unittest.TestCase):
+	def setUp(self):
+		self.workdir = tempfile.mkdtemp(prefix = 'bgtest')
+		self.queue = deadletter.DeadLetterQueue(os.path.join(self.workdir, 'deadletters.db'), 10, 3)
+
+	def tearDown(self):
+		self.queue.close()
+		shutil.rmtree(self.workdir, True)
+
+	def _entry(self):
+		entries = self.queue.list()
+		self.assertEqual(len(entries), 1)
+		return entries[0]
+
+	def _assertWait(self, entry, seconds):
+		wait = entry['nextAttempt'] - time.time()
+		self.assertTrue(seconds - 5 < wait <= seconds, wait)
+
+	def test_backoff_and_parking(self):
+		self.assertTrue(self.queue.add(_dataset(), _change('insert', 1), FIELDS, 'failed'))
+		entry = self._entry()
+		self.assertEqual(entry['attempts'], 1)
+		self._assertWait(entry, 10)
+		self.assertEqual(self.queue.due(_dataset()), [])
+
+		self.queue.failed(entry['id'], 'failed again')
+		entry = self._entry()
+		self.assertEqual((entry['attempts'], entry['error']), (2, 'failed again'))
+		self._assertWait(entry, 20)
+
+		self.queue.failed(entry['id'], 'failed again')
+		entry = self._entry()
+		self.assertEqual(entry['attempts'], 3)
+		self.assertTrue(entry['parked'])
+		self.assertEqual(self.queue.due(_dataset()), [])
+
+		self.assertEqual(self.queue.replay('plants'), 1)
+		due = self.queue.due(_dataset())
+		self.assertEqual(len(due), 1)
+		id, change, fields = due[0]
+		self.assertEqual((id, change.operation, change.key, tuple(change.row), change.cdcKeys, fields), (entry['id'], 'insert', 1, (1, 'a'), [], FIELDS))
+
+	def test_backoff_is_capped(self):
+		queue = deadletter.DeadLetterQueue(os.path.join(self.workdir, 'capped.db'), deadletter.MAX_BACKOFF, 5)
+		try:
+			queue.add(_dataset(), _change('insert', 1), FIELDS, 'failed')
+			queue.failed(queue.list()[0]['id'], 'failed again')
+			wait = queue.list()[0]['nextAttempt'] - time.time()
+			self.assertTrue(deadletter.MAX_BACKOFF - 5 < wait <= deadletter.MAX_BACKOFF, wait)
+		finally:
+			queue.close()
+
+	def test_fold(self):
+		self.queue.add(_dataset(), _change('update', 1, 'a'), FIELDS, 'failed')
+		self.queue.add(_dataset(), _change('delete', 1, 'a'), FIELDS, 'failed')
+		entry = self._entry()
+		self.assertEqual((entry['operation'], entry['attempts']), ('delete', 2))
+		self.queue.add(_dataset(), _change('insert', 1, 'b'), FIELDS, 'failed')
+		self.assertEqual(self._entry()['operation'], 'update')
+
+	def test_insert_and_delete_cancel_out(self):
+		self.queue.add(_dataset(), _change('insert', 1), FIELDS, 'failed')
+		self.queue.add(_dataset(), _change('delete', 1), FIELDS, 'failed')
+		self.assertEqual(self.queue.list(), [])
+
+	def test_newer_change_applied(self):
+		self.queue.add(_dataset(), _change('update', 1), FIELDS, 'failed')
+		self.queue.add(_dataset(), _change('update', 2), FIELDS, 'failed')
+		self.queue.add(_dataset('PLANTS_OBS'), _change('update', 1), FIELDS, 'failed')
+		self.queue.applied(_dataset(), _change('update', 1))
+		self.assertEqual(sorted([(entry['table'], entry['key']) for entry in self.queue.list()]), [('PLANTS', '2'), ('PLANTS_OBS', '1')])
+
+	def test_purge(self):
+		self.queue.add(_dataset(), _change('update', 1), FIELDS, 'failed')
+		self.queue.add(_dataset('PLANTS_OBS'), _change('update', 1), FIELDS, 'failed')
+		self.assertEqual(self.queue.purge('PLANTS_OBS'), 1)
+		self.assertEqual([entry['table'] for entry in self.queue.list()], ['PLANTS'])
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,127 @@
+import os, shutil, tempfile, unittest, logging
+import tests
+import util, splitter
+
+logging.disable(logging.CRITICAL)
+
+_HEADER = '<esri:DataChangeMessage xmlns:esri="http://www.esri.com/schemas/ArcGIS/10.1" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"><ReplicaName>R</ReplicaName><DataChanges xsi:type="esri:DataChanges">'
+
+#Returns a data change message with the records of one dataset. records is a list of (operation, values), or of
+#('Deletes', id). fields is a list of (name, type), or None to leave out the Fields element.
+def _message(records, fields = None):
+	xml = _HEADER + '<DatasetChanges xsi:type="esri:DeltaChanges"><DatasetName>PLANTS</DatasetName>'
+	for operation in ('Inserts', 'Updates', 'Deletes'):
+		items = [values for op, values in records if op == operation]
+		if len(items) == 0:
+			continue
+		xml += '<' + operation + '>'
+		if operation == 'Deletes':
+			xml += '<IDs>' + ''.join(['<ID>' + str(id) + '</ID>' for id in items]) + '</IDs>'
+		else:
+			if fields is not None:
+				xml += '<Fields><FieldArray>' + ''.join(['<Field><Name>' + name + '</Name><Type>' + type + '</Type></Field>' for name, type in fields]) + '</FieldArray></Fields>'
+			xml += '<Records>'
+			for values in items:
+				xml += '<Record><Values>' + ''.join(['<Value>' + str(value) + '</Value>' for value in values]) + '</Values></Record>'
+			xml += '</Records>'
+		xml += '</' + operation + '>'
+	return xml + '</DatasetChanges></DataChanges></esri:DataChangeMessage>'
+
+###################################################################################################
+###################################################################################################
+#
+# class:	RecordHashesTest
+# purpose:	splitter.recordHashes keys each record by dataset and ObjectID or GlobalID.
+#
+###################################################################################################
+
+class RecordHashesTest(unittest.TestCase):
+	def setUp(self):
+		self.workdir = tempfile.mkdtemp(prefix = 'bgtest')
+
+	def tearDown(self):
+		shutil.rmtree(self.workdir, True)
+
+	def _hashes(self, xml):
+		path = os.path.join(self.workdir, 'message.xml')
+		with open(path, 'w') as f:
+			f.write(xml)
+		return splitter.recordHashes(path)
+
+	def test_first_value_is_key(self):
+		hashes = self._hashes(_message([('Inserts', (1, 'a')), ('Updates', (2, 'b')), ('Deletes', 3)]))
+		self.assertEqual([key for key, h in hashes], ['PLANTS/1', 'PLANTS/2', 'PLANTS/3'])
+
+	def test_key_field(self):
+		fields = [('NAME', 'esriFieldTypeString'), ('OBJECTID', 'esriFieldTypeOID'), ('GLOBALID', 'esriFieldTypeGlobalID')]
+		hashes = self._hashes(_message([('Inserts', ('a', 1, '{G1}'))], fields))
+		self.assertEqual(hashes[0][0], 'PLANTS/{G1}')
+
+	def test_hash_depends_on_operation_and_values(self):
+		insert = self._hashes(_message([('Inserts', (1, 'a'))]))[0][1]
+		update = self._hashes(_message([('Updates', (1, 'a'))]))[0][1]
+		changed = self._hashes(_message([('Inserts', (1, 'b'))]))[0][1]
+		self.assertEqual(len(set([insert, update, changed])), 3)
+		self.assertEqual(self._hashes(_message([('Inserts', (1, 'a'))]))[0][1], insert)
+
+###################################################################################################
+###################################################################################################
+#
+# class:	DeliveryManifestTest
+# purpose:	DeliveryManifest compares each record with the latest record delivered for its key.
+#
+###################################################################################################
+
+class DeliveryManifestTest(unittest.TestCase):
+	def setUp(self):
+		self.workdir = tempfile.mkdtemp(prefix = 'bgtest')
+		self.path = os.path.join(self.workdir, 'manifest.json')
+
+	def tearDown(self):
+		shutil.rmtree(self.workdir, True)
+
+	def test_duplicate(self):
+		manifest = util.DeliveryManifest(self.path)
+		manifest.add('m1', [('PLANTS/1', 'B'), ('PLANTS/2', 'C')])
+		self.assertEqual(manifest.numNew([('PLANTS/1', 'B')]), 0)
+		self.assertEqual(manifest.numNew([('PLANTS/1', 'B'), ('PLANTS/3', 'D')]), 1)
+
+	#A record edited B -> A -> B while the messages are not acknowledged must be delivered a third time.
+	def test_change_back_is_new(self):
+		manifest = util.DeliveryManifest(self.path)
+		manifest.add('m1', [('PLANTS/1', 'B')])
+		manifest.add('m2', [('PLANTS/1', 'A')])
+		self.assertEqual(manifest.numNew([('PLANTS/1', 'B')]), 1)
+		self.assertEqual(manifest.numNew([('PLANTS/1', 'A')]), 0)
+
+	def test_records_without_key_are_new(self):
+		manifest = util.DeliveryManifest(self.path)
+		manifest.add('m1', [(None, 'B')])
+		self.assertEqual(manifest.numNew([(None, 'B')]), 1)
+
+	def test_save_and_acknowledge(self):
+		manifest = util.DeliveryManifest(self.path)
+		manifest.add('m1', [('PLANTS/1', 'B')])
+		manifest.add('m2', [('PLANTS/1', 'A'), ('PLANTS/2', 'C')])
+		manifest.add('m3', [('PLANTS/1', 'B')])
+		manifest.save()
+		manifest = util.DeliveryManifest(self.path)
+		self.assertEqual(manifest.numNew([('PLANTS/1', 'B'), ('PLANTS/2', 'C')]), 0)
+		self.assertEqual(manifest.acknowledge('m2.ack'), 2)
+		self.assertEqual(manifest.numNew([('PLANTS/1', 'B')]), 0)
+		self.assertEqual(manifest.numNew([('PLANTS/2', 'C')]), 1)
+		manifest.add('m4', [('PLANTS/2', 'C')])
+		self.assertEqual(manifest._data['messages'][-1]['sequence'], 4)
+
+	#A manifest written before records had keys delivers its records again.
+	def test_old_manifest(self):
+		with open(self.path, 'w') as f:
+			f.write('{"messages": [{"name": "m1", "delivered": "2020-01-01 00:00:00", "records": 1, "hashes": ["B"]}]}')
+		manifest = util.DeliveryManifest(self.path)
+		self.assertEqual(manifest.numNew([('PLANTS/1', 'B')]), 1)
+		manifest.add('m2', [('PLANTS/1', 'B')])
+		self.assertEqual(manifest.numNew([('PLANTS/1', 'B')]), 0)
+		self.assertEqual(manifest.acknowledge('m1.ack'), 1)
+
+if __name__ == '__main__':
+	unittest.main()
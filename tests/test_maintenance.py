@@ -0,0 +1,54 @@
+import os, shutil, tempfile, threading, time, unittest, logging
+import tests
+import util, maintenance
+
+logging.disable(logging.CRITICAL)
+
+###################################################################################################
+###################################################################################################
+#
+# class:	StateLockTest
+# purpose:	The schedulers of the import and the export change the shared maintenance state
+#			file under its lock, so neither loses the other's changes.
+#
+###################################################################################################
+
+class StateLockTest(unittest.TestCase):
+	def setUp(self):
+		self.workdir = tempfile.mkdtemp(prefix = 'bgtest')
+		self.path = os.path.join(self.workdir, 'maintenance.json')
+		self.config = util.Config(os.path.join(self.workdir, 'none.properties'))
+		self.config['maintenanceStatePath'] = self.path
+
+	def tearDown(self):
+		shutil.rmtree(self.workdir, True)
+
+	def _record(self, scheduler, name):
+		for i in range(25):
+			scheduler.record(name, 1)
+
+	#Each thread has its own schedulers, like the import and the export processes.
+	def test_concurrent_records(self):
+		threads = []
+		for i in range(4):
+			threads.append(threading.Thread(target = self._record, args = (maintenance.SyncScheduler(self.config), 'DBO.StagingToProduction')))
+			threads.append(threading.Thread(target = self._record, args = (maintenance.CompressScheduler(self.config), 'Production.sde')))
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		self.assertEqual(maintenance.SyncScheduler(self.config).pending('DBO.StagingToProduction'), 100)
+		self.assertEqual(maintenance._loadState(self.path)['compress']['Production.sde']['rows'], 100)
+		self.assertFalse(os.path.exists(self.path + '.lock'))
+
+	def test_left_lock_is_taken_over(self):
+		with open(self.path + '.lock', 'w') as f:
+			f.write('')
+		start = time.time()
+		with maintenance._StateLock(self.path, 0.2):
+			self.assertTrue(os.path.exists(self.path + '.lock'))
+		self.assertTrue(time.time() - start >= 0.2)
+		self.assertFalse(os.path.exists(self.path + '.lock'))
+
+if __name__ == '__main__':
+	unittest.main()
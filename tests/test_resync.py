@@ -0,0 +1,203 @@
+import os, shutil, sqlite3, tempfile, unittest, logging
+from datetime import datetime
+from decimal import Decimal
+import tests
+import arcpy
+import resync
+import run_bench, workloads
+from warehouse import SqliteWarehouse
+
+logging.disable(logging.CRITICAL)
+
+#Warehouse stand-in that only returns the key range of a dataset.
+class _Warehouse(object):
+	def __init__(self, keys):
+		self._keys = keys
+
+	def getKeyRange(self, dataset):
+		return self._keys
+
+#SQLite Warehouse with a source table for each dataset, that getTable and getRows read. The key range is not read,
+#so DatasetVerify buckets the keys by hash and reads whole tables, which the arcpy stand-in can filter.
+class _SourceWarehouse(SqliteWarehouse):
+	def addSource(self, table, columns, rows):
+		self._connection.execute('CREATE TABLE ' + table + ' (' + ', '.join(['"' + column + '"' for column in columns]) + ')')
+		self._connection.executemany('INSERT INTO ' + table + ' VALUES (' + ', '.join(['?'] * len(columns)) + ')', [[row[column] for column in columns] for row in rows])
+		self._connection.commit()
+
+	def getTable(self, dataset):
+		dataset['resync_lsn'] = self.getMaxLsn()
+		dataset['resync_time'] = '2020-01-01 00:00:00'
+		return self.getRows(dataset)
+
+	def getRows(self, dataset, where = None):
+		return self._connection.execute('SELECT * FROM ' + dataset['table'] + (' WHERE ' + where if where else ''))
+
+	def getKeyRange(self, dataset):
+		return None
+
+	def endTableRead(self):
+		return
+
+	def setWatermark(self, dataset, clearCdcRecords):
+		self.watermark = dataset['resync_time']
+		return True
+
+def _dataset():
+	return {'table': 'PLANTS', 'pkfield': 'PLANT_ID'}
+
+###################################################################################################
+###################################################################################################
+#
+# class:	BucketTest
+# purpose:	The where clauses of DatasetVerify select exactly the keys of their buckets, at the
+#			edges of the buckets and of the key range.
+#
+###################################################################################################
+
+class BucketTest(unittest.TestCase):
+	def setUp(self):
+		self.workdir = tempfile.mkdtemp(prefix = 'bgtest')
+
+	def tearDown(self):
+		shutil.rmtree(self.workdir, True)
+
+	def _verify(self, keys, buckets):
+		verify = resync.DatasetVerify(_Warehouse(keys), run_bench._config(self.workdir, ['verifyBuckets=' + str(buckets)]))
+		verify._range = verify._keyRange(_dataset())
+		return verify
+
+	#Checks the where clauses of each set of buckets against the buckets of every key from below to above the range.
+	def _assertClauses(self, lo, hi, buckets, sets):
+		verify = self._verify((lo, hi), buckets)
+		keys = range(lo - 3, hi + 4)
+		bucketOf = dict(zip(keys, verify._bucketsOf(keys).tolist()))
+		self.assertEqual(bucketOf[lo - 3], 0)
+		self.assertEqual(bucketOf[hi + 3], buckets - 1)
+		connection = sqlite3.connect(':memory:')
+		connection.execute('CREATE TABLE PLANTS (PLANT_ID INTEGER)')
+		connection.executemany('INSERT INTO PLANTS VALUES (?)', [(key,) for key in keys])
+		for wanted in sets:
+			selected = []
+			for where in verify._whereClauses(_dataset(), wanted):
+				selected.extend([row[0] for row in connection.execute('SELECT PLANT_ID FROM PLANTS WHERE ' + where)])
+			self.assertEqual(sorted(selected), [key for key in keys if bucketOf[key] in wanted], (lo, hi, buckets, wanted))
+
+	def test_span_not_a_multiple(self):
+		self._assertClauses(10, 22, 8, [[0], [1], [3], [7], [0, 1, 2], [2, 5], [6, 7], range(8)])
+
+	def test_span_smaller_than_buckets(self):
+		self._assertClauses(-1, 1, 8, [[0], [2], [3], [5], [7], [0, 7]])
+
+	def test_one_key(self):
+		self._assertClauses(5, 5, 4, [[0], [1], [3], [0, 3]])
+
+	def test_large_keys(self):
+		self._assertClauses(10 ** 12, 10 ** 12 + 1000, 64, [[0], [31, 32], [63]])
+
+	def test_many_ranges(self):
+		verify = self._verify((0, 999), 200)
+		self.assertEqual(len(verify._whereClauses(_dataset(), range(0, 200, 2))), 2)
+
+	def test_keys_that_are_not_numbers(self):
+		for keys in (('A', 'Z'), (True, True), (None, None), None):
+			verify = self._verify(keys, 16)
+			self.assertIsNone(verify._range)
+			self.assertEqual(verify._whereClauses(_dataset(), [1, 2]), [None])
+			buckets = verify._bucketsOf(['A', 'B', u'A', 1]).tolist()
+			self.assertTrue(min(buckets) >= 0 and max(buckets) < 16)
+			self.assertEqual(buckets[0], buckets[2])
+
+###################################################################################################
+###################################################################################################
+#
+# class:	RowHashTest
+# purpose:	A value hashes the same for its Warehouse and SDE types.
+#
+###################################################################################################
+
+class RowHashTest(unittest.TestCase):
+	def test_same_value(self):
+		for values in ([1, 1.0, long(1), Decimal('1.0000000'), 1.00000001], [u'abc', 'abc', 'abc  '],
+				[datetime(2020, 1, 2, 3, 4, 5), datetime(2020, 1, 2, 3, 4, 5, 999)], [True, 1]):
+			self.assertEqual(len(set([resync._rowHash([value]) for value in values])), 1, values)
+
+	def test_different_value(self):
+		for values in ([None, u'', 0], [0.5, 0.50001], [u'a', u' a']):
+			self.assertEqual(len(set([resync._rowHash([value]) for value in values])), len(values), values)
+
+	def test_columns_and_shape(self):
+		self.assertNotEqual(resync._rowHash([u'a', u'b']), resync._rowHash([u'a\x1fb']))
+		self.assertNotEqual(resync._rowHash([1]), resync._rowHash([1], (1.0, 2.0)))
+		self.assertEqual(resync._rowHash([1]), resync._rowHash([1], (None, None)))
+		self.assertEqual(resync._rowHash([1], (1, 2)), resync._rowHash([1], (1.0, 2.0)))
+
+###################################################################################################
+###################################################################################################
+#
+# class:	ResyncTest
+# purpose:	Reloads and repairs a dataset from the SQLite Warehouse into the arcpy stand-in, whose
+#			da cursors only write in an edit session like on versioned data.
+#
+###################################################################################################
+
+class ResyncTest(unittest.TestCase):
+	def setUp(self):
+		self.workdir = tempfile.mkdtemp(prefix = 'bgtest')
+		arcpy.reset()
+		self.config = run_bench._config(self.workdir, ['resyncFetchSize=3', 'importLogFile=${workdir}/bgimport.log'])
+		self.warehouse = _SourceWarehouse(os.path.join(self.workdir, 'warehouse.db'))
+		self.columns = ['PLANT_ID', 'NAME', 'STATUS', 'X', 'Y']
+		self.warehouse.addDataset('PLANTS', 'PLANT_ID', self.columns, 'X', 'Y')
+		self.rows = [self._plant(id, 'A') for id in range(3, 11)]
+		self.warehouse.addSource('PLANTS', self.columns, self.rows)
+
+	def tearDown(self):
+		shutil.rmtree(self.workdir, True)
+
+	def _plant(self, id, status):
+		return {'PLANT_ID': id, 'NAME': 'Plant ' + str(id), 'STATUS': status, 'X': -71.0 - id / 100.0, 'Y': 42.0 + id / 100.0}
+
+	#Creates the feature class with plants 1 to 6, of which 3 and 4 differ from the Warehouse.
+	def _createTable(self):
+		rows = []
+		for id in range(1, 7):
+			row = self._plant(id, 'D' if id in (3, 4) else 'A')
+			row['Shape'] = (row['X'], row['Y'])
+			rows.append(row)
+		arcpy.createTable('PLANTS', workloads.PLANT_FIELDS, rows)
+
+	def _sdeRows(self):
+		rows = dict()
+		for row in arcpy.TABLES['plants'].rows.values():
+			rows[row['PLANT_ID']] = dict([(column, row.get(column)) for column in self.columns])
+		return rows
+
+	def _assertLoaded(self):
+		expected = dict([(row['PLANT_ID'], row) for row in self.rows])
+		self.assertEqual(self._sdeRows(), expected)
+
+	def test_resync_in_edit_session(self):
+		self._createTable()
+		self.assertTrue(resync.DatasetResync(self.warehouse, self.config).run('PLANTS'))
+		self._assertLoaded()
+		self.assertEqual(arcpy.CALLS['da.Editor.startEditing'], 1)
+		self.assertEqual(arcpy.CALLS['da.Editor.stopEditing'], 1)
+		self.assertEqual(arcpy.CALLS['da.Editor.startOperation'], arcpy.CALLS['da.Editor.stopOperation'])
+		self.assertEqual(arcpy._editing[0], 0)
+		self.assertEqual(self.warehouse.watermark, '2020-01-01 00:00:00')
+
+	def test_verify_repair_in_edit_session(self):
+		self._createTable()
+		repairs = resync.DatasetVerify(self.warehouse, self.config).run('PLANTS', True)
+		self.assertEqual(repairs['insert'], range(7, 11))
+		self.assertEqual(repairs['update'], [3, 4])
+		self.assertEqual(repairs['delete'], [1, 2])
+		self._assertLoaded()
+		self.assertEqual(arcpy.CALLS['da.Editor.startEditing'], 1)
+		self.assertEqual(arcpy._editing[0], 0)
+		repairs = resync.DatasetVerify(self.warehouse, self.config).run('PLANTS')
+		self.assertEqual([len(repairs[action]) for action in ('insert', 'update', 'delete', 'pending')], [0, 0, 0, 0])
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,119 @@
+import os, shutil, tempfile, unittest, logging
+import tests
+import util
+
+logging.disable(logging.CRITICAL)
+
+def _lsn(n):
+	return bytearray(b'\x00' * 9 + chr(n).encode('latin-1'))
+
+#os stand-in that renames like Windows, which fails if the new name exists, and fails to rename the files in failing.
+class _WindowsOs(object):
+	name = 'nt'
+
+	def __init__(self):
+		self.failing = set()
+
+	def rename(self, source, dest):
+		if os.path.exists(dest) or source in self.failing:
+			raise OSError('Cannot create a file when that file already exists')
+		os.rename(source, dest)
+
+	def __getattr__(self, name):
+		return getattr(os, name)
+
+def _read(path):
+	with open(path, 'r') as f:
+		return f.read()
+
+def _write(path, text):
+	with open(path, 'w') as f:
+		f.write(text)
+
+###################################################################################################
+###################################################################################################
+#
+# class:	CheckpointStoreTest
+# purpose:	CheckpointStore keeps the upsert mark of a resync until a checkpoint passes it.
+#
+###################################################################################################
+
+class CheckpointStoreTest(unittest.TestCase):
+	def setUp(self):
+		self.workdir = tempfile.mkdtemp(prefix = 'bgtest')
+		self.path = os.path.join(self.workdir, 'checkpoints')
+
+	def tearDown(self):
+		shutil.rmtree(self.workdir, True)
+
+	def test_upsert_until(self):
+		checkpoints = util.CheckpointStore(self.path)
+		checkpoints.set('cdc_PLANTS', _lsn(2), _lsn(5))
+		checkpoints.save()
+		checkpoints = util.CheckpointStore(self.path)
+		self.assertEqual(checkpoints.get('cdc_PLANTS'), _lsn(2))
+		self.assertEqual(checkpoints.upsertUntil('cdc_PLANTS'), _lsn(5))
+		checkpoints.set('cdc_PLANTS', _lsn(5))
+		self.assertEqual(checkpoints.upsertUntil('cdc_PLANTS'), _lsn(5))
+		checkpoints.set('cdc_PLANTS', _lsn(6))
+		self.assertIsNone(checkpoints.upsertUntil('cdc_PLANTS'))
+		self.assertEqual(checkpoints.get('cdc_PLANTS'), _lsn(6))
+
+	#A resync with no changes captured since the rows were read marks the next window.
+	def test_mark_at_checkpoint(self):
+		checkpoints = util.CheckpointStore(self.path)
+		checkpoints.set('cdc_PLANTS', _lsn(2), _lsn(2))
+		self.assertEqual(checkpoints.upsertUntil('cdc_PLANTS'), _lsn(2))
+		self.assertIsNone(checkpoints.upsertUntil('cdc_PLANTS_OBS'))
+
+###################################################################################################
+###################################################################################################
+#
+# class:	ReplaceFileTest
+# purpose:	replaceFile keeps the old file until the new one is in place where the OS cannot
+#			rename over it, and existingFile finds the backup of an interrupted replace.
+#
+###################################################################################################
+
+class ReplaceFileTest(unittest.TestCase):
+	def setUp(self):
+		self.workdir = tempfile.mkdtemp(prefix = 'bgtest')
+		self.path = os.path.join(self.workdir, 'state.json')
+		self.temp = self.path + '.tmp'
+		_write(self.path, 'old')
+		_write(self.temp, 'new')
+
+	def tearDown(self):
+		util.os = os
+		shutil.rmtree(self.workdir, True)
+
+	def test_replace(self):
+		util.replaceFile(self.temp, self.path)
+		self.assertEqual(_read(self.path), 'new')
+		self.assertEqual(sorted(os.listdir(self.workdir)), ['state.json'])
+
+	def test_replace_on_windows(self):
+		util.os = _WindowsOs()
+		util.replaceFile(self.temp, self.path)
+		self.assertEqual(_read(self.path), 'new')
+		self.assertEqual(sorted(os.listdir(self.workdir)), ['state.json'])
+
+	def test_failed_replace_on_windows(self):
+		util.os = _WindowsOs()
+		util.os.failing.add(self.temp)
+		self.assertRaises(OSError, util.replaceFile, self.temp, self.path)
+		self.assertEqual(_read(self.path), 'old')
+		self.assertFalse(os.path.exists(self.path + '.bak'))
+
+	#The process stopped after the checkpoint file was renamed to its backup.
+	def test_interrupted_replace(self):
+		checkpoints = util.CheckpointStore(self.path + '.json')
+		checkpoints.set('cdc_PLANTS', _lsn(2))
+		checkpoints.save()
+		os.rename(self.path + '.json', self.path + '.json.bak')
+		self.assertEqual(util.existingFile(self.path + '.json'), self.path + '.json.bak')
+		self.assertEqual(util.CheckpointStore(self.path + '.json').get('cdc_PLANTS'), _lsn(2))
+		self.assertIsNone(util.existingFile(os.path.join(self.workdir, 'missing')))
+
+if __name__ == '__main__':
+	unittest.main()